@@ -4,8 +4,12 @@ from dotenv import load_dotenv
 import streamlit as st
 from langchain_core.messages import AIMessage, HumanMessage
 
-from graph import invoke_our_graph
+from chat_history import message_markdown, render_chat_history  # Paginated chat history rendering
+from llm_clients import warm_up  # Opens the pooled connection to the model provider ahead of the first turn
+from preload import preload  # Imports and builds the graph in the background once the page is drawn
+from run_control import RunCancelled, RunControl  # Cancels a running graph on a Stop click or a newer prompt
 from st_callable_util import get_streamlit_cb  # Utility function to get a Streamlit callback handler with context
+from turn_metrics import TurnMetrics, render_metrics_panel, report_turn  # Per-turn timings and their export
 
 load_dotenv()
 
@@ -32,18 +36,24 @@ if not os.getenv('OPENAI_API_KEY'):
         st.info("Please enter your OPENAI_API_KEY in the sidebar.")
         st.stop()
 
+# Open a keep-alive connection in the background (once per process) so the first prompt skips the TLS handshake
+warm_up()
+
 if "messages" not in st.session_state:
     # default initial message to render in message state
     st.session_state["messages"] = [AIMessage(content="How can I help you?")]
 
-# Loop through all messages in the session state and render them as a chat on every st.refresh mech
-for msg in st.session_state.messages:
+# Render the newest turns of the chat on every st.refresh mech, earlier turns are loaded on demand
+def render_message(index, msg):
     # https://docs.streamlit.io/develop/api-reference/chat/st.chat_message
     # we store them as AIMessage and HumanMessage as its easier to send to LangGraph
     if type(msg) == AIMessage:
-        st.chat_message("assistant").write(msg.content)
+        st.chat_message("assistant").write(message_markdown(msg))
     if type(msg) == HumanMessage:
-        st.chat_message("user").write(msg.content)
+        st.chat_message("user").write(message_markdown(msg))
+
+
+render_chat_history(st.session_state.messages, render_message)
 
 # takes new input in chat box from user and invokes the graph
 if prompt := st.chat_input():
@@ -55,7 +65,28 @@ if prompt := st.chat_input():
         msg_placeholder = st.empty()  # Placeholder for visually updating AI's response after events end
         # create a new placeholder for streaming messages and other events, and give it context
         st_callback = get_streamlit_cb(st.empty())
-        response = invoke_our_graph(st.session_state.messages, [st_callback])
-        last_msg = response["messages"][-1].content
-        st.session_state.messages.append(AIMessage(content=last_msg))  # Add that last message to the st_message_state
+        stop_placeholder = st.empty()
+        # clicking Stop reruns the script, which cancels the run and keeps the answer streamed so far
+        stop_placeholder.button("Stop", key="stop_generation")
+        from graph import invoke_our_graph  # usually preloaded already, see the end of the script
+        metrics = TurnMetrics()  # node, model, tool and render timings of this turn
+        control = RunControl()  # cancels the run on a Stop click, a newer prompt or the user leaving
+        try:
+            response = invoke_our_graph(st.session_state.messages, [st_callback], metrics, control)
+            last_msg = response["messages"][-1].content
+        except RunCancelled:
+            last_msg = control.partial_text  # the tokens streamed before the run was cancelled
+        stop_placeholder.empty()
+        report_turn(metrics)  # exported to the metrics endpoint and the JSONL sink if enabled
+        st.session_state.turn_metrics = metrics
+        if last_msg:
+            st.session_state.messages.append(AIMessage(content=last_msg))  # Add that last message to the st_message_state
         msg_placeholder.write(last_msg) # visually refresh the complete response after the callback container
+        control.resume()  # carries out the rerun or stop that cancelled the run, now that its answer is saved
+
+# Optional sidebar panel with the timings of the last turn
+render_metrics_panel(st.session_state.get("turn_metrics"))
+
+# The page is drawn, import the graph and build it in the background (once per process) ahead of the first prompt
+preload("graph", "get_graph_runnable")
+preload("remote_graph", "start_graph_workers")  # the worker processes, if GRAPH_WORKERS is set
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence
+
+import tiktoken
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from llm_clients import get_chat_model
+from rate_limiter import BACKGROUND, invoke_rate_limited
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an AI assistant.
+Keep names, facts, decisions, tool results and open questions that later turns may refer to, and be concise.
+
+Summary so far:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+
+@lru_cache(maxsize=None)
+def _encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:  # the encoding is downloaded on first use, offline hosts fall back to an estimate
+        return None
+
+
+def _message_key(message: BaseMessage) -> str:
+    """
+    Identifies a message across turns by what it says rather than its id, the messages a remote graph run gets
+    from the session come without ids and get fresh ones on every turn, see remote_graph.dump_messages.
+    """
+    raw = json.dumps([message.type, message.content, getattr(message, "tool_calls", None),
+                      getattr(message, "tool_call_id", None)], default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    """
+    Estimates the tokens a message takes up in the prompt, including its tool calls.
+    Args:
+        message (BaseMessage): The message to count.
+    Returns:
+        int: The estimated number of tokens.
+    """
+    text = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    if getattr(message, "tool_calls", None):
+        text += json.dumps(message.tool_calls)
+    encoding = _encoding()
+    tokens = len(encoding.encode(text)) if encoding else len(text) // 4
+    return tokens + 4  # role and separators of the chat format
+
+
+def _format_messages(messages: Sequence[BaseMessage]) -> str:
+    return "\n".join(f"{m.type}: {m.content}" for m in messages if m.content)
+
+
+class ContextWindow:
+    """
+    Keeps the prompt of every model call within a token budget. The leading system messages and the
+    most recent turns are sent verbatim, older turns are folded into a rolling summary.
+    Token counts are cached per message and summaries per folded history prefix, so a new turn
+    only counts its new messages and only summarizes the messages that just fell out of the window.
+    """
+
+    def __init__(self, max_tokens: int = 8000, summary_tokens: int = 512,
+                 token_counter: Callable[[BaseMessage], int] = count_message_tokens,
+                 summarizer: Optional[Callable[[str, Sequence[BaseMessage]], str]] = None,
+                 max_cached: int = 4096):
+        """
+        Initializes the ContextWindow.
+        Args:
+            max_tokens (int): Token budget of the messages sent to the model.
+            summary_tokens (int): Part of the budget reserved for the summary of older turns.
+            token_counter (Callable[[BaseMessage], int]): Counts the tokens of one message.
+            summarizer (Optional[Callable[[str, Sequence[BaseMessage]], str]]): Folds new messages into a
+                summary, defaults to asking the chat model.
+            max_cached (int): Maximum number of token counts and summaries kept.
+        """
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.token_counter = token_counter
+        self.summarizer = summarizer or self.summarize_with_model
+        self.max_cached = max_cached
+        self._token_counts: "OrderedDict[str, int]" = OrderedDict()
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()  # digest of a folded prefix -> its summary
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def summarize_with_model(summary: str, messages: Sequence[BaseMessage]) -> str:
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(empty)", messages=_format_messages(messages))
+        llm = get_chat_model(temperature=0.0, streaming=False)
+        # no callbacks, the summary must not stream into the chat like an answer, and it queues behind the answers
+        return invoke_rate_limited(llm, [HumanMessage(content=prompt)], BACKGROUND, config={"callbacks": []}).content
+
+    def _remember(self, cache: OrderedDict, key: str, value) -> None:
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_cached:
+                cache.popitem(last=False)
+
+    def count_tokens(self, message: BaseMessage) -> int:
+        """
+        Returns the token count of a message, counting each message only once.
+        """
+        key = _message_key(message)
+        with self._lock:
+            count = self._token_counts.get(key)
+        if count is None:
+            count = self.token_counter(message)
+            self._remember(self._token_counts, key, count)
+        return count
+
+    def _summarize(self, folded: Sequence[BaseMessage]) -> str:
+        """
+        Returns the summary of `folded`, extending the summary of its longest already summarized prefix.
+        """
+        digests = []
+        running = hashlib.sha1()
+        for message in folded:
+            running.update(_message_key(message).encode())
+            digests.append(running.hexdigest())
+
+        start, summary = 0, ""
+        with self._lock:
+            for i in range(len(digests) - 1, -1, -1):
+                if digests[i] in self._summaries:
+                    start, summary = i + 1, self._summaries[digests[i]]
+                    self._summaries.move_to_end(digests[i])
+                    break
+        if start < len(folded):
+            summary = self.summarizer(summary, folded[start:])
+            self._remember(self._summaries, digests[-1], summary)
+        return summary
+
+    def fit(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        """
+        Returns the messages to send to the model, within the token budget.
+        Args:
+            messages (Sequence[BaseMessage]): The full message history of the graph state.
+        Returns:
+            List[BaseMessage]: Leading system messages, a summary of older turns if any, and the recent turns.
+        """
+        messages = list(messages)
+        head = 0
+        while head < len(messages) and isinstance(messages[head], SystemMessage):
+            head += 1
+        counts = [self.count_tokens(m) for m in messages]
+        if sum(counts) <= self.max_tokens:
+            return messages
+
+        # walk back from the newest message while the recent turns fit next to the system prompt and summary
+        budget = self.max_tokens - self.summary_tokens - sum(counts[:head])
+        start = len(messages)
+        while start > head and counts[start - 1] <= budget:
+            budget -= counts[start - 1]
+            start -= 1
+        # only cut at the start of a user turn, so tool calls and their results stay together
+        cut = next((i for i in range(start, len(messages)) if isinstance(messages[i], HumanMessage)), None)
+        if cut is None:  # the current turn alone is over budget, it is still sent whole
+            cut = max((i for i in range(head, len(messages)) if isinstance(messages[i], HumanMessage)), default=head)
+        if cut <= head:
+            return messages
+
+        summary = self._summarize(messages[head:cut])
+        summary_message = SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")
+        return messages[:head] + [summary_message] + messages[cut:]
+
+
+@lru_cache(maxsize=None)
+def get_context_window() -> ContextWindow:
+    """
+    Returns the process-wide ContextWindow, its budget is read from CONTEXT_MAX_TOKENS on first use
+    as the apps load their .env after importing the graph.
+    Returns:
+        ContextWindow: The shared context window manager.
+    """
+    return ContextWindow(max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "8000")))
@@ -1,20 +1,29 @@
-from typing import Annotated, TypedDict, Literal
+import os
+from functools import lru_cache
+from typing import Annotated, List, TypedDict, Literal
 
 from langgraph.prebuilt import ToolNode
-from langchain_core.tools import tool, StructuredTool
+from langchain_core.tools import BaseTool, tool, StructuredTool
 from langgraph.graph import START, StateGraph
 from langgraph.graph.message import AnyMessage, add_messages
-from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
-from langchain_openai import ChatOpenAI
-
-# Define a search tool using DuckDuckGo API wrapper
-search_DDG = StructuredTool.from_function(
-        name="Search",
-        func=DuckDuckGoSearchAPIWrapper().run,  # Executes DuckDuckGo search using the provided query
-        description=f"""
-        useful for when you need to answer questions about current events. You should ask targeted questions
-        """,
-    )
+
+from context_window import get_context_window
+from llm_clients import get_chat_model_with_tools
+from remote_graph import invoke_remote, session_id, use_remote_graph
+from response_cache import invoke_with_cache
+from run_control import CancelCallbackHandler
+from tool_cache import with_tool_cache
+from tool_guard import with_tool_guard
+from turn_metrics import MetricsCallbackHandler, time_rendering
+
+@lru_cache(maxsize=None)
+def _search_api():
+    # langchain_community and the DuckDuckGo client are imported and set up by the first search, not at import
+    from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+    return DuckDuckGoSearchAPIWrapper()
+
+def _search(query: str) -> str:
+    return _search_api().run(query)  # Executes DuckDuckGo search using the provided query
 
 @tool
 def get_weather(location: str):
@@ -31,17 +40,35 @@ def get_coolest_cities():
     # Hardcoded response with a list of cool cities
     return "nyc, sf"
 
-# List of tools that will be accessible to the graph via the ToolNode
-tools = [get_weather, get_coolest_cities, search_DDG]
-tool_node = ToolNode(tools)
+@lru_cache(maxsize=None)
+def get_tools() -> List[BaseTool]:
+    """
+    Returns the tools that will be accessible to the graph via the ToolNode, built once per process on first use.
+    Search results are cached for a while and identical concurrent searches share one outbound call.
+    A slow search gets a hedged duplicate and ends at its deadline, SEARCH_DEADLINE_SECONDS, with an error the model
+    answers around, after repeated failures the search is paused for a while.
+    Returns:
+        List[BaseTool]: The tools of the graph.
+    """
+    # Define a search tool using DuckDuckGo API wrapper
+    search_DDG = StructuredTool.from_function(
+            name="Search",
+            func=_search,
+            description=f"""
+            useful for when you need to answer questions about current events. You should ask targeted questions
+            """,
+        )
+    # guarded inside the cache, the cache would join the hedged duplicate of a search to the search itself
+    tools = with_tool_guard([get_weather, get_coolest_cities, search_DDG],
+                            deadline_seconds={"Search": float(os.getenv("SEARCH_DEADLINE_SECONDS", "10"))},
+                            hedged={"Search"})
+    return with_tool_cache(tools, ttl_seconds={"Search": 10 * 60})
 
 # This is the default state same as "MessageState" TypedDict but allows us accessibility to custom keys
 class GraphsState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     # Custom keys for additional data can be added here such as - conversation_id: str
 
-graph = StateGraph(GraphsState)
-
 # Function to decide whether to continue tool usage or end the process
 def should_continue(state: GraphsState) -> Literal["tools", "__end__"]:
     messages = state["messages"]
@@ -52,33 +79,56 @@ def should_continue(state: GraphsState) -> Literal["tools", "__end__"]:
 
 # Core invocation of the model
 def _call_model(state: GraphsState):
-    messages = state["messages"]
-    llm = ChatOpenAI(
-        temperature=0.7,
-        streaming=True,
-    ).bind_tools(tools)
-    response = llm.invoke(messages)
+    # recent turns are sent verbatim, older ones are folded into a rolling summary to stay within budget
+    messages = get_context_window().fit(state["messages"])
+    # shared per process, the tool schemas are converted once and the pooled HTTP client is reused
+    llm = get_chat_model_with_tools(get_tools(), temperature=0.7, streaming=True)
+    response = invoke_with_cache(llm, messages)  # replays a cached answer if the opt-in cache is enabled
     return {"messages": [response]}  # add the response to the messages using LangGraph reducer paradigm
 
-# Define the structure (nodes and directional edges between nodes) of the graph
-graph.add_edge(START, "modelNode")
-graph.add_node("tools", tool_node)
-graph.add_node("modelNode", _call_model)
+@lru_cache(maxsize=None)
+def get_graph_runnable():
+    """
+    Returns the compiled graph, built once per process on the first call and shared by every session and rerun.
+    The app imports this module after drawing the page, so neither the imports nor the build delay the first paint.
+    Returns:
+        CompiledStateGraph: The runnable graph.
+    """
+    graph = StateGraph(GraphsState)
+
+    # Define the structure (nodes and directional edges between nodes) of the graph
+    graph.add_edge(START, "modelNode")
+    graph.add_node("tools", ToolNode(get_tools()))
+    graph.add_node("modelNode", _call_model)
+
+    # Add conditional logic to determine the next step based on the state (to continue or to end)
+    graph.add_conditional_edges(
+        "modelNode",
+        should_continue,  # This function will decide the flow of execution
+    )
+    graph.add_edge("tools", "modelNode")
+
+    # Compile the state graph into a runnable object
+    return graph.compile()
 
-# Add conditional logic to determine the next step based on the state (to continue or to end)
-graph.add_conditional_edges(
-    "modelNode",
-    should_continue,  # This function will decide the flow of execution
-)
-graph.add_edge("tools", "modelNode")
+def _graph_invoke():
+    # with GRAPH_SERVER_URL or GRAPH_WORKERS set the graph runs on the graph server or a worker process,
+    # its callbacks reach the handlers all the same
+    return invoke_remote if use_remote_graph() else get_graph_runnable().invoke
 
-# Compile the state graph into a runnable object
-graph_runnable = graph.compile()
+def _graph_config(callables):
+    # the rate limiter, if enabled, queues the model calls of the run under the Streamlit session
+    return {"callbacks": callables, "metadata": {"session_id": session_id()}}
 
 # Function to invoke the compiled graph externally
-def invoke_our_graph(st_messages, callables):
+def invoke_our_graph(st_messages, callables, metrics=None, control=None):
     # Ensure the callables parameter is a list as you can have multiple callbacks
     if not isinstance(callables, list):
         raise TypeError("callables must be a list")
+    if metrics is not None:  # time the nodes, model, tools and the rendering callbacks of this turn
+        callables = [time_rendering(cb, metrics) for cb in callables] + [MetricsCallbackHandler(metrics)]
+    if control is not None:  # a Stop click or a newer prompt cancels the run, the caller keeps the partial answer
+        callables = [CancelCallbackHandler(control)] + callables
+        return control.run(_graph_invoke(), {"messages": st_messages}, config=_graph_config(callables))
     # Invoke the graph with the current messages and callback configuration
-    return graph_runnable.invoke({"messages": st_messages}, config={"callbacks": callables})
+    return _graph_invoke()({"messages": st_messages}, config=_graph_config(callables))
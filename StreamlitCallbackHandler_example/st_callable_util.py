@@ -1,11 +1,91 @@
-from typing import Callable, TypeVar
+from typing import Callable, Type, TypeVar
+import functools
 import inspect
+import threading
 
 from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
 from streamlit.delta_generator import DeltaGenerator
 
-from langchain_core.callbacks.base import BaseCallbackHandler
-from langchain_community.callbacks.streamlit import StreamlitCallbackHandler
+from langchain_core.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain_community.callbacks.streamlit.streamlit_callback_handler import StreamlitCallbackHandler
+
+# Type of a wrapped method's result and of a decorated handler class
+T = TypeVar("T")
+H = TypeVar("H", bound=BaseCallbackHandler)
+
+
+def _attach_script_run_ctx(ctx) -> None:
+    thread = threading.current_thread()
+    # attached once per thread and session, every later call only compares the thread's attribute
+    if getattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None) is not ctx:
+        add_script_run_ctx(thread, ctx)
+
+
+def _in_script_run_ctx(fn: Callable[..., T]) -> Callable[..., T]:
+    """
+    Wraps a callback method so it runs with the handler's script run context attached to the calling thread.
+
+    Args:
+        fn (Callable[..., T]): The callback method, its handler has the context in `script_run_ctx`.
+    Returns:
+        Callable[..., T]: The wrapped method.
+    """
+    if inspect.iscoroutinefunction(fn):
+        # a coroutine callback renders before its first await, no other session's callback runs in between
+        @functools.wraps(fn)
+        async def async_wrapper(self, *args, **kwargs) -> T:
+            _attach_script_run_ctx(self.script_run_ctx)
+            return await fn(self, *args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs) -> T:
+        _attach_script_run_ctx(self.script_run_ctx)
+        return fn(self, *args, **kwargs)
+
+    return wrapper
+
+
+def with_script_run_ctx(cls: Type[H]) -> Type[H]:
+    """
+    Class decorator for a callback handler that renders from the threads LangChain runs callbacks on.
+    Wraps the `on_*` methods the handler implements, once when the class is defined instead of for every
+    handler instance, so Streamlit calls in them find the session of the script that created the handler.
+    Fixes the NoSessionContext() error of Streamlit calls in callbacks.
+
+    Args:
+        cls (Type[H]): The handler class, its instances set `script_run_ctx` to the script's context.
+    Returns:
+        Type[H]: The same class.
+    """
+    for name, fn in inspect.getmembers(cls, predicate=inspect.isfunction):
+        # the no-op methods of the base handlers render nothing and stay unwrapped
+        if (name.startswith("on_") and not hasattr(fn, "__wrapped__")  # not wrapped for a base class already
+                and fn not in (getattr(BaseCallbackHandler, name, None), getattr(AsyncCallbackHandler, name, None))):
+            setattr(cls, name, _in_script_run_ctx(fn))
+    return cls
+
+
+# Streamlit's StreamlitCallbackHandler with all its callback methods run within the Streamlit execution context
+@with_script_run_ctx
+class ContextStreamlitCallbackHandler(StreamlitCallbackHandler):
+    """
+    StreamlitCallbackHandler whose callbacks render into the session of the script that created it,
+    from whichever thread LangChain runs them on.
+    """
+
+    def __init__(self, parent_container: DeltaGenerator, **kwargs):
+        """
+        Initializes the handler, see StreamlitCallbackHandler for the keyword arguments.
+
+        Args:
+            parent_container (DeltaGenerator): The Streamlit container where the text will be rendered.
+        """
+        super().__init__(parent_container, **kwargs)
+        # attached to the threads LangChain calls back on, see with_script_run_ctx
+        self.script_run_ctx = get_script_run_ctx()
 
 
 # Define a function to wrap and add context to Streamlit's integration with LangGraph
@@ -24,56 +104,5 @@ def get_streamlit_cb(parent_container: DeltaGenerator) -> BaseCallbackHandler:
         BaseCallbackHandler: An instance of StreamlitCallbackHandler configured for full integration
                              with ChatLLM, enabling dynamic updates in the Streamlit app.
     """
-
-    # Define a type variable for generic type hinting in the decorator, ensuring the original
-    # function and wrapped function maintain the same return type.
-    fn_return_type = TypeVar('fn_return_type')
-
-    # Decorator function to add Streamlit's execution context to a function
-    def add_streamlit_context(fn: Callable[..., fn_return_type]) -> Callable[..., fn_return_type]:
-        """
-        Decorator to ensure that the decorated function runs within the Streamlit execution context.
-        This is necessary for interacting with Streamlit components from within callback functions
-        and prevents the NoSessionContext() error by adding the correct session context.
-
-        Args:
-            fn (Callable[..., fn_return_type]): The function to be decorated, typically a callback method.
-        Returns:
-            Callable[..., fn_return_type]: The decorated function that includes the Streamlit context setup.
-        """
-        # Retrieve the current Streamlit script execution context.
-        # This context holds session information necessary for Streamlit operations.
-        ctx = get_script_run_ctx()
-
-        def wrapper(*args, **kwargs) -> fn_return_type:
-            """
-            Wrapper function that adds the Streamlit context and then calls the original function.
-            If the Streamlit context is not set, it can lead to NoSessionContext() errors, which this
-            wrapper resolves by ensuring that the correct context is used when the function runs.
-
-            Args:
-                *args: Positional arguments to pass to the original function.
-                **kwargs: Keyword arguments to pass to the original function.
-            Returns:
-                fn_return_type: The result from the original function.
-            """
-            # Add the previously captured Streamlit context to the current execution.
-            # This step fixes NoSessionContext() errors by ensuring that Streamlit knows which session
-            # is executing the code, allowing it to properly manage session state and updates.
-            add_script_run_ctx(ctx=ctx)
-            return fn(*args, **kwargs)  # Call the original function with its arguments
-
-        return wrapper
-
-    # Create an instance of Streamlit's StreamlitCallbackHandler with the provided Streamlit container
-    st_cb = StreamlitCallbackHandler(parent_container)
-
-    # Iterate over all methods of the StreamlitCallbackHandler instance
-    for method_name, method_func in inspect.getmembers(st_cb, predicate=inspect.ismethod):
-        if method_name.startswith('on_'):  # Identify callback methods that respond to LLM events
-            # Wrap each callback method with the Streamlit context setup to prevent session errors
-            setattr(st_cb, method_name,
-                    add_streamlit_context(method_func))  # Replace the method with the wrapped version
-
-    # Return the fully configured StreamlitCallbackHandler instance, now context-aware and integrated with any ChatLLM
-    return st_cb
\ No newline at end of file
+    # Return the StreamlitCallbackHandler, context-aware and integrated with any ChatLLM
+    return ContextStreamlitCallbackHandler(parent_container)
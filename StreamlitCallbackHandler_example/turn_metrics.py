@@ -0,0 +1,362 @@
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from uuid import UUID
+
+import streamlit as st
+from langchain_core.callbacks.base import BaseCallbackHandler
+
+# Custom callback event the rate limiter dispatches with the seconds a model call waited, see rate_limiter.py
+RATE_LIMIT_EVENT = "rate_limit_wait"
+
+logger = logging.getLogger(__name__)
+
+
+def _is_node_run(tags: Optional[List[str]]) -> bool:
+    # LangGraph tags the run of every node, and only those, with the superstep it ran in
+    return any(tag.startswith("graph:step:") for tag in tags or ())
+
+
+class TurnMetrics:
+    """
+    Timings of one graph turn: wall time per node, time to first token and tokens per second of the
+    model, latency per tool call, the time the model calls waited for the rate limiter and the time the Streamlit
+    handler spent rendering.
+    Callbacks of parallel tool calls report from several threads, so every update takes the lock.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.node_seconds: Dict[str, float] = defaultdict(float)  # summed over the node's runs in this turn
+        self.tool_calls: List[Tuple[str, float]] = []  # (tool name, seconds) in the order they finished
+        self.first_token_at: Optional[float] = None
+        self.tokens = 0
+        self.streaming_seconds = 0.0  # first to last token of every model call
+        self.render_seconds = 0.0
+        self.queue_seconds = 0.0  # model calls waiting for the rate limiter, part of the time to first token
+        self._running: Dict[Any, Tuple[str, float]] = {}  # run_id -> (node or tool name, start)
+        self._llm_first_token: Dict[Any, float] = {}
+        self._llm_last_token: Dict[Any, float] = {}
+        self._lock = threading.Lock()
+
+    def node_start(self, run_id: Any, name: str) -> None:
+        with self._lock:
+            self._running[("node", run_id)] = (name, time.perf_counter())
+
+    def node_end(self, run_id: Any) -> None:
+        with self._lock:
+            name, start = self._running.pop(("node", run_id), (None, None))
+            if name is not None:
+                self.node_seconds[name] += time.perf_counter() - start
+
+    def tool_start(self, run_id: Any, name: str) -> None:
+        with self._lock:
+            self._running[("tool", run_id)] = (name, time.perf_counter())
+
+    def tool_end(self, run_id: Any) -> None:
+        with self._lock:
+            name, start = self._running.pop(("tool", run_id), (None, None))
+            if name is not None:
+                self.tool_calls.append((name, time.perf_counter() - start))
+
+    def llm_token(self, run_id: Any) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            if self.first_token_at is None:
+                self.first_token_at = now
+            self._llm_first_token.setdefault(run_id, now)
+            self._llm_last_token[run_id] = now
+            self.tokens += 1
+
+    def llm_end(self, run_id: Any) -> None:
+        with self._lock:
+            if run_id in self._llm_first_token:
+                self.streaming_seconds += self._llm_last_token.pop(run_id) - self._llm_first_token.pop(run_id)
+
+    def add_queue_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.queue_seconds += seconds
+
+    def add_render(self, seconds: float) -> None:
+        with self._lock:
+            self.render_seconds += seconds
+
+    def finish(self) -> None:
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return None if self.first_token_at is None else self.first_token_at - self.started_at
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        return self.tokens / self.streaming_seconds if self.streaming_seconds else None
+
+    @property
+    def total_seconds(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "total_seconds": self.total_seconds,
+                "ttft_seconds": self.ttft,
+                "tokens": self.tokens,
+                "tokens_per_second": self.tokens_per_second,
+                "render_seconds": self.render_seconds,
+                "queue_seconds": self.queue_seconds,
+                "node_seconds": dict(self.node_seconds),
+                "tool_calls": [{"tool": name, "seconds": seconds} for name, seconds in self.tool_calls],
+            }
+
+
+class QueueWaitHandler(BaseCallbackHandler):
+    """
+    Callback handler that adds the waits for the rate limiter to a TurnMetrics, for runs timed from their events.
+    """
+
+    run_inline = True  # it only takes timestamps, an async run calls it on the event loop instead of a thread pool
+
+    def __init__(self, metrics: TurnMetrics):
+        self.metrics = metrics
+
+    def on_custom_event(self, name: str, data: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if name == RATE_LIMIT_EVENT:
+            self.metrics.add_queue_wait(data["seconds"])
+
+
+class MetricsCallbackHandler(QueueWaitHandler):
+    """
+    Callback handler that feeds a TurnMetrics, add it to the graph's callbacks next to the StreamHandler.
+    """
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Any, *, run_id: UUID,
+                       tags: Optional[List[str]] = None, metadata: Optional[Dict[str, Any]] = None,
+                       **kwargs: Any) -> None:
+        if _is_node_run(tags):
+            self.metrics.node_start(run_id, kwargs.get("name") or (metadata or {}).get("langgraph_node"))
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.metrics.node_end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.metrics.node_end(run_id)  # NodeInterrupt ends a node with an error
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if token:  # tool call chunks come with an empty token
+            self.metrics.llm_token(run_id)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.metrics.llm_end(run_id)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self.metrics.tool_start(run_id, serialized.get("name") or kwargs.get("name"))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.metrics.tool_end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.metrics.tool_end(run_id)
+
+
+def time_rendering(handler: BaseCallbackHandler, metrics: TurnMetrics) -> BaseCallbackHandler:
+    """
+    Wraps the callback methods of a rendering handler, e.g. the StreamHandler, so their time counts as render time.
+    A handler that queues its events is timed where it renders them, in its `render_events`.
+    Args:
+        handler (BaseCallbackHandler): The handler to time, its methods are replaced on the instance.
+        metrics (TurnMetrics): The metrics of the current turn.
+    Returns:
+        BaseCallbackHandler: The same handler.
+    """
+    def timed(fn):
+        if inspect.iscoroutinefunction(fn):  # an async handler's methods stay awaitable
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    metrics.add_render(time.perf_counter() - start)
+            return async_wrapper
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.add_render(time.perf_counter() - start)
+        return wrapper
+
+    for name in dir(handler):
+        if (name.startswith("on_") or name == "render_events") and callable(getattr(handler, name)):
+            setattr(handler, name, timed(getattr(handler, name)))
+    return handler
+
+
+async def observe_events(events: AsyncIterator[Dict[str, Any]],
+                         metrics: TurnMetrics) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Passes an astream_events stream through unchanged while feeding a TurnMetrics from it.
+    The time the consumer spends between two events, handling the previous one, counts as render time.
+    Args:
+        events (AsyncIterator[Dict[str, Any]]): The events of `astream_events(..., version="v2")`.
+        metrics (TurnMetrics): The metrics of the current turn.
+    Returns:
+        AsyncIterator[Dict[str, Any]]: The same events.
+    """
+    async for event in events:
+        kind, run_id = event["event"], event.get("run_id")
+        if kind == "on_chain_start" and _is_node_run(event.get("tags")):
+            metrics.node_start(run_id, event["name"])
+        elif kind == "on_chain_end":
+            metrics.node_end(run_id)
+        elif kind == "on_chat_model_stream" and event["data"]["chunk"].content:
+            metrics.llm_token(run_id)
+        elif kind == "on_chat_model_end":
+            metrics.llm_end(run_id)
+        elif kind == "on_tool_start":
+            metrics.tool_start(run_id, event["name"])
+        elif kind == "on_tool_end":
+            metrics.tool_end(run_id)
+        elif kind == "on_custom_event" and event["name"] == RATE_LIMIT_EVENT:
+            metrics.add_queue_wait(event["data"]["seconds"])
+        start = time.perf_counter()
+        yield event
+        metrics.add_render(time.perf_counter() - start)
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    Process-wide totals over all finished turns, exposed in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.turns = 0
+        self.tokens = 0
+        self.sums: Dict[Tuple[str, str, str], float] = defaultdict(float)  # (metric, label name, label) -> sum
+        self.counts: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _observe(self, metric: str, seconds: Optional[float], label: Tuple[str, str] = ("", "")) -> None:
+        if seconds is not None:
+            self.sums[(metric, *label)] += seconds
+            self.counts[(metric, *label)] += 1
+
+    def observe(self, metrics: TurnMetrics) -> None:
+        turn = metrics.to_dict()
+        with self._lock:
+            self.turns += 1
+            self.tokens += turn["tokens"]
+            self._observe("graph_turn_seconds", turn["total_seconds"])
+            self._observe("graph_ttft_seconds", turn["ttft_seconds"])
+            self._observe("graph_render_seconds", turn["render_seconds"])
+            self._observe("graph_queue_seconds", turn["queue_seconds"])
+            for node, seconds in turn["node_seconds"].items():
+                self._observe("graph_node_seconds", seconds, ("node", node))
+            for call in turn["tool_calls"]:
+                self._observe("graph_tool_seconds", call["seconds"], ("tool", call["tool"]))
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            lines = ["# TYPE graph_turns_total counter", f"graph_turns_total {self.turns}",
+                     "# TYPE graph_tokens_total counter", f"graph_tokens_total {self.tokens}"]
+            for metric in sorted({key[0] for key in self.sums}):
+                lines.append(f"# TYPE {metric} summary")
+                for key in sorted(k for k in self.sums if k[0] == metric):
+                    labels = f'{{{key[1]}="{_label(key[2])}"}}' if key[1] else ""
+                    lines.append(f"{metric}_sum{labels} {self.sums[key]}")
+                    lines.append(f"{metric}_count{labels} {self.counts[key]}")
+        return "\n".join(lines) + "\n"
+
+
+def _serve_metrics(registry: MetricsRegistry, host: str, port: int) -> None:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # scrapes would flood the Streamlit log
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:  # e.g. a second app process on the same port
+        logger.warning("metrics endpoint not started on %s:%s: %s", host, port, e)
+        return
+    threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True).start()
+
+
+@lru_cache(maxsize=None)
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Returns the process-wide MetricsRegistry. If METRICS_PORT is set its totals are served at
+    http://METRICS_HOST:METRICS_PORT/metrics, METRICS_HOST defaults to 127.0.0.1.
+    Read on first use rather than at import, the apps load their .env after importing the graph.
+    Returns:
+        MetricsRegistry: The shared registry.
+    """
+    registry = MetricsRegistry()
+    if os.getenv("METRICS_PORT"):
+        _serve_metrics(registry, os.getenv("METRICS_HOST", "127.0.0.1"), int(os.getenv("METRICS_PORT")))
+    return registry
+
+
+_jsonl_lock = threading.Lock()
+
+
+def report_turn(metrics: TurnMetrics) -> None:
+    """
+    Finishes a turn's metrics and exports them, to the registry and, if METRICS_JSONL is set, as a line of that file.
+    Args:
+        metrics (TurnMetrics): The metrics of the finished turn.
+    """
+    metrics.finish()
+    get_metrics_registry().observe(metrics)
+    if os.getenv("METRICS_JSONL"):
+        line = json.dumps(metrics.to_dict())
+        with _jsonl_lock, open(os.getenv("METRICS_JSONL"), "a") as f:
+            f.write(line + "\n")
+
+
+def render_metrics_panel(metrics: Optional[TurnMetrics]) -> None:
+    """
+    Renders an optional sidebar panel with the timings of the last turn, switched on with a toggle.
+    Args:
+        metrics (Optional[TurnMetrics]): The metrics of the last turn, None before the first turn.
+    """
+    if not st.sidebar.toggle("Show turn timings", key="show_turn_metrics") or metrics is None:
+        return
+    turn = metrics.to_dict()
+    ms = lambda seconds: "–" if seconds is None else f"{seconds * 1000:,.0f} ms"
+    st.sidebar.metric("Turn", ms(turn["total_seconds"]))
+    first, second = st.sidebar.columns(2)
+    first.metric("Time to first token", ms(turn["ttft_seconds"]))
+    second.metric("Tokens / s", "–" if turn["tokens_per_second"] is None else f"{turn['tokens_per_second']:,.0f}")
+    first.metric("Rendering", ms(turn["render_seconds"]))
+    second.metric("Tokens", turn["tokens"])
+    first.metric("Rate limited", ms(turn["queue_seconds"]))
+    rows = [{"step": f"node {node}", "time": ms(seconds)} for node, seconds in turn["node_seconds"].items()]
+    rows += [{"step": f"tool {call['tool']}", "time": ms(call["seconds"])} for call in turn["tool_calls"]]
+    if rows:
+        st.sidebar.dataframe(rows, hide_index=True)
@@ -0,0 +1,167 @@
+"""
+Measures the latency of every streamed token from its callback dispatch to the handler that renders it.
+
+Runs the graph of simple_streaming with a deterministic fake chat model, its handler in
+  sync inline       StreamHandler, graph.invoke, LangChain calls it on the graph's worker thread
+  sync in async     StreamHandler, graph.ainvoke on the shared event loop, every token goes to a thread pool
+  sync queued       StreamHandler with a RenderQueue, the script thread renders what the run queued
+  async             AsyncStreamHandler, graph.ainvoke on the shared event loop, awaited on the loop
+A handler put first in the callbacks takes the dispatch time of every token, the StreamHandler takes the time
+it renders it. With --sessions N, N runs stream at the same time, the async variants share the event loop.
+Rendering is stubbed out unless --render is given. The handlers live in a headless Streamlit script run (AppTest).
+
+    python benchmarks/bench_callback_dispatch.py --tokens 300 --token-delay 0.002 --sessions 1 8
+"""
+import argparse
+import os
+import statistics
+import time
+
+from langchain_core.callbacks.base import BaseCallbackHandler
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE_DIR = os.path.join(ROOT, "simple_streaming")
+
+VARIANTS = ("sync inline", "sync in async", "sync queued", "async")
+
+
+class DispatchClock(BaseCallbackHandler):
+    """
+    Takes the time the callback manager dispatches every token, before any other handler gets it.
+    """
+
+    run_inline = True  # called first and in order by the async callback manager as well
+
+    def __init__(self):
+        self.dispatched = []
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.dispatched.append(time.perf_counter())
+
+
+def clock_rendering(handler, render):
+    """
+    Records the time and token count of every text the handler renders, renders it only if `render` is set.
+    """
+    handler.rendered = []
+    render_token = handler._render_token
+
+    def timed_render_token(text, tokens):
+        handler.rendered.append((time.perf_counter(), tokens))
+        if render:
+            render_token(text, tokens)
+
+    handler._render_token = timed_render_token
+    if not render:
+        handler._flush = lambda: None
+    return handler
+
+
+def latencies(clock, handler):
+    # the n-th dispatched token against the frame it was rendered in, a queued frame renders several
+    rendered = [at for at, tokens in handler.rendered for _ in range(tokens)]
+    return [at - dispatched for dispatched, at in zip(clock.dispatched, rendered)]
+
+
+def run_session(variant, container, render):
+    """
+    Streams one graph run into `container` with the handler of `variant`.
+    Returns:
+        List[float]: Seconds from dispatch to render of every token.
+    """
+    from langchain_core.messages import HumanMessage
+
+    import graph
+    from event_loop import run_async
+    from run_control import RunControl
+    from st_callable_util import get_async_streamlit_cb, get_streamlit_cb
+
+    messages = [HumanMessage(content="Which cities are coolest?")]
+    clock = DispatchClock()
+    if variant == "sync inline":
+        handler = clock_rendering(get_streamlit_cb(container), render)
+        graph.invoke_our_graph(messages, [clock, handler])
+    elif variant == "sync in async":
+        handler = clock_rendering(get_streamlit_cb(container), render)
+        run_async(graph.ainvoke_our_graph(messages, [clock, handler]))
+    elif variant == "sync queued":
+        control = RunControl()
+        handler = clock_rendering(get_streamlit_cb(container, control=control), render)
+        graph.invoke_our_graph(messages, [clock, handler], control=control)
+    else:
+        handler = clock_rendering(get_async_streamlit_cb(container), render)
+        run_async(graph.ainvoke_our_graph(messages, [clock, handler]))
+    return latencies(clock, handler)
+
+
+def bench_script(example_dir, bench_dir, model_params, sessions_list, runs, render):
+    # runs as its own Streamlit script, so it imports everything itself
+    import sys
+    import threading
+    import time
+
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+    sys.path[:0] = [example_dir, bench_dir]
+    import graph
+    from bench_callback_dispatch import VARIANTS, run_session
+    from fake_chat_model import FakeStreamingChatModel
+
+    model = FakeStreamingChatModel(streaming=True, **model_params)
+    graph.get_chat_model = lambda **kwargs: model
+    ctx = get_script_run_ctx()
+    results = {}
+    for sessions in sessions_list:
+        for variant in VARIANTS:
+            samples, elapsed = [], []
+            for _ in range(runs):
+                containers = [st.empty().container() for _ in range(sessions)]
+
+                def session(container):
+                    add_script_run_ctx(threading.current_thread(), ctx)  # one page, like sessions of one user
+                    samples.extend(run_session(variant, container, render))
+
+                threads = [threading.Thread(target=session, args=(c,)) for c in containers]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed.append(time.perf_counter() - start)
+            results[f"{sessions} {variant}"] = (samples, min(elapsed))
+    st.session_state.bench_results = results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=300, help="tokens of every streamed answer")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="seconds between streamed tokens")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 8], help="concurrent runs, per measurement")
+    parser.add_argument("--runs", type=int, default=3, help="measurements per variant")
+    parser.add_argument("--render", action="store_true", help="render the tokens instead of stubbing it out")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds the measurements may take")
+    args = parser.parse_args()
+
+    os.chdir(EXAMPLE_DIR)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")  # never used, the model is faked
+    for name in ("RESPONSE_CACHE", "RESPONSE_CACHE_DIR", "STREAM_TRACE_DIR"):
+        os.environ.pop(name, None)
+    model_params = {"tokens": args.tokens, "token_delay": args.token_delay}
+    app = AppTest.from_function(bench_script, args=(EXAMPLE_DIR, os.path.dirname(os.path.abspath(__file__)),
+                                                   model_params, args.sessions, args.runs, args.render))
+    app.run(timeout=args.timeout)
+    if app.exception:
+        raise SystemExit("\n".join(app.exception[0].stack_trace))
+    print(f"{'sessions':>8} {'variant':<14} {'p50 us':>9} {'p99 us':>9} {'max us':>10} {'tok/s':>9}")
+    for key, (samples, elapsed) in app.session_state.bench_results.items():
+        sessions, variant = key.split(" ", 1)
+        samples = sorted(samples)
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        print(f"{sessions:>8} {variant:<14} {statistics.median(samples) * 1e6:>9.1f} {p99 * 1e6:>9.1f} "
+              f"{samples[-1] * 1e6:>10.1f} {int(sessions) * args.tokens / elapsed:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
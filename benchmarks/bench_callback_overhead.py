@@ -0,0 +1,146 @@
+"""
+Measures what keeping the Streamlit script run context costs a callback handler, per token and per turn.
+
+Compares the StreamHandler of simple_streaming
+  unwrapped      its callback methods without any context handling, the lower bound
+  per instance   the former get_streamlit_cb: the handler class defined on every call and every on_*
+                 method of the instance wrapped in a closure that attaches the context on every call
+  per class      with_script_run_ctx: the methods wrapped once with the class, attaching the context
+                 once per thread and comparing one thread attribute on every later call
+Rendering is stubbed out, so only the callback overhead is measured. The handlers are built in a headless
+Streamlit script run (AppTest) and get their tokens from a worker thread, like LangChain's callback threads,
+directly and through a LangChain callback manager.
+
+    python benchmarks/bench_callback_overhead.py --tokens 20000 --handlers 2000
+"""
+import argparse
+import inspect
+import os
+import sys
+import time
+import uuid
+
+from langchain_core.callbacks import CallbackManager
+from langchain_core.messages import HumanMessage
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "simple_streaming"))
+
+from st_callable_util import StreamHandler  # noqa: E402
+
+
+def unwrapped_methods():
+    # the callback methods as written, without the context handling with_script_run_ctx added
+    return {name: getattr(fn, "__wrapped__", fn) for name, fn in vars(StreamHandler).items() if name.startswith("on_")}
+
+
+UnwrappedStreamHandler = type("StreamHandler", (StreamHandler,), unwrapped_methods())
+
+
+def per_instance_handler(container):
+    """
+    The handler the way get_streamlit_cb built it before with_script_run_ctx.
+    """
+    # a new class per call, like the class statement inside the function
+    LegacyStreamHandler = type("StreamHandler", (StreamHandler,), unwrapped_methods())
+
+    def add_streamlit_context(fn):
+        ctx = get_script_run_ctx()
+
+        def wrapper(*args, **kwargs):
+            add_script_run_ctx(ctx=ctx)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    handler = LegacyStreamHandler(container)
+    for method_name, method_func in inspect.getmembers(handler, predicate=inspect.ismethod):
+        if method_name.startswith('on_'):
+            setattr(handler, method_name, add_streamlit_context(method_func))
+    return handler
+
+
+VARIANTS = {"unwrapped": UnwrappedStreamHandler, "per instance": per_instance_handler, "per class": StreamHandler}
+
+
+def stub_rendering(handler):
+    handler._render_token = lambda text, tokens: None
+    handler._flush = lambda: None
+    return handler
+
+
+def time_construction(build, container, handlers):
+    start = time.perf_counter()
+    for _ in range(handlers):
+        build(container)
+    return (time.perf_counter() - start) / handlers
+
+
+def time_direct(handler, tokens, pool):
+    def deliver():
+        start = time.perf_counter()
+        for _ in range(tokens):
+            handler.on_llm_new_token("tok ")
+        return time.perf_counter() - start
+    return pool.submit(deliver).result() / tokens
+
+
+def time_callback_manager(handler, tokens, pool):
+    def deliver():
+        manager = CallbackManager(handlers=[handler])
+        run_manager, = manager.on_chat_model_start({}, [[HumanMessage(content="hi")]], run_id=uuid.uuid4())
+        start = time.perf_counter()
+        for _ in range(tokens):
+            run_manager.on_llm_new_token("tok ")
+        return time.perf_counter() - start
+    return pool.submit(deliver).result() / tokens
+
+
+def best_of(runs, fn, *args):
+    return min(fn(*args) for _ in range(runs))
+
+
+def bench_script(bench_path, tokens, handlers, runs):
+    # runs as its own Streamlit script, so it imports everything itself
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    import streamlit as st
+
+    sys.path.insert(0, bench_path)
+    from bench_callback_overhead import (VARIANTS, best_of, stub_rendering, time_callback_manager,
+                                         time_construction, time_direct)
+
+    container = st.container()
+    results = {}
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="callbacks") as pool:
+        for name, build in VARIANTS.items():
+            handler = stub_rendering(build(container))
+            results[name] = (best_of(runs, time_construction, build, container, handlers),
+                             best_of(runs, time_direct, handler, tokens, pool),
+                             best_of(runs, time_callback_manager, handler, tokens, pool))
+    st.session_state.bench_results = results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=20000, help="tokens per measurement")
+    parser.add_argument("--handlers", type=int, default=2000, help="handlers built per measurement")
+    parser.add_argument("--runs", type=int, default=5, help="measurements per number, the best one is reported")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds the measurements may take")
+    args = parser.parse_args()
+
+    app = AppTest.from_function(bench_script, args=(os.path.dirname(os.path.abspath(__file__)),
+                                                   args.tokens, args.handlers, args.runs))
+    app.run(timeout=args.timeout)
+    if app.exception:
+        raise SystemExit("\n".join(app.exception[0].stack_trace))
+    print(f"{'variant':<14} {'build us':>9} {'token us':>9} {'via manager us':>15}")
+    for name, (build_s, direct_s, manager_s) in app.session_state.bench_results.items():
+        print(f"{name:<14} {build_s * 1e6:>9.2f} {direct_s * 1e6:>9.3f} {manager_s * 1e6:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
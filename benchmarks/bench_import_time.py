@@ -0,0 +1,139 @@
+"""
+Measures what each app imports before it draws its page and how long a cold first script run takes.
+
+Every number is taken in fresh processes, with Streamlit already imported like in a running server:
+  imports ms    python -X importtime total of the modules app.py imports at the top, before the first element
+  heaviest      the packages that take the most of it
+  first run ms  a cold headless script run of app.py (AppTest), from the first import to the drawn page
+  graph ms      importing the graph module and building the graph, done in the background after the page is drawn
+
+    python benchmarks/bench_import_time.py --runs 3
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = ["simple_streaming", "msg_manipulation", "tool_calling_via_callback", "StreamlitCallbackHandler_example",
+            "tool_calling_via_events", "dynamic_interrupts"]
+# the graph module's function that builds the graph, the first call does the work
+GRAPH_BUILDERS = ("get_graph_runnable", "get_graph")
+
+FIRST_RUN = """
+import json, os, sys, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file(os.path.abspath("app.py"), default_timeout=60).run()
+elapsed = time.perf_counter() - start
+if app.exception:
+    raise SystemExit(app.exception[0].message)
+print(json.dumps(elapsed))
+"""
+
+GRAPH_BUILD = """
+import json, time
+import streamlit
+start = time.perf_counter()
+import graph
+for name in {builders!r}:
+    if hasattr(graph, name):
+        getattr(graph, name)()
+        break
+print(json.dumps(time.perf_counter() - start))
+"""
+
+
+def top_level_imports(app_path):
+    """
+    Returns the import statements of app.py that run before anything else, the ones at module level.
+    """
+    with open(app_path) as f:
+        tree = ast.parse(f.read())
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def parse_importtime(stderr):
+    """
+    Returns (module, cumulative seconds) of every module imported at the top level of a -X importtime log,
+    the modules they import are included in their cumulative time.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):  # a module the statement imports, not one of its dependencies
+            modules.append((name.strip(), int(cumulative) / 1e6))
+    return modules
+
+
+def importtime(example_dir, statements):
+    done = subprocess.run([sys.executable, "-X", "importtime", "-c", "\n".join(statements)], cwd=example_dir,
+                          env=benchmark_env(), capture_output=True, text=True)
+    if done.returncode:
+        raise SystemExit(done.stderr)
+    return parse_importtime(done.stderr)
+
+
+def run_json(example_dir, code):
+    done = subprocess.run([sys.executable, "-c", code], cwd=example_dir, env=benchmark_env(),
+                          capture_output=True, text=True)
+    if done.returncode:
+        raise SystemExit(done.stderr or done.stdout)
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+
+def benchmark_env():
+    env = dict(os.environ, OPENAI_API_KEY="sk-benchmark",  # never used, the apps only need one to draw the page
+               OPENAI_BASE_URL="http://127.0.0.1:9")  # the warm-up connection fails right away instead of going out
+    for name in ("RESPONSE_CACHE", "RESPONSE_CACHE_DIR", "STREAM_TRACE_DIR", "CHECKPOINT_DB", "METRICS_PORT"):
+        env.pop(name, None)
+    return env
+
+
+def bench_example(example, runs):
+    example_dir = os.path.join(ROOT, example)
+    statements = top_level_imports(os.path.join(example_dir, "app.py"))
+    # a running server imports Streamlit before any app, its modules cost the app nothing
+    server_modules = {name for name, _ in importtime(example_dir, ["import streamlit"])}
+    totals, packages = [], defaultdict(list)
+    for _ in range(runs):
+        by_package = defaultdict(float)
+        for name, seconds in importtime(example_dir, ["import streamlit"] + statements):
+            if name not in server_modules:
+                by_package[name.split(".")[0]] += seconds
+        totals.append(sum(by_package.values()))
+        for package, seconds in by_package.items():
+            packages[package].append(seconds)
+    heaviest = sorted(((statistics.median(s), p) for p, s in packages.items()), reverse=True)[:3]
+    first_runs = [run_json(example_dir, FIRST_RUN) for _ in range(runs)]
+    graph_builds = [run_json(example_dir, GRAPH_BUILD.format(builders=GRAPH_BUILDERS)) for _ in range(runs)]
+    return {"imports": statistics.median(totals), "heaviest": heaviest,
+            "first_run": statistics.median(first_runs), "graph": statistics.median(graph_builds)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--examples", nargs="+", default=EXAMPLES, choices=EXAMPLES, help="examples to measure")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per number, the median is reported")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    report = {example: bench_example(example, args.runs) for example in args.examples}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'example':<34} {'imports ms':>10} {'first run ms':>12} {'graph ms':>9}  heaviest imports")
+    for example, result in report.items():
+        heaviest = ", ".join(f"{package} {seconds * 1000:.0f}" for seconds, package in result["heaviest"])
+        print(f"{example:<34} {result['imports'] * 1000:>10.0f} {result['first_run'] * 1000:>12.0f} "
+              f"{result['graph'] * 1000:>9.0f}  {heaviest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Compares what each cookbook's way of streaming a graph run into Streamlit costs, offline.
+
+Every example runs in its own process, as the examples share module names, with its model replaced
+by a deterministic fake chat model. Its handler renders into a headless Streamlit script run
+(AppTest) whose outgoing messages go through a delta sink instead of a browser.
+Reported per example, as the median over the runs:
+  ttft     time from invoking the graph to the first delta after the first answer token
+  e2e      time until the handler returns
+  deltas   element updates the handler emits, before the server coalesces them
+  kB       serialized size of those deltas
+  cpu/tok  process CPU time per answer token, includes the fake model and the graph
+
+    python benchmarks/bench_streaming.py --tokens 500 --chunk-tokens 1 --tool-calls 2 --runs 5
+
+The custom callback examples await their graph on the shared event loop with an AsyncStreamHandler, like
+their apps. With --sync-handler they invoke it synchronously and render inline on LangChain's callback
+threads instead, with --render-queue they queue their updates for the script thread to render, while the
+graph runs on a worker thread.
+--delta-delay simulates a slow websocket by holding up every delta the handler emits.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# example directory -> (streaming strategy, whether its graph has tools)
+STRATEGIES = {
+    "simple_streaming": ("custom callback", False),
+    "StreamlitCallbackHandler_example": ("StreamlitCallbackHandler", True),
+    "tool_calling_via_callback": ("custom callback + tools", True),
+    "msg_manipulation": ("custom callback + msg manipulation", False),
+    "tool_calling_via_events": ("stream_mode messages + tasks", True),
+    "dynamic_interrupts": ("custom dispatched events", False),
+}
+# examples whose StreamHandler can queue its updates for the script thread, see render_queue.py
+QUEUED_EXAMPLES = {"simple_streaming", "tool_calling_via_callback", "msg_manipulation"}
+# examples whose app awaits the graph with an AsyncStreamHandler on the shared event loop
+ASYNC_EXAMPLES = QUEUED_EXAMPLES
+
+
+class DeltaSink:
+    """
+    Headless stand-in for the browser connection: wraps the script run's enqueue function and
+    records the time and serialized size of every delta the handler emits.
+    """
+
+    def __init__(self, ctx, delay=0.0):
+        self.delay = delay  # seconds every delta takes to send, a slow connection to the browser
+        self.deltas = []  # (perf_counter, bytes), list.append is atomic for the graph's worker threads
+        self._enqueue = ctx._enqueue
+        ctx._enqueue = self.enqueue
+
+    def enqueue(self, msg):
+        if msg.HasField("delta"):
+            time.sleep(self.delay)
+            self.deltas.append((time.perf_counter(), msg.ByteSize()))
+        self._enqueue(msg)
+
+
+def run_example(example, container, model, render_queue=False, sync_handler=False):
+    """
+    Invokes the example's graph once the way its app.py does and returns the handler's result.
+    With `render_queue` a custom callback handler queues its updates for this thread to render,
+    with `sync_handler` it renders them inline on LangChain's callback threads of a synchronous run.
+    """
+    from langchain_core.messages import HumanMessage
+
+    import graph
+    if hasattr(graph, "get_chat_model"):
+        graph.get_chat_model = lambda **kwargs: model
+    if hasattr(graph, "get_chat_model_with_tools"):
+        graph.get_chat_model_with_tools = lambda tools, **kwargs: model
+
+    messages = [HumanMessage(content="What's the weather in sf and which cities are coolest?")]
+    if example == "tool_calling_via_events":
+        from astream_events_handler import invoke_our_graph
+        from event_loop import run_async
+        return run_async(invoke_our_graph(messages, container))
+    if example == "dynamic_interrupts":
+        from astream_events_handler import invoke_our_graph
+        from event_loop import run_async
+        return run_async(invoke_our_graph("word", container, {"thread_id": str(uuid.uuid4())}))
+    from st_callable_util import get_streamlit_cb
+    if render_queue and example in QUEUED_EXAMPLES:
+        from run_control import RunControl
+        control = RunControl()
+        return graph.invoke_our_graph(messages, [get_streamlit_cb(container, control=control)], control=control)
+    if sync_handler or example not in ASYNC_EXAMPLES:
+        return graph.invoke_our_graph(messages, [get_streamlit_cb(container)])
+    from event_loop import run_async
+    from st_callable_util import get_async_streamlit_cb
+    return run_async(graph.ainvoke_our_graph(messages, [get_async_streamlit_cb(container)]))
+
+
+def bench_script(example_dir, bench_dir, example, model_params, runs, render_queue, sync_handler, delta_delay):
+    # runs as its own Streamlit script, so it imports everything itself
+    import sys
+    import time
+
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    sys.path[:0] = [example_dir, bench_dir]
+    from bench_streaming import DeltaSink, run_example
+    from fake_chat_model import FakeStreamingChatModel
+
+    import graph
+    # built once per process, like a running app does after drawing its first page, the runs stream only
+    (getattr(graph, "get_graph_runnable", None) or graph.get_graph)()
+    sink = DeltaSink(get_script_run_ctx(), delta_delay)
+    results = []
+    for _ in range(runs):
+        model = FakeStreamingChatModel(streaming=True, **model_params)  # explicit, like the apps pass it
+        container = st.empty() if example == "StreamlitCallbackHandler_example" else st.container()
+        first_delta = len(sink.deltas)
+        cpu_start, start = time.process_time(), time.perf_counter()
+        run_example(example, container, model, render_queue, sync_handler)
+        e2e, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+        deltas = sink.deltas[first_delta:]
+        # examples without a model (dynamic_interrupts) have their first render as first token
+        first_token = model.first_token_at or start
+        ttft = next((at - start for at, _ in deltas if at >= first_token), None)
+        results.append({"ttft": ttft, "e2e": e2e, "deltas": len(deltas), "bytes": sum(size for _, size in deltas),
+                        "cpu": cpu, "tokens": model.tokens if model.first_token_at else 0})
+    st.session_state.bench_results = results
+
+
+def run_worker(args):
+    example_dir = os.path.join(ROOT, args.worker)
+    _, has_tools = STRATEGIES[args.worker]
+    model_params = {"tokens": args.tokens, "chunk_tokens": args.chunk_tokens, "token_delay": args.token_delay,
+                    "first_token_delay": args.first_token_delay, "tool_calls": args.tool_calls if has_tools else 0}
+    os.chdir(example_dir)
+    app = AppTest.from_function(bench_script, args=(example_dir, os.path.dirname(os.path.abspath(__file__)),
+                                                   args.worker, model_params, args.runs, args.render_queue,
+                                                   args.sync_handler, args.delta_delay))
+    app.run(timeout=args.timeout)
+    if app.exception:
+        raise SystemExit("\n".join(app.exception[0].stack_trace))
+    print(json.dumps(app.session_state.bench_results))
+
+
+def median(values):
+    values = [v for v in values if v is not None]
+    return statistics.median(values) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--examples", nargs="+", default=list(STRATEGIES), choices=list(STRATEGIES),
+                        help="examples to benchmark")
+    parser.add_argument("--tokens", type=int, default=500, help="tokens of the streamed answer")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per streamed chunk")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="seconds before the first chunk")
+    parser.add_argument("--tool-calls", type=int, default=0,
+                        help="parallel tool calls before the answer, for the examples with tools")
+    parser.add_argument("--runs", type=int, default=5, help="graph runs per example")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds the runs of one example may take")
+    parser.add_argument("--render-queue", action="store_true",
+                        help="custom callback handlers queue their updates for the script thread to render")
+    parser.add_argument("--sync-handler", action="store_true",
+                        help="custom callback handlers render inline in a synchronous graph run, as before the async one")
+    parser.add_argument("--delta-delay", type=float, default=0.0, help="seconds every delta takes to send")
+    parser.add_argument("--json", action="store_true", help="print the results of every run as JSON")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)  # example to run in this process
+    args = parser.parse_args()
+    if args.worker:
+        return run_worker(args)
+
+    report = {}
+    for example in args.examples:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", example] + [
+            f"--{name.replace('_', '-')}={getattr(args, name)}"
+            for name in ("tokens", "chunk_tokens", "token_delay", "first_token_delay", "tool_calls", "runs",
+                         "timeout", "delta_delay")
+        ] + [f"--{flag}" for flag in ("render-queue", "sync-handler") if getattr(args, flag.replace("-", "_"))]
+        env = {k: v for k, v in os.environ.items()
+               if k not in ("RESPONSE_CACHE", "RESPONSE_CACHE_DIR", "STREAM_TRACE_DIR", "CHECKPOINT_DB")}
+        env.setdefault("OPENAI_API_KEY", "sk-benchmark")  # never used, the model is faked
+        done = subprocess.run(command, env=env, capture_output=True, text=True)
+        if done.returncode:
+            print(f"{example} failed:\n{done.stderr or done.stdout}", file=sys.stderr)
+            continue
+        report[example] = json.loads(done.stdout.strip().splitlines()[-1])
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'strategy':<36} {'ttft ms':>9} {'e2e ms':>9} {'deltas':>7} {'kB':>8} {'cpu/tok us':>11}")
+    for example, runs in report.items():
+        ttft = median(r["ttft"] for r in runs)
+        cpu_per_token = median(r["cpu"] / r["tokens"] if r["tokens"] else None for r in runs)
+        print(f"{STRATEGIES[example][0]:<36} "
+              f"{ttft * 1000 if ttft is not None else float('nan'):>9.2f} "
+              f"{median(r['e2e'] for r in runs) * 1000:>9.2f} "
+              f"{median(r['deltas'] for r in runs):>7.0f} "
+              f"{median(r['bytes'] for r in runs) / 1024:>8.1f} "
+              f"{cpu_per_token * 1e6 if cpu_per_token is not None else float('nan'):>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Arguments the fake model calls the cookbook tools with, the network bound Search tool is never called
+TOOL_ARGS = {"get_weather": {"location": "sf"}, "get_coolest_cities": {}}
+
+WORDS = ("the graph streams every token of the answer into the streamlit container while tools run "
+         "and the handler decides when to re-render the markdown of the open block").split()
+# Token positions within every 60 tokens that open a list item or a code block, or close the code block
+MARKDOWN_PREFIXES = {30: "\n\n- ", 33: "\n- ", 36: "\n- ", 40: "\n\n```python\n", 45: "\n```\n\n"}
+
+
+def fake_answer(tokens: int) -> List[str]:
+    """
+    Builds a deterministic markdown answer of `tokens` tokens with paragraphs, a list and a code block,
+    so block-wise markdown rendering sees the same structure a real answer has.
+    Args:
+        tokens (int): Number of tokens, a token is a word with its trailing whitespace.
+    Returns:
+        List[str]: The tokens of the answer.
+    """
+    answer = []
+    for i in range(tokens):
+        position = i % 60
+        # structure is prefixed to a word, so the answer has exactly `tokens` tokens
+        prefix = MARKDOWN_PREFIXES.get(position, "\n\n" if position == 0 and i else "")
+        answer.append(prefix + WORDS[i % len(WORDS)] + " ")
+    return answer
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Deterministic chat model for benchmarks. It answers a user message with `tool_calls` parallel
+    tool calls first, if any, and answers the tool results with `tokens` tokens streamed
+    `chunk_tokens` at a time, `token_delay` seconds apart.
+    """
+
+    tokens: int = 500
+    chunk_tokens: int = 1
+    token_delay: float = 0.0
+    first_token_delay: float = 0.0
+    tool_calls: int = 0
+    tool_names: List[str] = list(TOOL_ARGS)
+    streaming: bool = True
+    first_token_at: Optional[float] = None  # perf_counter of the first streamed answer token of the last call
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat-model"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeStreamingChatModel":
+        return self
+
+    def _response(self, messages: List[BaseMessage]) -> AIMessage:
+        if self.tool_calls and not isinstance(messages[-1], ToolMessage):
+            calls = []
+            for index in range(self.tool_calls):
+                name = self.tool_names[index % len(self.tool_names)]
+                calls.append({"name": name, "args": TOOL_ARGS.get(name, {}), "id": f"call_{uuid.uuid4().hex[:24]}"})
+            return AIMessage(content="", tool_calls=calls)
+        return AIMessage(content="".join(fake_answer(self.tokens)))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._response(messages))])
+
+    @staticmethod
+    def _tool_call_chunk(response: AIMessage) -> ChatGenerationChunk:
+        return ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+            {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+            for index, call in enumerate(response.tool_calls)
+        ]))
+
+    def _answer_chunks(self) -> Iterator[ChatGenerationChunk]:
+        # the delays are left to the caller, so the sync and the async stream share the chunks
+        answer = fake_answer(self.tokens)
+        self.first_token_at = None
+        for start in range(0, len(answer), self.chunk_tokens):
+            text = "".join(answer[start:start + self.chunk_tokens])
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        response = self._response(messages)
+        if response.tool_calls:
+            yield self._tool_call_chunk(response)
+            return
+
+        time.sleep(self.first_token_delay)
+        for index, chunk in enumerate(self._answer_chunks()):
+            if index:
+                time.sleep(self.token_delay)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        response = self._response(messages)
+        if response.tool_calls:
+            yield self._tool_call_chunk(response)
+            return
+
+        await asyncio.sleep(self.first_token_delay)
+        for index, chunk in enumerate(self._answer_chunks()):
+            if index:
+                await asyncio.sleep(self.token_delay)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
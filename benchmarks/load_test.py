@@ -0,0 +1,472 @@
+"""
+Simulates concurrent users chatting with each example's app.py and reports how the server holds up as they ramp up.
+
+Every example is served by `streamlit run app.py` in its own process, the server, with its model replaced by a
+deterministic fake chat model and its tools by stubs that take --tool-delay seconds. Every simulated user is a
+websocket client that talks to the server like a browser tab: it opens a session and sends --turns prompts through
+the app's chat input, so a turn goes through the same invoke_our_graph call, handler and rendering as in the
+browser, and the sessions share the server like real ones. The clients run on an event loop of this process, the
+users of a level all start at once, after an unreported warm-up level that builds the graph.
+Reported per example and number of users:
+  ttft       p50/p95/p99 time to first token of the turns, from the app's turn metrics (METRICS_JSONL)
+  latency    p50/p95/p99 time from sending the prompt to the end of the script run that draws the answer
+  queue      p95 time the model calls of a turn waited for the rate limiter (RATE_LIMIT_RPM/RATE_LIMIT_TPM)
+  rss MB     peak resident memory of the server process and its graph workers, sampled during the level
+  cpu %      CPU time of the server and its graph workers over the level's wall time, 100 is one core
+
+    python benchmarks/load_test.py --users 1 4 16 --token-delay 0.01 --tool-delay 0.2 --out results.json
+    python benchmarks/load_test.py --users 1 4 16 --workers 2 --compare results.json
+
+--out saves the results as JSON, --compare prints the change against results saved before.
+With --workers the graphs run on that many worker processes (GRAPH_WORKERS) instead of the server's event loop.
+Memory and CPU are read from /proc, so they are only reported on Linux.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from functools import lru_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# example directory -> the prompt a user sends, the dynamic_interrupts graph only completes short words
+EXAMPLES = {
+    "simple_streaming": "Tell me about streaming.",
+    "msg_manipulation": "Tell me about streaming.",
+    "tool_calling_via_callback": "What's the weather in sf and which cities are coolest?",
+    "StreamlitCallbackHandler_example": "What's the weather in sf and which cities are coolest?",
+    "tool_calling_via_events": "What's the weather in sf and which cities are coolest?",
+    "dynamic_interrupts": "abc",
+}
+PERCENTILES = (50, 95, 99)
+SAMPLE_INTERVAL = 0.1  # seconds between two memory samples
+SERVER_START_TIMEOUT = 60  # seconds the server may take to answer its health check
+COMPARE_THRESHOLD = 5  # percent a percentile has to change by to be listed against the baseline
+
+
+def patch_graph(tokens, chunk_tokens, token_delay, first_token_delay, tool_calls, tool_delay):
+    """
+    Replaces the model of the example's graph module with a FakeStreamingChatModel and its tools with stubs
+    that take `tool_delay` seconds, before the graph is built. The stubs skip the tool cache, every call waits.
+    """
+    import asyncio
+
+    from langchain_core.tools import StructuredTool
+
+    import graph
+    from fake_chat_model import FakeStreamingChatModel
+
+    has_tools = hasattr(graph, "get_tools")
+    model = FakeStreamingChatModel(tokens=tokens, chunk_tokens=chunk_tokens, token_delay=token_delay,
+                                   first_token_delay=first_token_delay, tool_calls=tool_calls if has_tools else 0,
+                                   streaming=True)  # explicit, like the apps pass it
+    if hasattr(graph, "get_chat_model"):
+        graph.get_chat_model = lambda **kwargs: model
+    if hasattr(graph, "get_chat_model_with_tools"):
+        graph.get_chat_model_with_tools = lambda tools, **kwargs: model
+
+    def get_weather(location: str) -> str:
+        """Call to get the current weather."""
+        time.sleep(tool_delay)
+        return "It's 90 degrees and sunny."
+
+    async def aget_weather(location: str) -> str:
+        await asyncio.sleep(tool_delay)
+        return "It's 90 degrees and sunny."
+
+    def get_coolest_cities() -> str:
+        """Get a list of coolest cities."""
+        time.sleep(tool_delay)
+        return "nyc, sf"
+
+    async def aget_coolest_cities() -> str:
+        await asyncio.sleep(tool_delay)
+        return "nyc, sf"
+
+    if has_tools:
+        tools = [StructuredTool.from_function(func=get_weather, coroutine=aget_weather),
+                 StructuredTool.from_function(func=get_coolest_cities, coroutine=aget_coolest_cities)]
+        graph.get_tools = lambda: tools
+
+
+def percentiles(values):
+    """
+    Returns {"p50": ..., "p95": ..., "p99": ...} of `values`, None for each if there are none.
+    """
+    values = sorted(v for v in values if v is not None)
+    if len(values) < 2:
+        return {f"p{p}": values[0] if values else None for p in PERCENTILES}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {f"p{p}": cuts[p - 1] for p in PERCENTILES}
+
+
+@lru_cache(maxsize=None)
+def clock_ticks():
+    return os.sysconf("SC_CLK_TCK")
+
+
+def server_pids(pid):
+    """
+    Returns the server process `pid` and its children, the graph workers if there are any.
+    """
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:  # exited meanwhile
+                continue
+            if int(fields[1]) == pid:
+                pids.append(int(entry))
+    return pids
+
+
+def process_usage(pids):
+    """
+    Returns (resident memory in bytes, CPU seconds) of the processes `pids` together, from /proc.
+    """
+    rss, cpu = 0, 0.0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/status") as f:
+                status = f.read()
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / clock_ticks()  # utime and stime
+        rss += next((int(line.split()[1]) * 1024 for line in status.splitlines() if line.startswith("VmRSS:")), 0)
+    return rss, cpu
+
+
+class UsageSampler:
+    """
+    Samples the memory of the server and its workers on a thread while a level runs, and takes their CPU time
+    at its start and end.
+    """
+
+    def __init__(self, pid):
+        self.server_pid = pid
+        self.available = os.path.isdir("/proc")
+        self.peak_rss = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="usage-sampler", daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, process_usage(server_pids(self.server_pid))[0])
+
+    def __enter__(self):
+        if self.available:
+            self.pids = server_pids(self.server_pid)
+            self.peak_rss, self._cpu_start = process_usage(self.pids)
+            self._thread.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = time.perf_counter() - self._start
+        if self.available:
+            self._stopped.set()
+            self._thread.join()
+            rss, cpu_end = process_usage(self.pids)
+            self.peak_rss = max(self.peak_rss, rss)
+            self.cpu = cpu_end - self._cpu_start
+
+    def to_dict(self):
+        if not self.available:
+            return {"rss_mb": None, "cpu_percent": None}
+        return {"rss_mb": self.peak_rss / 2 ** 20, "cpu_percent": 100 * self.cpu / self.wall}
+
+
+async def run_script(ws, widget_states=None):
+    """
+    Asks the server for a script run like the browser does and reads its messages until the run is over.
+    Returns (ID of the app's chat input, the first exception the run drew), each None if there is none.
+    """
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    back_msg = BackMsg()
+    back_msg.rerun_script.query_string = ""
+    if widget_states is not None:
+        back_msg.rerun_script.widget_states.CopyFrom(widget_states)
+    await ws.send(back_msg.SerializeToString())
+    chat_input_id, error = None, None
+    while True:
+        msg = ForwardMsg()
+        msg.ParseFromString(await ws.recv())
+        kind = msg.WhichOneof("type")
+        if kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+            element = msg.delta.new_element
+            if element.WhichOneof("type") == "chat_input":
+                chat_input_id = element.chat_input.id
+            elif element.WhichOneof("type") == "exception" and error is None:
+                error = f"{element.exception.type}: {element.exception.message}"
+        # a run the app reran itself, e.g. with st.rerun, goes on in the next one
+        elif kind == "script_finished" and msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+            return chat_input_id, error
+
+
+def chat_input_state(chat_input_id, prompt):
+    from streamlit.proto.WidgetStates_pb2 import WidgetStates
+
+    widget_states = WidgetStates()
+    state = widget_states.widgets.add()
+    state.id = chat_input_id
+    state.chat_input_value.data = prompt
+    return widget_states
+
+
+async def simulate_user(url, prompt, turns, think_time, timeout, turn_results):
+    """
+    One user: opens a session of the app, then sends `turns` prompts, `think_time` seconds apart.
+    """
+    from websockets.asyncio.client import connect
+
+    try:
+        async with connect(url, subprotocols=["streamlit"], max_size=None) as ws:
+            chat_input_id, error = await asyncio.wait_for(run_script(ws), timeout)
+            if error or chat_input_id is None:
+                turn_results.append({"error": error or "the app drew no chat input"})
+                return
+            for turn in range(turns):
+                if turn and think_time:
+                    await asyncio.sleep(think_time)
+                start = time.perf_counter()
+                _, error = await asyncio.wait_for(run_script(ws, chat_input_state(chat_input_id, prompt)), timeout)
+                if error:
+                    turn_results.append({"error": error})
+                    return
+                turn_results.append({"latency": time.perf_counter() - start})
+    except Exception as e:  # e.g. the script run timed out or the server closed the session, the user counts as failed
+        turn_results.append({"error": repr(e)})
+
+
+def read_turn_metrics(path):
+    # the lines report_turn wrote, one per finished turn
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_level(server, prompt, users, args):
+    turn_results = []
+    reported = len(read_turn_metrics(server.metrics_path))
+
+    async def run_users():
+        await asyncio.gather(*(simulate_user(server.url, prompt, args.turns, args.think_time, args.timeout,
+                                             turn_results) for _ in range(users)))
+
+    with UsageSampler(server.process.pid) as usage:
+        asyncio.run(run_users())
+    turn_metrics = read_turn_metrics(server.metrics_path)[reported:]
+    done = [r for r in turn_results if "error" not in r]
+    errors = [r["error"] for r in turn_results if "error" in r]
+    return {"users": users, "turns": len(done), "errors": len(errors), "first_error": errors[0] if errors else None,
+            "ttft": percentiles(m["ttft_seconds"] for m in turn_metrics),
+            "latency": percentiles(r["latency"] for r in done),
+            "queue": percentiles(m["queue_seconds"] for m in turn_metrics),
+            **usage.to_dict()}
+
+
+def model_params(args):
+    return {"tokens": args.tokens, "chunk_tokens": args.chunk_tokens, "token_delay": args.token_delay,
+            "first_token_delay": args.first_token_delay, "tool_calls": args.tool_calls, "tool_delay": args.tool_delay}
+
+
+def serve(args):
+    """
+    The server process: patches the example's graph, then serves its app.py like `streamlit run` does.
+    The app's script runs in this process, so it imports the patched graph module.
+    """
+    from streamlit.web import bootstrap
+
+    example_dir = os.path.join(ROOT, args.serve)
+    os.chdir(example_dir)
+    sys.path[:0] = [example_dir, BENCH_DIR]
+    patch_graph(**model_params(args))
+    if args.workers:
+        import worker_pool
+
+        # the workers run the example's graph_server run with the same fake model and stub tools
+        os.environ["LOAD_TEST_PARAMS"] = json.dumps(model_params(args))
+        os.environ["PYTHONPATH"] = os.pathsep.join([BENCH_DIR, os.environ.get("PYTHONPATH", "")])
+        worker_pool.get_worker_pool = lru_cache(maxsize=None)(
+            lambda size: worker_pool.WorkerPool(size, "load_test_worker", "run_graph"))
+        worker_pool.get_worker_pool(args.workers).start()
+    flag_options = {"server_port": args.port, "server_address": "127.0.0.1", "server_headless": True,
+                    "server_fileWatcherType": "none", "server_runOnSave": False,
+                    "browser_gatherUsageStats": False}
+    bootstrap.load_config_options(flag_options)
+    bootstrap.run(os.path.join(example_dir, "app.py"), False, [], flag_options)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AppServer:
+    """
+    The server process of an example, started with `serve` and stopped on exit.
+    """
+
+    def __init__(self, example, args):
+        self.example = example
+        self.args = args
+        self.port = free_port()
+        self.url = f"ws://127.0.0.1:{self.port}/_stcore/stream"
+        self.metrics_path = os.path.join(tempfile.mkdtemp(prefix="load_test_"), "turns.jsonl")
+
+    def __enter__(self):
+        args = self.args
+        command = [sys.executable, os.path.abspath(__file__), "--serve", self.example, f"--port={self.port}"] + [
+            f"--{name.replace('_', '-')}={getattr(args, name)}"
+            for name in ("tokens", "chunk_tokens", "token_delay", "first_token_delay", "tool_calls", "tool_delay",
+                         "workers")
+        ]
+        env = benchmark_env(args)
+        env["METRICS_JSONL"] = self.metrics_path  # the turn metrics of every session, read after each level
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1):
+                    return self
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.__exit__(None, None, None)
+                    raise RuntimeError(f"the server didn't start:\n{self.output()}")
+                time.sleep(0.2)
+
+    def __exit__(self, *exc_info):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def output(self):
+        self.log.seek(0)
+        return self.log.read().decode(errors="replace")
+
+
+def run_example(example, args):
+    with AppServer(example, args) as server:
+        # unreported warm-up: the graph is built and the workers have imported it before the first level
+        run_level(server, EXAMPLES[example], max(1, 2 * args.workers), args)
+        return [run_level(server, EXAMPLES[example], users, args) for users in args.users]
+
+
+def benchmark_env(args):
+    env = dict(os.environ, OPENAI_API_KEY="sk-benchmark",  # never used, the model is faked
+               OPENAI_BASE_URL="http://127.0.0.1:9")  # the warm-up connection fails right away instead of going out
+    for name in ("RESPONSE_CACHE", "RESPONSE_CACHE_DIR", "STREAM_TRACE_DIR", "CHECKPOINT_DB", "METRICS_PORT",
+                 "METRICS_JSONL", "GRAPH_SERVER_URL"):
+        env.pop(name, None)
+    env["GRAPH_WORKERS"] = str(args.workers)
+    return env
+
+
+def ms(value):
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+def relative_change(value, before):
+    return None if value is None or not before else 100 * (value - before) / before
+
+
+def change(value, before):
+    percent = relative_change(value, before)
+    return "" if percent is None else f" ({percent:+.0f}%)"
+
+
+def print_report(report, baseline):
+    print(f"{'example':<34} {'users':>5} {'turns':>5} {'err':>4} {'ttft p50/p95/p99 ms':>22} "
+          f"{'latency p50/p95/p99 ms':>24} {'queue p95':>9} {'rss MB':>14} {'cpu %':>12}")
+    for example, levels in report.items():
+        before = {level["users"]: level for level in baseline.get(example, [])}
+        for level in levels:
+            old = before.get(level["users"], {})
+            ttft = "/".join(ms(level["ttft"][f"p{p}"]) for p in PERCENTILES)
+            latency = "/".join(ms(level["latency"][f"p{p}"]) for p in PERCENTILES)
+            rss = f"{level['rss_mb']:.0f}" if level["rss_mb"] is not None else "-"
+            cpu = f"{level['cpu_percent']:.0f}" if level["cpu_percent"] is not None else "-"
+            print(f"{example:<34} {level['users']:>5} {level['turns']:>5} {level['errors']:>4} {ttft:>22} "
+                  f"{latency:>24} {ms(level['queue']['p95']):>9} {rss + change(level['rss_mb'], old.get('rss_mb')):>14} "
+                  f"{cpu + change(level['cpu_percent'], old.get('cpu_percent')):>12}")
+            if old:
+                percents = {f"{kind} p{p}": relative_change(level[kind][f"p{p}"], old[kind][f"p{p}"])
+                            for kind in ("ttft", "latency") for p in PERCENTILES}
+                deltas = [f"{name} {percent:+.0f}%" for name, percent in percents.items()
+                          if percent is not None and abs(percent) >= COMPARE_THRESHOLD]
+                if deltas:
+                    print(f"{'':<34} {'':>5} vs baseline: {', '.join(deltas)}")
+            if level["first_error"]:
+                print(f"{'':<34} {'':>5} first error: {level['first_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--examples", nargs="+", default=list(EXAMPLES), choices=list(EXAMPLES),
+                        help="examples to load")
+    parser.add_argument("--users", nargs="+", type=int, default=[1, 2, 4, 8], help="concurrent users of each level")
+    parser.add_argument("--turns", type=int, default=3, help="prompts every user sends")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds a user waits between two prompts")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens of the streamed answer")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per streamed chunk")
+    parser.add_argument("--token-delay", type=float, default=0.01,
+                        help="seconds between streamed chunks, 0.01 is 100 chunks per second")
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="seconds before the first chunk")
+    parser.add_argument("--tool-calls", type=int, default=2,
+                        help="parallel tool calls before the answer, for the examples with tools")
+    parser.add_argument("--tool-delay", type=float, default=0.2, help="seconds every stub tool call takes")
+    parser.add_argument("--workers", type=int, default=0, help="graph worker processes, 0 runs the graphs in process")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds a script run of a turn may take")
+    parser.add_argument("--out", help="save the results as JSON to this file")
+    parser.add_argument("--compare", help="results saved with --out before, to print the change against")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)  # example to serve in this process
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)  # port of the served example
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args)
+
+    report = {}
+    for example in args.examples:
+        try:
+            report[example] = run_example(example, args)
+        except RuntimeError as e:
+            print(f"{example} failed: {e}", file=sys.stderr)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"args": vars(args), "results": report}, f, indent=2)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print_report(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+"""
+The run of a graph worker under load_test.py: the example's graph_server run with the model and the tools
+replaced like in the load test's own process. The parameters come from the LOAD_TEST_PARAMS environment variable.
+"""
+import json
+import os
+
+from load_test import patch_graph
+
+patch_graph(**json.loads(os.environ["LOAD_TEST_PARAMS"]))
+
+from graph_server import run_graph  # noqa: E402, imports the patched graph module
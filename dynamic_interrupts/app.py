@@ -1,8 +1,12 @@
 from langchain_core.messages import AIMessage, HumanMessage
 import streamlit as st
-import asyncio
+import uuid
 
-from astream_events_handler import invoke_our_graph  # Utility function to handle events from astream_events from graph
+from chat_history import message_markdown, render_chat_history  # Paginated chat history rendering
+from event_loop import run_async  # Runs coroutines on a persistent background event loop
+from preload import preload  # Imports and builds the graph in the background once the page is drawn
+from run_control import RunCancelled, RunControl  # Cancels a running graph on a Stop click or a newer prompt
+from turn_metrics import TurnMetrics, render_metrics_panel, report_turn  # Per-turn timings and their export
 
 st.title("StreamLit 🤝 LangGraph")
 
@@ -13,6 +17,10 @@ if "expander_open" not in st.session_state:
 if 'graph_resume' not in st.session_state:
     st.session_state.graph_resume = False  # Track if the graph should resume from a previous state
 
+if "thread_id" not in st.session_state:
+    # Every browser session gets its own graph thread, so interrupts of different users don't mix
+    st.session_state.thread_id = str(uuid.uuid4())
+
 # Initialize chat messages in session state
 if "messages" not in st.session_state:
     # Set an initial message from the "Ai" to prompt the user
@@ -30,14 +38,17 @@ with st.expander(label="Dynamic Interrupts", expanded=st.session_state.expander_
     that will dynamically ask the user for a new response based on the user's input.
     """
 
-# Loop through all messages in the session state and render them as a chat on every st.refresh mech
-for msg in st.session_state.messages:
+# Render the newest turns of the chat on every st.refresh mech, earlier turns are loaded on demand
+def render_message(index, msg):
     # https://docs.streamlit.io/develop/api-reference/chat/st.chat_message
     # we store them as AIMessage and HumanMessage as its easier to send to LangGraph
     if isinstance(msg, AIMessage):
-        st.chat_message("assistant").write(msg.content)
+        st.chat_message("assistant").write(message_markdown(msg))
     elif isinstance(msg, HumanMessage):
-        st.chat_message("user").write(msg.content)
+        st.chat_message("user").write(message_markdown(msg))
+
+
+render_chat_history(st.session_state.messages, render_message)
 
 # Trigger graph interaction if there's a new user input (i.e., prompt)
 if prompt:
@@ -48,9 +59,21 @@ if prompt:
     with st.chat_message("assistant"):
         placeholder = st.container()  # Placeholder for dynamically updating agents message
         shared_state = {
-            "graph_resume": st.session_state.graph_resume
+            "graph_resume": st.session_state.graph_resume,
+            "thread_id": st.session_state.thread_id,
         }
-        response = asyncio.run(invoke_our_graph(prompt, placeholder, shared_state))
+        from astream_events_handler import invoke_our_graph  # usually preloaded already, see the end of the script
+        metrics = TurnMetrics()  # node, model, tool and render timings of this turn
+        control = RunControl()  # cancels the run on a newer prompt or the user leaving
+        # run on the long-lived background event loop instead of a new one per prompt
+        try:
+            response = run_async(invoke_our_graph(prompt, placeholder, shared_state, metrics=metrics,
+                                                  control=control), control=control)
+        except RunCancelled:
+            response = None  # the run didn't wind down within the grace period, the rerun below replaces it
+        report_turn(metrics)  # exported to the metrics endpoint and the JSONL sink if enabled
+        st.session_state.turn_metrics = metrics
+        control.resume()  # a cancelled run has no response, the newer prompt resumes the graph from its checkpoint
 
         # Handle the response from the graph
         if type(response) is dict: # error handling
@@ -69,3 +92,10 @@ if prompt:
                 st.error("Received: " + response)  # Handle unexpected operations
         else:
             st.error("Received: " + response)  # Handle invalid response types
+
+# Optional sidebar panel with the timings of the last turn
+render_metrics_panel(st.session_state.get("turn_metrics"))
+
+# The page is drawn, import the graph and build it in the background (once per process) ahead of the first prompt
+preload("graph", "get_graph")
+preload("remote_graph", "start_graph_workers")  # the worker processes, if GRAPH_WORKERS is set
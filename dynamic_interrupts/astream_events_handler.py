@@ -1,53 +1,36 @@
+import asyncio
+
 import streamlit as st
-from graph import graph
+from graph import get_graph
+from remote_graph import open_run, use_remote_graph
+from stream_trace import load_event, new_trace_path, record_events
+from turn_metrics import observe_events
 
-# Configuration for thread processing with a "specific" thread ID
-# this is key for dynamic interrupts
-# it allows the graph to remember the previous conversation
-# why it stopped and to resume from that point
-thread_config = {"configurable": {"thread_id": "1"}}
+# Thread ID used when the caller doesn't pass one in its state
+DEFAULT_THREAD_ID = "1"
 
-# Asynchronous function to process events from the graph and update Streamlit UI
-async def invoke_our_graph(st_messages, st_placeholder, st_state):
+def graph_events(graph, st_messages, thread_config, resume):
     """
-    Asynchronously processes a stream of events from the graph_runnable and updates the Streamlit interface.
-
-    Args:
-        st_messages (list): List of messages to be sent to the graph_runnable.
-        st_placeholder (st.beta_container): Streamlit placeholder used to display updates and statuses.
-        st_state (dict): State information for controlling graph resume behavior.
+    Starts or resumes the graph on the session's thread and returns its astream_events.
+    Also used by graph_server.py to run the graph for a remote app.
     """
-    print("============================")
-    container = st_placeholder
     st_input = {"input": st_messages}
 
     # If the graph has been previously interrupted
     # we have to resume from that point by
     # updating the graph state instead of sending new input
-    if st_state.get("graph_resume"):
+    if resume:
         graph.update_state(thread_config, {"input": st_messages})  # Update the graph's state with the new input
         st_input = None  # No new input is passed if resuming the graph
 
     # invoke the graph as normal but depending on if the input is `None` or a `str` the graph will resume
-    async for event in graph.astream_events(st_input, thread_config, version="v2"):
-        name = event["name"]
-
-        # on new response from graph that passes the condition
-        if name == "on_conditional_check":
-            container.info("The length of the word is " + str(event["data"]) + " letters long")
+    return graph.astream_events(st_input, thread_config, version="v2")
 
-        # the graph issued an interrupt that the user needs to update/handle
-        if name == "on_waiting_user_resp":
-            # Display the issue/error and prompt the user for a new response or update
-            container.error("The length of the word is " + str(event["data"]) + " letters long")
-
-        if name == "on_complete_graph":
-            with container:
-                st.balloons()
-                data = event["data"]
-            # Return success message with processed data
-            return {"op": "on_new_graph_msg", "msg": f"Nice, the word is {data['input']}, with length {data['len']}"}
 
+def pending_interrupt(graph, thread_config):
+    """
+    Returns the response for an interrupted run of the session's thread, None if it isn't waiting for the user.
+    """
     # Retrieve the current state of the graph to check for any pending tasks or interruptions
     state = graph.get_state(thread_config)
 
@@ -55,4 +38,77 @@ async def invoke_our_graph(st_messages, st_placeholder, st_state):
     if len(state.tasks) != 0 and len(state.next) != 0:
         issue = state.tasks[0].interrupts[0].value  # Retrieve the first interrupt value from the task
         # Return an operation indicating the graph is waiting for the user to respond
-        return {"op": "on_waiting_user_resp", "msg": issue}
\ No newline at end of file
+        return {"op": "on_waiting_user_resp", "msg": issue}
+    return None
+
+
+# Asynchronous function to process events from the graph and update Streamlit UI
+async def invoke_our_graph(st_messages, st_placeholder, st_state, events=None, metrics=None, control=None):
+    """
+    Asynchronously processes a stream of events from the graph_runnable and updates the Streamlit interface.
+
+    Args:
+        st_messages (list): List of messages to be sent to the graph_runnable.
+        st_placeholder (st.beta_container): Streamlit placeholder used to display updates and statuses.
+        st_state (dict): State information for controlling graph resume behavior and the session's thread ID.
+        events (AsyncIterator[dict], optional): Events to render instead of running the graph, e.g. from
+            stream_trace.replay_events, the graph's state is then left untouched.
+        metrics (TurnMetrics, optional): Collects the node and render timings of this turn.
+        control (RunControl, optional): The control event_loop.run_async cancels the run with, a cancelled run
+            returns None.
+    """
+    print("============================")
+    # Configuration for thread processing with a "specific" thread ID
+    # this is key for dynamic interrupts
+    # it allows the graph to remember the previous conversation
+    # why it stopped and to resume from that point, every Streamlit session has its own thread
+    replaying = events is not None
+    thread_id = st_state.get("thread_id", DEFAULT_THREAD_ID)
+    thread_config = {"configurable": {"thread_id": thread_id}}
+    container = st_placeholder
+    run = None  # the run on the graph server or a worker, if GRAPH_SERVER_URL or GRAPH_WORKERS is set
+
+    if not replaying:
+        if use_remote_graph():
+            # the graph and its checkpoints live on the graph server or the thread's worker, which resumes it
+            run = open_run({"input": st_messages, "thread_id": thread_id,
+                            "resume": bool(st_state.get("graph_resume"))}, affinity=thread_id)
+            events = (load_event(record) async for record in run.astream())
+        else:
+            graph = get_graph()  # compiled with its checkpointer on the first run of the process
+            events = graph_events(graph, st_messages, thread_config, st_state.get("graph_resume"))
+        trace_path = new_trace_path()
+        if trace_path:  # STREAM_TRACE_DIR is set, record the rendered events for offline replay
+            events = record_events(events, trace_path)
+    if metrics is not None:  # node, model and tool timings, and the time this loop spends rendering each event
+        events = observe_events(events, metrics)
+
+    try:
+        async for event in events:
+            name = event["name"]
+
+            # on new response from graph that passes the condition
+            if name == "on_conditional_check":
+                container.info("The length of the word is " + str(event["data"]) + " letters long")
+
+            # the graph issued an interrupt that the user needs to update/handle
+            if name == "on_waiting_user_resp":
+                # Display the issue/error and prompt the user for a new response or update
+                container.error("The length of the word is " + str(event["data"]) + " letters long")
+
+            if name == "on_complete_graph":
+                with container:
+                    st.balloons()
+                    data = event["data"]
+                # Return success message with processed data
+                return {"op": "on_new_graph_msg", "msg": f"Nice, the word is {data['input']}, with length {data['len']}"}
+    except asyncio.CancelledError:
+        if control is None or not control.cancelled:
+            raise
+        return None  # a newer prompt cancelled the run, the graph's checkpoint keeps its finished steps
+
+    if replaying:  # a replayed trace has no graph state behind it
+        return None
+    if run is not None:  # the server or worker checked the thread for an interrupt once the run was over
+        return run.result
+    return pending_interrupt(graph, thread_config)
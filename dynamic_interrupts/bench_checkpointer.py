@@ -0,0 +1,77 @@
+"""
+Compares write and resume latency of the checkpointer backends on the interrupt graph.
+
+Every thread is run into the `NodeInterrupt` once (writes), then a sample of the threads is resumed
+the way astream_events_handler.py does it, with `graph.update_state` and `astream_events(None, ...)`.
+
+    python bench_checkpointer.py --threads 10000 --sample 1000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from checkpointer import SqliteCheckpointSaver
+from graph import builder
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return f"mean {statistics.mean(ordered) * 1000:7.3f} ms  p50 {pick(0.5):7.3f} ms  p99 {pick(0.99):7.3f} ms"
+
+
+async def bench(checkpointer, threads, sample):
+    graph = builder.compile(checkpointer=checkpointer)
+
+    write_latencies = []
+    for i in range(threads):
+        config = {"configurable": {"thread_id": f"thread-{i}"}}
+        start = time.perf_counter()
+        async for _ in graph.astream_events({"input": "toolong"}, config, version="v2"):
+            pass
+        write_latencies.append(time.perf_counter() - start)
+
+    resume_latencies = []
+    for i in random.Random(0).sample(range(threads), sample):
+        config = {"configurable": {"thread_id": f"thread-{i}"}}
+        start = time.perf_counter()
+        graph.update_state(config, {"input": "ok"})
+        async for _ in graph.astream_events(None, config, version="v2"):
+            pass
+        resume_latencies.append(time.perf_counter() - start)
+
+    return write_latencies, resume_latencies
+
+
+def report(name, write_latencies, resume_latencies):
+    print(f"{name:<8} run to interrupt  {percentiles(write_latencies)}")
+    print(f"{name:<8} resume            {percentiles(resume_latencies)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=10_000, help="number of interrupted threads to create")
+    parser.add_argument("--sample", type=int, default=1_000, help="number of threads to resume")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_saver = SqliteCheckpointSaver(os.path.join(tmp, "bench.sqlite"))
+        # the graph nodes print every step, keep that out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            memory_results = await bench(MemorySaver(), args.threads, args.sample)
+            sqlite_results = await bench(sqlite_saver, args.threads, args.sample)
+        sqlite_saver.close()
+    report("memory", *memory_results)
+    report("sqlite", *sqlite_results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
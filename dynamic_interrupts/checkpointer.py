@@ -0,0 +1,377 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables.config import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver that keeps its memory flat when many sessions leave threads behind.
+    Idle threads are evicted after `ttl_seconds` or, least recently used first, once more than
+    `max_threads` are stored, and every thread only retains its newest `max_checkpoints_per_thread`
+    checkpoints, which is all a paused interrupt needs to resume. Pruning and eviction go through an index of
+    each thread's blob keys and checkpoint versions, so they cost the size of that thread, not of the store.
+    """
+
+    def __init__(self, *, ttl_seconds: float = 1800.0, max_threads: int = 1000,
+                 max_checkpoints_per_thread: int = 10, **kwargs: Any):
+        """
+        Initializes the BoundedMemorySaver with its eviction limits.
+        Args:
+            ttl_seconds (float): Seconds a thread may stay idle before it is evicted.
+            max_threads (int): Maximum number of threads kept in memory.
+            max_checkpoints_per_thread (int): Maximum number of checkpoints kept per thread and namespace.
+            **kwargs: Additional keyword arguments for MemorySaver, e.g. serde.
+        """
+        super().__init__(**kwargs)
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self._last_used: "OrderedDict[str, float]" = OrderedDict()  # thread ID -> last access, oldest first
+        self._lock = threading.RLock()
+        # (thread ID, namespace) -> checkpoint ID -> the channel versions that checkpoint points to
+        self._versions: Dict[Tuple[str, str], Dict[str, ChannelVersions]] = {}
+        # (thread ID, namespace) -> keys of its stored channel values in self.blobs
+        self._blob_keys: Dict[Tuple[str, str], set] = {}
+
+    def _touch(self, thread_id: str) -> None:
+        """
+        Marks a thread as most recently used and evicts the threads that expired or overflow the limit.
+        """
+        now = time.monotonic()
+        self._last_used[thread_id] = now
+        self._last_used.move_to_end(thread_id)
+        while self._last_used:
+            oldest, last_used = next(iter(self._last_used.items()))
+            if len(self._last_used) <= self.max_threads and now - last_used <= self.ttl_seconds:
+                break
+            del self._last_used[oldest]
+            self._forget(oldest)
+
+    def _forget(self, thread_id: str) -> None:
+        """
+        Deletes a thread with its writes and blobs, looked up in the index instead of scanning every thread's.
+        """
+        for checkpoint_ns, checkpoints in self.storage.pop(thread_id, {}).items():
+            for checkpoint_id in checkpoints:
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._versions.pop((thread_id, checkpoint_ns), None)
+            for key in self._blob_keys.pop((thread_id, checkpoint_ns), ()):
+                self.blobs.pop(key, None)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        """
+        Drops the oldest checkpoints of a thread above the per-thread cap, with their writes and unused blobs.
+        """
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.max_checkpoints_per_thread:
+            return
+        versions = self._versions.get((thread_id, checkpoint_ns), {})
+        # checkpoint IDs are time ordered, which is also how MemorySaver picks the latest one
+        ordered = sorted(checkpoints)
+        for checkpoint_id in ordered[:-self.max_checkpoints_per_thread]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            versions.pop(checkpoint_id, None)
+
+        # channel values are stored once per version, only keep the versions a retained checkpoint points to
+        referenced = {(thread_id, checkpoint_ns, channel, version)
+                      for channel_versions in versions.values() for channel, version in channel_versions.items()}
+        blob_keys = self._blob_keys.get((thread_id, checkpoint_ns), set())
+        for key in blob_keys - referenced:
+            blob_keys.discard(key)
+            self.blobs.pop(key, None)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            if thread_id in self.storage:
+                self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def list(self, config: Optional[RunnableConfig], **kwargs: Any) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            if config and config["configurable"]["thread_id"] in self.storage:
+                self._touch(config["configurable"]["thread_id"])
+            return iter(list(super().list(config, **kwargs)))
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            self._versions.setdefault((thread_id, checkpoint_ns), {})[checkpoint["id"]] = dict(
+                checkpoint["channel_versions"])
+            self._blob_keys.setdefault((thread_id, checkpoint_ns), set()).update(
+                (thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items())
+            self._prune(thread_id, checkpoint_ns)
+            self._touch(thread_id)
+            return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            self._touch(config["configurable"]["thread_id"])
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._last_used.pop(thread_id, None)
+            self._forget(thread_id)
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver[int]):
+    """
+    File-backed checkpointer on SQLite in WAL mode, pending interrupts survive a server restart.
+    Checkpoints and writes are keyed by (thread_id, checkpoint_ns, checkpoint_id), so resuming a thread
+    is an indexed lookup of its newest checkpoint. The writes of a step are buffered and committed in one
+    transaction with the step's checkpoint, or as soon as an interrupt, error or resume is written, so a pending
+    interrupt is on disk when the run returns. Only the writes of a step in progress can be lost, and at most
+    `batch_size` of them are buffered. Any read commits the buffer first, and superseded checkpoints are
+    compacted away on every commit.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            thread_id TEXT NOT NULL,
+            checkpoint_ns TEXT NOT NULL DEFAULT '',
+            checkpoint_id TEXT NOT NULL,
+            parent_checkpoint_id TEXT,
+            checkpoint_type TEXT NOT NULL,
+            checkpoint BLOB NOT NULL,
+            metadata_type TEXT NOT NULL,
+            metadata BLOB NOT NULL,
+            PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS writes (
+            thread_id TEXT NOT NULL,
+            checkpoint_ns TEXT NOT NULL DEFAULT '',
+            checkpoint_id TEXT NOT NULL,
+            task_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            value_type TEXT NOT NULL,
+            value BLOB NOT NULL,
+            task_path TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str = "checkpoints.sqlite", *, batch_size: int = 64,
+                 max_checkpoints_per_thread: int = 10, **kwargs: Any):
+        """
+        Initializes the SqliteCheckpointSaver and creates its tables if needed.
+        Args:
+            path (str): Path of the SQLite database file.
+            batch_size (int): Number of buffered writes that forces a commit within a step.
+            max_checkpoints_per_thread (int): Maximum number of checkpoints kept per thread and namespace.
+            **kwargs: Additional keyword arguments for BaseCheckpointSaver, e.g. serde.
+        """
+        super().__init__(**kwargs)
+        self.batch_size = batch_size
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # WAL keeps the database consistent without a sync per commit
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.RLock()
+        self._pending_checkpoints: List[Tuple] = []
+        self._pending_writes: List[Tuple] = []  # (replace, row) as special writes overwrite, others don't
+        self._touched: set = set()  # (thread_id, checkpoint_ns) pairs to compact on the next commit
+
+    def flush(self) -> None:
+        """
+        Commits the buffered checkpoints and writes in a single transaction and compacts the touched threads.
+        """
+        with self._lock:
+            if not self._pending_checkpoints and not self._pending_writes:
+                return
+            with self._conn:  # BEGIN ... COMMIT, rolls back on error
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending_checkpoints)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [row for replace, row in self._pending_writes if replace])
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [row for replace, row in self._pending_writes if not replace])
+                for thread_id, checkpoint_ns in self._touched:
+                    self._compact(thread_id, checkpoint_ns)
+            self._pending_checkpoints.clear()
+            self._pending_writes.clear()
+            self._touched.clear()
+
+    def _maybe_flush(self) -> None:
+        if len(self._pending_checkpoints) + len(self._pending_writes) >= self.batch_size:
+            self.flush()
+
+    def _compact(self, thread_id: str, checkpoint_ns: str) -> None:
+        """
+        Deletes the superseded checkpoints of a thread above the per-thread cap, with their writes.
+        """
+        row = self._conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.max_checkpoints_per_thread - 1),
+        ).fetchone()
+        if row is None:
+            return
+        for table in ("checkpoints", "writes"):
+            self._conn.execute(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                (thread_id, checkpoint_ns, row[0]),
+            )
+
+    def _row_to_tuple(self, row: Tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata = row
+        writes = self._conn.execute(
+            "SELECT task_id, channel, value_type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed((checkpoint_type, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                            "checkpoint_id": parent_id}} if parent_id else None,
+            pending_writes=[(task_id, channel, self.serde.loads_typed((value_type, value)))
+                            for task_id, channel, value_type, value in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            self.flush()
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self._row_to_tuple(row) if row else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            self.flush()
+            clauses, params = [], []
+            if config:
+                clauses.append("thread_id = ?")
+                params.append(config["configurable"]["thread_id"])
+                if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                    clauses.append("checkpoint_ns = ?")
+                    params.append(checkpoint_ns)
+                if checkpoint_id := get_checkpoint_id(config):
+                    clauses.append("checkpoint_id = ?")
+                    params.append(checkpoint_id)
+            if before and (before_id := get_checkpoint_id(before)):
+                clauses.append("checkpoint_id < ?")
+                params.append(before_id)
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            rows = self._conn.execute(f"SELECT * FROM checkpoints {where} ORDER BY checkpoint_id DESC", params)
+            results = []
+            for row in rows.fetchall():
+                checkpoint_tuple = self._row_to_tuple(row)
+                if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                results.append(checkpoint_tuple)
+                if limit is not None and len(results) >= limit:
+                    break
+        return iter(results)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_type, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self._lock:
+            self._pending_checkpoints.append((
+                thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                checkpoint_type, serialized_checkpoint, metadata_type, serialized_metadata,
+            ))
+            self._touched.add((thread_id, checkpoint_ns))
+            self.flush()  # the checkpoint finishes a step, it goes to disk with the step's writes
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            special = False
+            for idx, (channel, value) in enumerate(writes):
+                value_type, serialized_value = self.serde.dumps_typed(value)
+                write_idx = WRITES_IDX_MAP.get(channel, idx)
+                special = special or write_idx < 0
+                self._pending_writes.append((write_idx < 0, (
+                    thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx,
+                    channel, value_type, serialized_value, task_path,
+                )))
+            if special:  # e.g. an interrupt, the run may end here without another checkpoint
+                self.flush()
+            else:
+                self._maybe_flush()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self.flush()
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def close(self) -> None:
+        """
+        Commits any buffered writes and closes the database.
+        """
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+    # The graph streams with astream_events, SQLite calls are short so they run inline like MemorySaver's
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None
+                    ) -> AsyncIterator[CheckpointTuple]:
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return self.delete_thread(thread_id)
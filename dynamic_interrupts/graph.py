@@ -1,11 +1,14 @@
+import os
+from functools import lru_cache
 from typing import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langchain_core.runnables.config import RunnableConfig
 #  https://api.python.langchain.com/en/latest/callbacks/langchain_core.callbacks.manager.adispatch_custom_event.html
 from langchain_core.callbacks import adispatch_custom_event
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.errors import NodeInterrupt  # interrupt for human-in-the-loop intervention
 
+from checkpointer import BoundedMemorySaver, SqliteCheckpointSaver
+
 # This state contains a single field "input" which holds the user-provided string or None for graph resume
 class State(TypedDict):
     input: str
@@ -47,7 +50,21 @@ builder.add_edge("step_1", "step_2")
 builder.add_edge("step_2", "step_3")
 builder.add_edge("step_3", END)
 
-# Create a memory saver to store graph states by thread and allow state recovery
-memory = MemorySaver()
+@lru_cache(maxsize=None)
+def get_graph():
+    """
+    Returns the compiled graph with its checkpointer, built once per process on the first call, so every session
+    and rerun shares the checkpoints. The app imports this module after drawing the page.
+    Returns:
+        CompiledStateGraph: The runnable graph.
+    """
+    # Create a memory saver to store graph states by thread and allow state recovery,
+    # idle threads of closed sessions are evicted and each thread keeps only its newest checkpoints.
+    # Setting CHECKPOINT_DB to a file path stores them in SQLite instead, so pending interrupts survive a restart
+    if os.getenv("CHECKPOINT_DB"):
+        memory = SqliteCheckpointSaver(os.getenv("CHECKPOINT_DB"), max_checkpoints_per_thread=10)
+    else:
+        memory = BoundedMemorySaver(ttl_seconds=30 * 60, max_threads=1000, max_checkpoints_per_thread=10)
+
+    return builder.compile(checkpointer=memory)
 
-graph = builder.compile(checkpointer=memory)
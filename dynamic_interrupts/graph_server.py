@@ -0,0 +1,33 @@
+"""
+Serves the graph of this example over HTTP, so the app can run it in another process or on another machine.
+The graph and its checkpoints live in the server, an interrupted thread is resumed there.
+
+Runs are streamed as Server-Sent Events (POST /runs/stream) or over a WebSocket (/runs/ws), one record per
+event the handler renders, and end with the interrupt the run stopped at, if any. Start the server from this
+directory and point the app at it:
+
+    uvicorn graph_server:app --port 8500
+    GRAPH_SERVER_URL=http://127.0.0.1:8500 streamlit run app.py
+
+Set GRAPH_SERVER_TRANSPORT=ws for the app to use the WebSocket instead.
+"""
+from astream_events_handler import graph_events, pending_interrupt
+from graph import get_graph
+from remote_graph import create_app
+from stream_trace import RECORDED_EVENTS, dump_event
+
+# the rendered events and the chain events the app's metrics time the nodes with
+FORWARDED_EVENTS = RECORDED_EVENTS | {"on_chain_start", "on_chain_end"}
+
+
+# also what the workers of GRAPH_WORKERS run, see worker_pool.py
+async def run_graph(payload, emit):
+    graph = get_graph()
+    thread_config = {"configurable": {"thread_id": payload["thread_id"]}}
+    async for event in graph_events(graph, payload["input"], thread_config, payload.get("resume")):
+        if event["event"] in FORWARDED_EVENTS:
+            emit(dump_event(event))
+    return pending_interrupt(graph, thread_config)
+
+
+app = create_app(run_graph)
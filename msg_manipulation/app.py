@@ -4,8 +4,13 @@ from dotenv import load_dotenv
 import streamlit as st
 from langchain_core.messages import AIMessage, HumanMessage
 
-from graph import invoke_our_graph
-from st_callable_util import get_streamlit_cb
+from chat_history import message_markdown, render_chat_history
+from event_loop import get_event_loop, run_async  # Runs the graph on a persistent event loop shared by all sessions
+from llm_clients import warm_up  # Opens the pooled connection to the model provider ahead of the first turn
+from preload import preload  # Imports and builds the graph in the background once the page is drawn
+from run_control import RunCancelled, RunControl  # Cancels a running graph on a Stop click or a newer prompt
+from st_callable_util import get_async_streamlit_cb
+from turn_metrics import TurnMetrics, render_metrics_panel, report_turn  # Per-turn timings and their export
 
 load_dotenv()
 
@@ -32,6 +37,9 @@ if not os.getenv('OPENAI_API_KEY'):
         st.info("Please enter your OPENAI_API_KEY in the sidebar.")
         st.stop()
 
+# Open a keep-alive connection on the graph's event loop (once per process) so the first prompt skips the TLS handshake
+warm_up(get_event_loop())
+
 st.markdown("""
     <style>
     .stButton>button {
@@ -46,6 +54,11 @@ st.markdown("""
     .stButton>button:hover {
         opacity: 1; /* Make visible on hover */
     }
+    .st-key-stop_generation .stButton>button {
+        left: 0px; /* The Stop button of a running answer stays in place */
+        padding: 0px 12px;
+        opacity: 1; /* and visible */
+    }
     </style>
 """, unsafe_allow_html=True)
 
@@ -72,26 +85,30 @@ msg_view_container = st.container()
 if "messages" not in st.session_state:
     st.session_state["messages"] = [AIMessage(content="How can I help you?")]
 
+def render_message(index, msg):
+    msg_val = index + 1  # 1-based position in st.session_state.messages, used by click_delete
+    if isinstance(msg, AIMessage):
+        name = "assistant"
+    elif isinstance(msg, HumanMessage):
+        name = "user"
+    else:
+        return
+    with st.container():
+        # col1, col2, col3 = st.columns([8, 1, 1])
+        col1, col3 = st.columns([9, 1])
+        with col1:
+            st.chat_message(name).write(message_markdown(msg))
+        if name == "user":
+            # with col2:
+            #     with st.chat_message(name, avatar=":material/edit:"):
+            #         st.button("", key=msg_val, on_click=click_edit, args=[msg_val, msg.content])
+            with col3:
+                with st.chat_message(name, avatar=":material/delete:"):
+                    st.button("", key=-msg_val, on_click=click_delete, args=[msg_val])
+
+# only the newest turns get their columns and delete buttons built, earlier turns are loaded on demand
 with msg_view_container:
-    for msg_val, msg in enumerate(st.session_state.messages, start=1):
-        if isinstance(msg, AIMessage):
-            name = "assistant"
-        elif isinstance(msg, HumanMessage):
-            name = "user"
-        else:
-            continue
-        with st.container():
-            # col1, col2, col3 = st.columns([8, 1, 1])
-            col1, col3 = st.columns([9, 1])
-            with col1:
-                st.chat_message(name).write(msg.content)
-            if name == "user":
-                # with col2:
-                #     with st.chat_message(name, avatar=":material/edit:"):
-                #         st.button("", key=msg_val, on_click=click_edit, args=[msg_val, msg.content])
-                with col3:
-                    with st.chat_message(name, avatar=":material/delete:"):
-                        st.button("", key=-msg_val, on_click=click_delete, args=[msg_val])
+    render_chat_history(st.session_state.messages, render_message)
 
 if prompt := st.chat_input():
     st.session_state.messages.append(HumanMessage(content=prompt))
@@ -108,6 +125,30 @@ if prompt := st.chat_input():
                 st.button("", key=-msg_val, on_click=click_delete, args=[msg_val])
 
     with st.chat_message("assistant"):
-        st_callback = get_streamlit_cb(st.container())
-        response = invoke_our_graph(st.session_state.messages, [st_callback])
-        st.session_state.messages.append(AIMessage(content=response["messages"][-1].content))
+        control = RunControl()  # cancels the run on a Stop click, a newer prompt or the user leaving
+        st_callback = get_async_streamlit_cb(st.container(), control=control)
+        stop_placeholder = st.empty()
+        # clicking Stop reruns the script, which cancels the run and keeps the answer streamed so far
+        stop_placeholder.button("Stop", key="stop_generation")
+        from graph import ainvoke_our_graph  # usually preloaded already, see the end of the script
+        metrics = TurnMetrics()  # node, model, tool and render timings of this turn
+        try:
+            # awaited on the shared event loop, the callbacks queue what this thread renders while it waits
+            response = run_async(ainvoke_our_graph(st.session_state.messages, [st_callback], metrics, control),
+                                 control=control)
+            answer = response["messages"][-1].content
+        except RunCancelled:
+            answer = control.partial_text  # the tokens streamed before the run was cancelled
+        stop_placeholder.empty()
+        report_turn(metrics)  # exported to the metrics endpoint and the JSONL sink if enabled
+        st.session_state.turn_metrics = metrics
+        if answer:
+            st.session_state.messages.append(AIMessage(content=answer))
+        control.resume()  # carries out the rerun or stop that cancelled the run, now that its answer is saved
+
+# Optional sidebar panel with the timings of the last turn
+render_metrics_panel(st.session_state.get("turn_metrics"))
+
+# The page is drawn, import the graph and build it in the background (once per process) ahead of the first prompt
+preload("graph", "get_graph_runnable")
+preload("remote_graph", "start_graph_workers")  # the worker processes, if GRAPH_WORKERS is set
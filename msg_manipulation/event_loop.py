@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import types
+from concurrent.futures import Future
+from typing import Any, Coroutine, Generator, Optional, TypeVar
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+T = TypeVar("T")
+
+# The long-lived event loop of this server process, started lazily on its own daemon thread
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the process-wide background event loop, starting it on first use.
+    Async clients, connection pools and tasks bound to it survive across reruns and chat turns.
+    Returns:
+        asyncio.AbstractEventLoop: The running background event loop.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="graph-event-loop", daemon=True).start()
+    return _loop
+
+
+@types.coroutine
+def _with_script_run_ctx(coro: Coroutine[Any, Any, T], ctx) -> Generator[Any, Any, T]:
+    """
+    Drives `coro` step by step and re-attaches the Streamlit script context to the loop thread before each step.
+    Sessions share the loop thread, so attaching the context once would let a concurrent run of another
+    session render into the wrong page, a step never yields to another task before it finishes.
+    """
+    thread = threading.current_thread()
+    send_value, error = None, None
+    while True:
+        add_script_run_ctx(thread, ctx)
+        try:
+            if error is None:
+                yielded = coro.send(send_value)
+            else:
+                yielded = coro.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send_value, error = (yield yielded), None
+        except GeneratorExit:
+            coro.close()
+            raise
+        except BaseException as e:  # e.g. CancelledError thrown into the task, forwarded to the coroutine
+            send_value, error = None, e
+
+
+async def _run_with_script_run_ctx(coro: Coroutine[Any, Any, T], ctx) -> T:
+    return await _with_script_run_ctx(coro, ctx)
+
+
+def submit(coro: Coroutine[Any, Any, T]) -> Future:
+    """
+    Schedules `coro` on the background event loop from any thread, e.g. the Streamlit script thread.
+    The caller's Streamlit script context goes along so the coroutine can render into the page.
+    Args:
+        coro (Coroutine): The coroutine to run.
+    Returns:
+        Future: A thread-safe future resolving to the result of the coroutine.
+    """
+    return asyncio.run_coroutine_threadsafe(_run_with_script_run_ctx(coro, get_script_run_ctx()), get_event_loop())
+
+
+async def _cancel_on(coro: Coroutine[Any, Any, T], control) -> T:
+    # cancelling the task throws CancelledError into whatever the run awaits, e.g. the model's HTTP stream
+    task, loop = asyncio.current_task(), asyncio.get_running_loop()
+    control.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    return await coro
+
+
+def run_async(coro: Coroutine[Any, Any, T], timeout: Optional[float] = None, control=None) -> T:
+    """
+    Runs `coro` on the background event loop and blocks the calling thread until it is done.
+    A drop-in replacement for asyncio.run that doesn't create and tear down an event loop per call.
+    Args:
+        coro (Coroutine): The coroutine to run.
+        timeout (Optional[float]): Seconds to wait for the result, waits forever if None.
+        control (Optional[RunControl]): Cancels the coroutine's task on a Stop click, a newer prompt or
+            the user leaving, the coroutine may catch the CancelledError and return a partial result.
+    Returns:
+        T: The result of the coroutine.
+    """
+    if control is None:
+        return submit(coro).result(timeout)
+    return control.wait(submit(_cancel_on(coro, control)))
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence, Tuple
+
+import httpx
+
+if TYPE_CHECKING:  # langchain_openai takes most of a second to import, it's imported with the first chat model
+    from langchain_core.runnables import Runnable
+    from langchain_core.tools import BaseTool
+    from langchain_openai import ChatOpenAI
+
+# Connection limits of the keep-alive pool shared by every session and every graph step in this process
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=120.0)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# Chat models kept per (API key, model parameters), the least recently used ones beyond this are dropped so keys
+# entered at runtime don't keep a client and the secret alive for the life of the process
+MAX_CHAT_MODELS = 8
+# (API key, model parameters) -> the chat model and its bind_tools results keyed by (tool names, bind kwargs),
+# the bound models go with their chat model. Guarded by a lock as sessions run in parallel
+_chat_models: "OrderedDict[Tuple, Tuple[ChatOpenAI, Dict[Tuple, Runnable]]]" = OrderedDict()
+_chat_models_lock = threading.Lock()
+_warmed_up = threading.Event()
+
+
+@lru_cache(maxsize=None)
+def get_http_client() -> httpx.Client:
+    """
+    Returns the process-wide pooled HTTP client, connections are kept alive and reused across requests.
+    Returns:
+        httpx.Client: The shared HTTP client.
+    """
+    return httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Returns the process-wide pooled async HTTP client for `ainvoke` and `astream`.
+    Its connections belong to the event loop that opened them, use it from the shared loop of event_loop.py only.
+    Returns:
+        httpx.AsyncClient: The shared async HTTP client.
+    """
+    return httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
+def _cached_chat_model(**model_params: Any) -> Tuple["ChatOpenAI", Dict[Tuple, "Runnable"]]:
+    from langchain_openai import ChatOpenAI
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    key = (api_key, tuple(sorted(model_params.items())))
+    with _chat_models_lock:
+        cached = _chat_models.get(key)
+        if cached is None:
+            llm = ChatOpenAI(api_key=api_key, http_client=get_http_client(),
+                             http_async_client=get_async_http_client(), **model_params)
+            cached = _chat_models[key] = (llm, {})
+            if len(_chat_models) > MAX_CHAT_MODELS:
+                _chat_models.popitem(last=False)
+        else:
+            _chat_models.move_to_end(key)
+    return cached
+
+
+def get_chat_model(**model_params: Any) -> "ChatOpenAI":
+    """
+    Returns the shared ChatOpenAI instance for the given model parameters, creating it on first use.
+    The API key is part of the cache key because the apps let the user enter it at runtime,
+    the MAX_CHAT_MODELS most recently used models are kept.
+    Args:
+        **model_params: Keyword arguments for ChatOpenAI, e.g. temperature and streaming.
+    Returns:
+        ChatOpenAI: A chat model that sends its requests through the pooled HTTP client.
+    """
+    return _cached_chat_model(**model_params)[0]
+
+
+def get_chat_model_with_tools(tools: Sequence["BaseTool"], bind_kwargs: Optional[Dict[str, Any]] = None,
+                              **model_params: Any) -> "Runnable":
+    """
+    Returns the shared chat model with `tools` bound, the tool schemas are only converted once per model
+    and the bound model is dropped with its chat model.
+    Args:
+        tools (Sequence[BaseTool]): The tools to bind to the chat model.
+        bind_kwargs (Dict[str, Any]): Extra keyword arguments for bind_tools, e.g. parallel_tool_calls.
+        **model_params: Keyword arguments for ChatOpenAI, e.g. temperature and streaming.
+    Returns:
+        Runnable: The chat model with the tools bound.
+    """
+    bind_kwargs = bind_kwargs or {}
+    llm, bound_models = _cached_chat_model(**model_params)
+    key = (tuple(t.name for t in tools), tuple(sorted(bind_kwargs.items())))
+    with _chat_models_lock:
+        bound = bound_models.get(key)
+        if bound is None:
+            bound = bound_models[key] = llm.bind_tools(tools, **bind_kwargs)
+    return bound
+
+
+def warm_up(loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+    """
+    Opens a pooled connection to the OpenAI API in the background, once per process,
+    so the first chat turn doesn't pay for DNS, TCP and TLS setup.
+    Args:
+        loop (Optional[asyncio.AbstractEventLoop]): The shared event loop, if the graph runs on it
+            the connection is opened for the async HTTP client instead.
+    """
+    if _warmed_up.is_set():
+        return
+    _warmed_up.set()
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+    def connect() -> None:
+        try:
+            get_http_client().head(base_url)  # Any response means the connection is open and pooled
+        except httpx.HTTPError:
+            pass  # The real request will surface connection problems
+
+    async def aconnect() -> None:
+        try:
+            await get_async_http_client().head(base_url)
+        except httpx.HTTPError:
+            pass
+
+    if loop is not None:
+        asyncio.run_coroutine_threadsafe(aconnect(), loop)
+        return
+    threading.Thread(target=connect, name="llm-warm-up", daemon=True).start()
@@ -0,0 +1,293 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Callable, Deque, Dict, Optional, Sequence
+
+from langchain_core.callbacks import adispatch_custom_event, dispatch_custom_event
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import ensure_config
+
+from run_control import CancelCallbackHandler, RunCancelled, RunControl
+from turn_metrics import RATE_LIMIT_EVENT  # the turn metrics add up the waits it reports
+
+# Priorities of the queued model calls, a lower one is served first
+INTERACTIVE = 0  # the answer of a chat turn, a user is watching
+BACKGROUND = 1  # e.g. folding older turns into the summary
+CANCEL_POLL_INTERVAL = 0.1  # seconds a blocked caller waits between two checks of its RunControl
+
+
+class _TokenBucket:
+    """
+    Holds up to `per_minute` units and refills at `per_minute` units a minute.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def seconds_until(self, amount: float) -> float:
+        # a request over the capacity waits for a full bucket instead of forever
+        return max(0.0, min(amount, self.capacity) - self.level) / self.rate
+
+
+class _Request:
+    __slots__ = ("tokens", "session", "priority", "grant", "granted")
+
+    def __init__(self, tokens: int, session: Any, priority: int, grant: Callable[[], None]):
+        self.tokens = tokens
+        self.session = session
+        self.priority = priority
+        self.grant = grant
+        self.granted = False
+
+
+class RateLimiter:
+    """
+    Process-wide token buckets for the requests and tokens per minute of the outbound model calls, so concurrent
+    sessions stay within the provider's limits instead of running into its 429s and piling up retries.
+    Waiting calls queue per session and the sessions take turns, so one session's burst doesn't hold up the
+    others, interactive answers go before background calls. A thread hands out the buckets, both to callers
+    blocking a thread and to coroutines awaiting on an event loop.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        """
+        Initializes the RateLimiter, both buckets start full.
+        Args:
+            requests_per_minute (Optional[float]): Model calls a minute, unlimited if None.
+            tokens_per_minute (Optional[float]): Prompt and answer tokens a minute, unlimited if None.
+        """
+        self.requests = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        # priority -> session -> its waiting requests, the sessions in the order they take turns
+        self._queues: Dict[int, "OrderedDict[Any, Deque[_Request]]"] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def _next(self) -> Optional[_Request]:
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                return next(iter(sessions.values()))[0]
+        return None
+
+    def _seconds_until(self, request: _Request) -> float:
+        now = time.monotonic()
+        waits = [0.0]
+        if self.requests is not None:
+            self.requests.refill(now)
+            waits.append(self.requests.seconds_until(1))
+        if self.tokens is not None:
+            self.tokens.refill(now)
+            waits.append(self.tokens.seconds_until(request.tokens))
+        return max(waits)
+
+    def _dispatch(self) -> None:
+        with self._cond:
+            while True:
+                request = self._next()
+                if request is None:
+                    self._cond.wait()
+                    continue
+                wait = self._seconds_until(request)
+                if wait > 0:
+                    self._cond.wait(wait)  # a newer request of a higher priority may arrive meanwhile
+                    continue
+                if self.requests is not None:
+                    self.requests.level -= 1
+                if self.tokens is not None:
+                    self.tokens.level -= request.tokens
+                self._remove(request)
+                sessions = self._queues[request.priority]
+                if request.session in sessions:  # the session's next request waits for the other sessions' turns
+                    sessions.move_to_end(request.session)
+                request.granted = True
+                request.grant()
+
+    def _enqueue(self, request: _Request) -> None:
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name="rate-limiter", daemon=True)
+                self._thread.start()
+            self._queues.setdefault(request.priority, OrderedDict()).setdefault(request.session, deque()).append(
+                request)
+            self._cond.notify()
+
+    def _remove(self, request: _Request) -> None:
+        sessions = self._queues[request.priority]
+        waiting = sessions.get(request.session)
+        if waiting is not None and request in waiting:
+            waiting.remove(request)
+            if not waiting:
+                del sessions[request.session]
+
+    def acquire(self, tokens: int, session: Any = None, priority: int = INTERACTIVE,
+                control: Optional[RunControl] = None) -> float:
+        """
+        Blocks until the call may be sent, a call whose run is cancelled meanwhile leaves the queue.
+        Args:
+            tokens (int): Estimated tokens of the call, prompt and answer.
+            session (Any): The session the call is queued under, calls without one share a queue.
+            priority (int): INTERACTIVE or BACKGROUND.
+            control (Optional[RunControl]): The control of the run, checked every CANCEL_POLL_INTERVAL seconds.
+        Returns:
+            float: Seconds the call waited.
+        Raises:
+            RunCancelled: If the run was cancelled before the call got its turn.
+        """
+        start = time.perf_counter()
+        granted = threading.Event()
+        request = _Request(tokens, session, priority, granted.set)
+        self._enqueue(request)
+        while not granted.wait(CANCEL_POLL_INTERVAL):
+            if control is not None and control.cancelled:
+                with self._cond:
+                    if not request.granted:
+                        self._remove(request)
+                        self._cond.notify()
+                        raise RunCancelled()
+        return time.perf_counter() - start
+
+    async def aacquire(self, tokens: int, session: Any = None, priority: int = INTERACTIVE) -> float:
+        """
+        Async version of `acquire`, a cancelled call leaves the queue.
+        """
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant() -> None:
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        request = _Request(tokens, session, priority, grant)
+        self._enqueue(request)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._cond:
+                if not request.granted:
+                    self._remove(request)
+                    self._cond.notify()
+            raise
+        return time.perf_counter() - start
+
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        """
+        Corrects the token bucket by what a call actually used, once the provider reported it.
+        Args:
+            estimated (int): The tokens the call was acquired with.
+            actual (Optional[int]): The tokens the provider counted, nothing is corrected if None.
+        """
+        if self.tokens is None or actual is None:
+            return
+        with self._cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
+            self._cond.notify()
+
+
+@lru_cache(maxsize=None)
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """
+    Returns the process-wide RateLimiter, or None if no limit is set.
+    Opt-in: RATE_LIMIT_RPM limits the model calls and RATE_LIMIT_TPM the tokens per minute of the provider's key.
+    Every process calling the model gets an equal share, RATE_LIMIT_PROCESSES is the number of processes that
+    share the key. The worker pool of GRAPH_WORKERS sets it for its workers, set it for several graph servers.
+    Read on first use rather than at import, the apps load their .env after importing the graph.
+    Returns:
+        Optional[RateLimiter]: The shared limiter.
+    """
+    rpm, tpm = os.getenv("RATE_LIMIT_RPM"), os.getenv("RATE_LIMIT_TPM")
+    if not (rpm or tpm):
+        return None
+    processes = int(os.getenv("RATE_LIMIT_PROCESSES", "1"))
+    return RateLimiter(requests_per_minute=float(rpm) / processes if rpm else None,
+                       tokens_per_minute=float(tpm) / processes if tpm else None)
+
+
+def estimate_tokens(messages: Sequence[BaseMessage]) -> int:
+    """
+    Estimates the tokens a model call is counted for before sending it: its prompt, counted like the context
+    window does, and RATE_LIMIT_OUTPUT_TOKENS for the answer.
+    Args:
+        messages (Sequence[BaseMessage]): The messages sent to the model.
+    Returns:
+        int: The estimated tokens.
+    """
+    from context_window import get_context_window  # it calls the model through this module
+
+    window = get_context_window()
+    return sum(window.count_tokens(m) for m in messages) + int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", "512"))
+
+
+def _used_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+def _queued_call():
+    # the session of the graph run the call is made in and whether it has callbacks to report the wait to
+    config = ensure_config()
+    metadata, configurable = config.get("metadata") or {}, config.get("configurable") or {}
+    return metadata.get("session_id") or configurable.get("thread_id"), config.get("callbacks") is not None
+
+
+def _run_control() -> Optional[RunControl]:
+    # the control of the graph run the call is made in, from its CancelCallbackHandler
+    callbacks = ensure_config().get("callbacks")
+    handlers = getattr(callbacks, "handlers", callbacks) or []
+    return next((handler.control for handler in handlers if isinstance(handler, CancelCallbackHandler)), None)
+
+
+def invoke_rate_limited(llm: Runnable, messages: Sequence[BaseMessage], priority: int = INTERACTIVE,
+                        config: Optional[Dict[str, Any]] = None) -> BaseMessage:
+    """
+    Invokes `llm` once the rate limiter lets the call through, or right away if no limit is set.
+    In a graph run the call queues under the run's session, metadata "session_id", and the seconds it waited are
+    dispatched as the custom event RATE_LIMIT_EVENT, for the turn metrics to tell throttling from model latency.
+    Args:
+        llm (Runnable): The chat model, optionally with tools bound.
+        messages (Sequence[BaseMessage]): The messages sent to the model.
+        priority (int): INTERACTIVE or BACKGROUND.
+        config (Optional[Dict[str, Any]]): Config of the model call.
+    Returns:
+        BaseMessage: The model's response.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return llm.invoke(messages, config)
+    tokens = estimate_tokens(messages)
+    session, in_run = _queued_call()
+    waited = limiter.acquire(tokens, session, priority, _run_control())  # a Stop click or rerun ends the wait
+    if in_run:
+        dispatch_custom_event(RATE_LIMIT_EVENT, {"seconds": waited, "tokens": tokens})
+    response = llm.invoke(messages, config)
+    limiter.settle(tokens, _used_tokens(response))
+    return response
+
+
+async def ainvoke_rate_limited(llm: Runnable, messages: Sequence[BaseMessage], priority: int = INTERACTIVE,
+                               config: Optional[Dict[str, Any]] = None) -> BaseMessage:
+    """
+    Async version of `invoke_rate_limited`.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return await llm.ainvoke(messages, config)
+    tokens = estimate_tokens(messages)
+    session, in_run = _queued_call()
+    waited = await limiter.aacquire(tokens, session, priority)
+    if in_run:
+        await adispatch_custom_event(RATE_LIMIT_EVENT, {"seconds": waited, "tokens": tokens})
+    response = await llm.ainvoke(messages, config)
+    limiter.settle(tokens, _used_tokens(response))
+    return response
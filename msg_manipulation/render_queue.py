@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import deque
+from typing import Any, List, Optional, Tuple
+
+# Kind of the queued events that carry streamed tokens, consecutive ones are merged into one frame
+TOKEN = "token"
+
+
+class RenderQueue:
+    """
+    Bounded queue between a graph run and the Streamlit script thread that renders it.
+    The graph's callbacks only put events, the script thread takes them in batches and renders them, so a
+    slow websocket no longer slows down reading tokens from the model.
+
+    Backpressure policy:
+      - a token never blocks the model, it is merged into the newest frame if that is a token frame
+        as well, so a consumer that falls behind renders the text of many tokens in one frame
+      - any other event, e.g. a tool call, is kept and waits while the queue holds `maxsize` events
+      - once closed, e.g. when the run is cancelled, new events are dropped and nothing waits
+    """
+
+    def __init__(self, maxsize: int = 256):
+        """
+        Initializes the RenderQueue.
+        Args:
+            maxsize (int): Number of queued events past which events other than tokens wait for the consumer.
+        """
+        self.maxsize = maxsize
+        self.merged_tokens = 0  # tokens that went into an already queued frame instead of a frame of their own
+        self.blocked_seconds = 0.0  # time producers spent waiting for the consumer
+        self._events: deque = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put_token(self, text: str) -> None:
+        """
+        Queues a streamed token without ever waiting for the consumer.
+        A token frame is [text, number of tokens], so the renderer keeps counting tokens.
+        Args:
+            text (str): The token.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            if self._events and self._events[-1][0] == TOKEN:
+                frame = self._events[-1][1]
+                frame[0] += text
+                frame[1] += 1
+                self.merged_tokens += 1
+                return
+            self._events.append((TOKEN, [text, 1]))
+            self._cond.notify()
+
+    def put(self, kind: str, *args: Any) -> None:
+        """
+        Queues an event other than a token, waits while the queue is full.
+        Args:
+            kind (str): Name of the event, the consumer picks its renderer by it.
+            *args (Any): Arguments of the event.
+        """
+        with self._cond:
+            if len(self._events) >= self.maxsize and not self._closed:
+                start = time.perf_counter()
+                self._cond.wait_for(lambda: len(self._events) < self.maxsize or self._closed)
+                self.blocked_seconds += time.perf_counter() - start
+            if self._closed:
+                return
+            self._events.append((kind, args))
+            self._cond.notify()
+
+    def get_batch(self, timeout: Optional[float] = None) -> List[Tuple[str, Any]]:
+        """
+        Takes every queued event, waiting up to `timeout` seconds for the first one.
+        Returns:
+            List[Tuple[str, Any]]: (kind, args) per event, (TOKEN, [text, tokens]) per token frame.
+                Empty if nothing arrived in time or the queue is closed and drained.
+        """
+        with self._cond:
+            if not self._events and not self._closed:
+                self._cond.wait(timeout)
+            batch = list(self._events)
+            self._events.clear()
+            self._cond.notify_all()  # producers waiting for room
+            return batch
+
+    def close(self) -> None:
+        """
+        Stops accepting events, the queued ones can still be taken. Wakes up waiting producers and the consumer.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable, RunnableBinding
+
+from rate_limiter import ainvoke_rate_limited, invoke_rate_limited
+
+# Words with their trailing whitespace, roughly the granularity a model streams at
+TOKEN_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _normalize_message(message: BaseMessage) -> Dict[str, Any]:
+    """
+    Reduces a message to what the model sees, IDs are left out as they differ on every turn.
+    """
+    normalized = {"type": message.type, "content": message.content}
+    if getattr(message, "tool_calls", None):
+        normalized["tool_calls"] = [{"name": c["name"], "args": c["args"]} for c in message.tool_calls]
+    if getattr(message, "name", None) and message.type == "tool":
+        normalized["name"] = message.name
+    return normalized
+
+
+class CachedResponseReplay(BaseChatModel):
+    """
+    Chat model that streams back a cached response as synthetic tokens, so a cache hit emits the same
+    `on_llm_new_token` callbacks and `on_chat_model_stream` events a real model call does.
+    """
+
+    message: AIMessage
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "cached-response-replay"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self.message)])
+
+    def _chunks(self) -> Iterator[ChatGenerationChunk]:
+        for token in TOKEN_RE.findall(self.message.content):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        if self.message.tool_calls:
+            # fresh tool call IDs, the replayed calls get answered by new ToolMessages in this conversation
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": f"call_{uuid.uuid4().hex[:24]}",
+                 "index": index}
+                for index, call in enumerate(self.message.tool_calls)
+            ]))
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for chunk in self._chunks():
+            if run_manager and chunk.message.content:
+                run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for chunk in self._chunks():
+            if run_manager and chunk.message.content:
+                await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+
+class ResponseCache:
+    """
+    Exact-match cache of model responses keyed on the normalized message history, the model name,
+    its temperature and the bound tool schemas. Entries live in an in-memory LRU and, if `disk_dir`
+    is set, also as JSON files so they survive restarts and are shared between server processes.
+    """
+
+    def __init__(self, max_entries: int = 512, disk_dir: Optional[str] = None):
+        """
+        Initializes the ResponseCache.
+        Args:
+            max_entries (int): Maximum number of responses kept in memory.
+            disk_dir (Optional[str]): Directory of the on-disk tier, disabled if None.
+        """
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0  # Sum of the original model latencies of all cache hits
+
+    @staticmethod
+    def make_key(llm: Runnable, messages: Sequence[BaseMessage]) -> str:
+        """
+        Builds a stable hash of everything that determines the model's answer.
+        Args:
+            llm (Runnable): The chat model, optionally with tools bound.
+            messages (Sequence[BaseMessage]): The message history sent to the model.
+        Returns:
+            str: The cache key.
+        """
+        model, bound_kwargs = (llm.bound, llm.kwargs) if isinstance(llm, RunnableBinding) else (llm, {})
+        payload = {
+            "model": getattr(model, "model_name", type(model).__name__),
+            "temperature": getattr(model, "temperature", None),
+            "bound": bound_kwargs,  # the converted tool schemas and tool options of bind_tools
+            "messages": [_normalize_message(m) for m in messages],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.disk_dir:
+            try:
+                with open(os.path.join(self.disk_dir, f"{key}.json")) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, message: AIMessage, latency: float) -> None:
+        entry = {"content": message.content, "tool_calls": [{"name": c["name"], "args": c["args"]}
+                                                            for c in message.tool_calls], "latency": latency}
+        self._remember(key, entry)
+        if self.disk_dir:
+            tmp_path = os.path.join(self.disk_dir, f"{key}.{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, os.path.join(self.disk_dir, f"{key}.json"))  # atomic for concurrent readers
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invoke(self, llm: Runnable, messages: Sequence[BaseMessage]) -> BaseMessage:
+        """
+        Invokes `llm` with `messages`, or replays the cached response as a token stream on a hit.
+        Args:
+            llm (Runnable): The chat model, optionally with tools bound.
+            messages (Sequence[BaseMessage]): The message history sent to the model.
+        Returns:
+            BaseMessage: The model's response.
+        """
+        key = self.make_key(llm, messages)
+        replay = self._replay(key)
+        if replay is not None:
+            return replay.invoke(messages)
+
+        start = time.perf_counter()
+        response = invoke_rate_limited(llm, messages)  # only a miss goes out to the provider
+        self._store(key, response, time.perf_counter() - start)
+        return response
+
+    async def ainvoke(self, llm: Runnable, messages: Sequence[BaseMessage]) -> BaseMessage:
+        """
+        Async version of `invoke`, the model call and the replayed tokens run on the caller's event loop.
+        The disk tier, if enabled, is still read and written synchronously.
+        Args:
+            llm (Runnable): The chat model, optionally with tools bound.
+            messages (Sequence[BaseMessage]): The message history sent to the model.
+        Returns:
+            BaseMessage: The model's response.
+        """
+        key = self.make_key(llm, messages)
+        replay = self._replay(key)
+        if replay is not None:
+            return await replay.ainvoke(messages)
+
+        start = time.perf_counter()
+        response = await ainvoke_rate_limited(llm, messages)
+        self._store(key, response, time.perf_counter() - start)
+        return response
+
+    def _replay(self, key: str) -> Optional[CachedResponseReplay]:
+        # the model replaying the cached response of `key`, None on a miss
+        entry = self.get(key)
+        if entry is None:
+            return None
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += entry["latency"]
+        tool_calls = [{"name": c["name"], "args": c["args"], "id": None} for c in entry["tool_calls"]]
+        return CachedResponseReplay(message=AIMessage(content=entry["content"], tool_calls=tool_calls), streaming=True)
+
+    def _store(self, key: str, response: BaseMessage, latency: float) -> None:
+        with self._lock:
+            self.misses += 1
+        self.put(key, response, latency)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit rate and the model latency saved by cache hits.
+        Returns:
+            Dict[str, Any]: hits, misses, hit_rate, saved_seconds and the number of entries in memory.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "entries": len(self._entries),
+            }
+
+
+@lru_cache(maxsize=None)
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Returns the process-wide response cache, or None if it isn't enabled.
+    Opt-in: RESPONSE_CACHE=1 enables the in-memory cache, RESPONSE_CACHE_DIR adds the on-disk tier.
+    Read on first use rather than at import, the apps load their .env after importing the graph.
+    Returns:
+        Optional[ResponseCache]: The shared cache.
+    """
+    if not (os.getenv("RESPONSE_CACHE") or os.getenv("RESPONSE_CACHE_DIR")):
+        return None
+    return ResponseCache(max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+                         disk_dir=os.getenv("RESPONSE_CACHE_DIR"))
+
+
+def invoke_with_cache(llm: Runnable, messages: Sequence[BaseMessage]) -> BaseMessage:
+    """
+    Invokes `llm` through the response cache when it is enabled, otherwise calls it directly.
+    Calls that go out to the provider wait for the rate limiter if RATE_LIMIT_RPM or RATE_LIMIT_TPM is set.
+    Args:
+        llm (Runnable): The chat model, optionally with tools bound.
+        messages (Sequence[BaseMessage]): The message history sent to the model.
+    Returns:
+        BaseMessage: The model's response.
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return invoke_rate_limited(llm, messages)
+    return response_cache.invoke(llm, messages)
+
+
+async def ainvoke_with_cache(llm: Runnable, messages: Sequence[BaseMessage]) -> BaseMessage:
+    """
+    Async version of `invoke_with_cache`.
+    Args:
+        llm (Runnable): The chat model, optionally with tools bound.
+        messages (Sequence[BaseMessage]): The message history sent to the model.
+    Returns:
+        BaseMessage: The model's response.
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return await ainvoke_rate_limited(llm, messages)
+    return await response_cache.ainvoke(llm, messages)
@@ -0,0 +1,173 @@
+import threading
+from concurrent.futures import Future, TimeoutError, wait as wait_futures
+from typing import Any, Callable, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks.base import BaseCallbackHandler
+from streamlit.runtime.scriptrunner import StopException, RerunException, add_script_run_ctx, get_script_run_ctx
+
+
+class RunCancelled(Exception):
+    """
+    Raised inside a graph run once its RunControl is cancelled, and to the caller if the run is cancelled.
+    """
+
+
+class RunControl:
+    """
+    Cooperative cancellation of one graph run. The script thread waits for the run with `wait`, which
+    cancels it as soon as Streamlit asks the script to rerun or stop: a click on a Stop button, a newer
+    prompt or the user leaving the page. The graph checks the control at every token, tool and node.
+    """
+
+    def __init__(self, grace_period: float = 2.0):
+        """
+        Initializes the RunControl.
+        Args:
+            grace_period (float): Seconds to wait for a cancelled run to wind down before giving up on it.
+        """
+        self.grace_period = grace_period
+        self.partial_text = ""  # tokens streamed so far, the answer to keep if the run is cancelled
+        self.pending: Optional[BaseException] = None  # the rerun or stop request that cancelled the run
+        self._cancelled = threading.Event()
+        self._on_cancel: List[Callable[[], None]] = []
+        self._on_wait: List[Tuple[Callable[[float], None], Optional[Callable[[], None]]]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def on_cancel(self, fn: Callable[[], None]) -> None:
+        """
+        Registers `fn` to be called on cancellation, e.g. to cancel the asyncio task of the run.
+        """
+        with self._lock:
+            if not self.cancelled:
+                self._on_cancel.append(fn)
+                return
+        fn()
+
+    def on_wait(self, fn: Callable[[float], None], wake: Optional[Callable[[], None]] = None) -> None:
+        """
+        Registers `fn(timeout)` for the script thread to call while it waits for the run instead of sleeping,
+        e.g. to render the updates the run queued. `fn` may block up to `timeout` seconds, and is called once
+        more with a timeout of 0 after the run, so nothing queued is lost.
+        Args:
+            fn (Callable[[float], None]): Called by the waiting script thread.
+            wake (Optional[Callable[[], None]]): Called once the run is done, to return from a blocked `fn`.
+        """
+        self._on_wait.append((fn, wake))
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self.cancelled:
+                return
+            self._cancelled.set()
+            callbacks, self._on_cancel = self._on_cancel, []
+        for fn in callbacks:
+            fn()
+
+    def check(self) -> None:
+        """
+        Raises RunCancelled if the run was cancelled, called by the graph between units of work.
+        """
+        if self.cancelled:
+            raise RunCancelled()
+
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Calls `fn` on a worker thread and waits for it with `wait`, so a synchronous graph run can be cancelled.
+        The caller's Streamlit script context goes along so the run can render into the page.
+        Returns:
+            Any: The result of `fn`.
+        """
+        future: Future = Future()
+        ctx = get_script_run_ctx()
+
+        def worker():
+            add_script_run_ctx(threading.current_thread(), ctx)
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=worker, name="graph-run", daemon=True).start()
+        return self.wait(future)
+
+    def wait(self, future: Future, poll_interval: float = 0.1) -> Any:
+        """
+        Blocks the script thread until the run is done, cancelling it if Streamlit asks the script to rerun or stop.
+        The request is kept in `pending`, call `resume` once the partial answer is saved to carry it out.
+        Args:
+            future (Future): The future of the run.
+            poll_interval (float): Seconds between checks for a rerun or stop request.
+        Returns:
+            Any: The result of the run, a cancelled run may still return one, e.g. its partial answer.
+        """
+        ctx = get_script_run_ctx()
+        for _, wake in self._on_wait:
+            if wake is not None:
+                future.add_done_callback(lambda _, wake=wake: wake())
+        try:
+            while True:
+                try:
+                    if self._on_wait:
+                        # the script thread renders what the run queued meanwhile, which raises as well
+                        # once a rerun or stop is requested
+                        for fn, _ in self._on_wait:
+                            fn(poll_interval)
+                    else:
+                        wait_futures([future], poll_interval)
+                    if future.done():
+                        return future.result()
+                    if self.cancelled or ctx is None:
+                        continue
+                    ctx.yield_check()  # raises if a widget changed or the session ended while the graph runs
+                except (RerunException, StopException) as e:
+                    self.pending = e
+                    self.cancel()
+                    try:
+                        return future.result(timeout=self.grace_period)
+                    except TimeoutError:
+                        # e.g. a synchronous tool that doesn't return, it finishes on its own and is ignored
+                        raise RunCancelled() from None
+        finally:
+            for fn, _ in self._on_wait:
+                fn(0)
+
+    def resume(self) -> None:
+        """
+        Carries out the rerun or stop request that cancelled the run, if any.
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            raise pending
+
+
+class CancelCallbackHandler(BaseCallbackHandler):
+    """
+    Callback handler that stops a graph run at its next token, tool call or node once its RunControl is
+    cancelled, and collects the streamed tokens as the partial answer. Put it first in the callbacks,
+    so no later handler renders anything of a cancelled run.
+    A model call aborted at a token closes its HTTP stream, a running synchronous tool finishes on its thread.
+    """
+
+    raise_error = True  # a handler's exception is logged and swallowed unless it asks to be raised
+    run_inline = True
+
+    def __init__(self, control: RunControl):
+        self.control = control
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.control.check()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self.control.check()
+        self.control.partial_text += token
+
+    def on_tool_start(self, serialized: Any, input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self.control.check()
+
+    def on_chain_start(self, serialized: Any, inputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.control.check()
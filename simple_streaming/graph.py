@@ -1,37 +1,104 @@
+import asyncio
+from functools import lru_cache
 from typing import Annotated, TypedDict
 
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import START, END, StateGraph
 from langgraph.graph.message import AnyMessage, add_messages
-from langchain_openai import ChatOpenAI
+
+from context_window import get_context_window
+from llm_clients import get_chat_model
+from remote_graph import ainvoke_remote, invoke_remote, session_id, use_remote_graph
+from response_cache import ainvoke_with_cache, invoke_with_cache
+from run_control import CancelCallbackHandler, RunCancelled
+from stream_trace import TraceRecorder, new_trace_path
+from turn_metrics import MetricsCallbackHandler, time_rendering
 
 # This is the default state same as "MessageState" TypedDict but allows us accessibility to custom keys
 class GraphsState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     # Custom keys for additional data can be added here such as - conversation_id: str
 
-graph = StateGraph(GraphsState)
-
 # Core invocation of the model
 def _call_model(state: GraphsState):
-    messages = state["messages"]
-    llm = ChatOpenAI(
-        temperature=0.0,
-        streaming=True,
-    )
-    response = llm.invoke(messages)
+    # recent turns are sent verbatim, older ones are folded into a rolling summary to stay within budget
+    messages = get_context_window().fit(state["messages"])
+    # shared per process, so graph steps and sessions reuse the same pooled HTTP client
+    llm = get_chat_model(temperature=0.0, streaming=True)
+    response = invoke_with_cache(llm, messages)  # replays a cached answer if the opt-in cache is enabled
+    return {"messages": [response]}# add the response to the messages using LangGraph reducer paradigm
+
+# Same as _call_model for `ainvoke`, the model streams its tokens to the callbacks on the event loop
+async def _acall_model(state: GraphsState):
+    # folding older turns may call the model synchronously, so it runs off the shared event loop
+    messages = await asyncio.to_thread(get_context_window().fit, state["messages"])
+    # shared per process, so graph steps and sessions reuse the same pooled HTTP client
+    llm = get_chat_model(temperature=0.0, streaming=True)
+    response = await ainvoke_with_cache(llm, messages)  # replays a cached answer if the opt-in cache is enabled
     return {"messages": [response]}# add the response to the messages using LangGraph reducer paradigm
 
-# Define the structure (nodes and directional edges between nodes) of the graph
-graph.add_edge(START, "modelNode")
-graph.add_node("modelNode", _call_model)
-graph.add_edge("modelNode", END)
+@lru_cache(maxsize=None)
+def get_graph_runnable():
+    """
+    Returns the compiled graph, built once per process on the first call and shared by every session and rerun.
+    The app imports this module after drawing the page, so neither the imports nor the build delay the first paint.
+    Returns:
+        CompiledStateGraph: The runnable graph.
+    """
+    graph = StateGraph(GraphsState)
+
+    # Define the structure (nodes and directional edges between nodes) of the graph
+    graph.add_edge(START, "modelNode")
+    graph.add_node("modelNode", RunnableLambda(_call_model, afunc=_acall_model))
+    graph.add_edge("modelNode", END)
+
+    # Compile the state graph into a runnable object
+    return graph.compile()
+
+def _graph_invoke():
+    # with GRAPH_SERVER_URL or GRAPH_WORKERS set the graph runs on the graph server or a worker process,
+    # its callbacks reach the handlers all the same
+    return invoke_remote if use_remote_graph() else get_graph_runnable().invoke
+
 
-# Compile the state graph into a runnable object
-graph_runnable = graph.compile()
+def _graph_ainvoke():
+    return ainvoke_remote if use_remote_graph() else get_graph_runnable().ainvoke
 
-def invoke_our_graph(st_messages, callables):
+
+def _graph_callbacks(callables, metrics=None, control=None):
     # Ensure the callables parameter is a list as you can have multiple callbacks
     if not isinstance(callables, list):
         raise TypeError("callables must be a list")
+    if metrics is not None:  # time the nodes, model, tools and the rendering callbacks of this turn
+        callables = [time_rendering(cb, metrics) for cb in callables] + [MetricsCallbackHandler(metrics)]
+    trace_path = new_trace_path()
+    if trace_path:  # STREAM_TRACE_DIR is set, record the rendered callbacks for offline replay
+        callables = callables + [TraceRecorder(trace_path)]
+    if control is not None:  # a Stop click or a newer prompt cancels the run, the caller keeps the partial answer
+        callables = [CancelCallbackHandler(control)] + callables
+    return callables
+
+
+def _graph_config(callables):
+    # the rate limiter, if enabled, queues the model calls of the run under the Streamlit session
+    return {"callbacks": callables, "metadata": {"session_id": session_id()}}
+
+
+def invoke_our_graph(st_messages, callables, metrics=None, control=None):
+    callables = _graph_callbacks(callables, metrics, control)
+    if control is not None:
+        return control.run(_graph_invoke(), {"messages": st_messages}, config=_graph_config(callables))
     # Invoke the graph with the current messages and callback configuration
-    return graph_runnable.invoke({"messages": st_messages}, config={"callbacks": callables})
+    return _graph_invoke()({"messages": st_messages}, config=_graph_config(callables))
+
+
+# Async version of invoke_our_graph for async callback handlers, run it with event_loop.run_async
+# so sessions share one event loop and its token callbacks are awaited on it without a thread hop
+async def ainvoke_our_graph(st_messages, callables, metrics=None, control=None):
+    callables = _graph_callbacks(callables, metrics, control)
+    try:
+        return await _graph_ainvoke()({"messages": st_messages}, config=_graph_config(callables))
+    except asyncio.CancelledError:
+        if control is None or not control.cancelled:
+            raise
+        raise RunCancelled() from None  # cancelled by run_async, the caller keeps control.partial_text
@@ -0,0 +1,22 @@
+"""
+Serves the graph of this example over HTTP, so the app can run it in another process or on another machine.
+
+Runs are streamed as Server-Sent Events (POST /runs/stream) or over a WebSocket (/runs/ws). Start the server
+from this directory and point the app at it, the handlers render the remote run the way they render a local one:
+
+    uvicorn graph_server:app --port 8500
+    GRAPH_SERVER_URL=http://127.0.0.1:8500 streamlit run app.py
+
+Set GRAPH_SERVER_TRANSPORT=ws for the app to use the WebSocket instead.
+"""
+from dotenv import load_dotenv
+
+from graph import get_graph_runnable
+from remote_graph import create_app, graph_run
+
+load_dotenv()
+
+# also what the workers of GRAPH_WORKERS run, see worker_pool.py
+run_graph = graph_run(get_graph_runnable)
+
+app = create_app(run_graph)
@@ -0,0 +1,478 @@
+import asyncio
+import json
+import os
+from contextlib import aclosing, closing
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks.base import BaseCallbackHandler
+from langchain_core.callbacks.manager import ahandle_event, handle_event
+from langchain_core.messages import BaseMessage, ToolMessage, messages_from_dict, messages_to_dict
+from langchain_core.outputs import LLMResult
+
+from run_control import CancelCallbackHandler, RunControl
+
+# Reads of a streamed run wait as long as its slowest tool or model call, only connecting is bounded
+STREAM_TIMEOUT = httpx.Timeout(10.0, read=None)
+
+# A graph run on the server: it gets the request payload and a function to stream records to the client with,
+# and returns the JSON data of the run's final record
+GraphRun = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], None]], Awaitable[Any]]
+
+
+class RemoteGraphError(Exception):
+    """
+    Raised by a remote run if the graph server reports an error or its stream ends before the run.
+    """
+
+
+def get_graph_server_url() -> Optional[str]:
+    """
+    Returns the URL of the graph server the apps run their graph on, or None to run it in process.
+    Read on every run rather than at import, the apps load their .env after importing the graph.
+    Returns:
+        Optional[str]: The GRAPH_SERVER_URL, e.g. http://127.0.0.1:8500.
+    """
+    return os.getenv("GRAPH_SERVER_URL") or None
+
+
+def get_graph_workers() -> int:
+    """
+    Returns the number of worker processes the apps run their graph on, 0 to run it in process.
+    Returns:
+        int: GRAPH_WORKERS, ignored if GRAPH_SERVER_URL is set.
+    """
+    return int(os.getenv("GRAPH_WORKERS") or 0)
+
+
+def use_remote_graph() -> bool:
+    """
+    Returns whether runs go to the graph server or the worker pool instead of the graph in this process.
+    """
+    return bool(get_graph_server_url() or get_graph_workers())
+
+
+def dump_messages(messages: List[BaseMessage]) -> List[Dict[str, Any]]:
+    return messages_to_dict(messages)
+
+
+def load_messages(records: List[Dict[str, Any]]) -> List[BaseMessage]:
+    return messages_from_dict(records)
+
+
+# Run IDs as sent and as read back: every token of a model call carries the same two, converting them once keeps
+# that off the per-token path, and a batch of records on the worker pipe pickles a repeated ID only once
+_run_key = lru_cache(maxsize=4096)(str)
+_run_id = lru_cache(maxsize=4096)(UUID)
+
+
+def _encode(record: Dict[str, Any]) -> str:
+    return json.dumps(record, separators=(",", ":"), default=str)
+
+
+def _dump_output(output: Any) -> Any:
+    if isinstance(output, ToolMessage):  # the tool handlers render its content
+        return {"message": messages_to_dict([output])[0]}
+    return str(output)
+
+
+def _load_output(output: Any) -> Any:
+    if isinstance(output, dict) and "message" in output:
+        return messages_from_dict([output["message"]])[0]
+    return output
+
+
+class CallbackForwarder(BaseCallbackHandler):
+    """
+    Callback handler of a graph run on the graph server, turns the callbacks the apps' handlers use into records
+    for the client. Inputs, outputs and prompts of the chains and models stay on the server, only what the
+    handlers render or time is sent.
+    """
+
+    run_inline = True  # an async run calls it on the event loop, in order, instead of a thread pool
+
+    def __init__(self, emit: Callable[[Dict[str, Any]], None]):
+        """
+        Initializes the CallbackForwarder.
+        Args:
+            emit (Callable[[Dict[str, Any]], None]): Sends a record to the client, safe to call from any thread.
+        """
+        self.emit = emit
+
+    def _send(self, event: str, run_id: UUID, parent_run_id: Optional[UUID], data: Dict[str, Any]) -> None:
+        self.emit({"e": event, "r": _run_key(run_id), "p": parent_run_id and _run_key(parent_run_id), "d": data})
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, tags: Optional[List[str]] = None,
+                       metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        self._send("on_chain_start", run_id, parent_run_id,
+                   {"name": kwargs.get("name"), "tags": tags,
+                    "metadata": {"langgraph_node": (metadata or {}).get("langgraph_node")}})
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                     **kwargs: Any) -> None:
+        self._send("on_chain_end", run_id, parent_run_id, {})
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       **kwargs: Any) -> None:
+        self._send("on_chain_error", run_id, parent_run_id, {"error": repr(error)})
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._send("on_chat_model_start", run_id, parent_run_id, {"name": (serialized or {}).get("name")})
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                         **kwargs: Any) -> None:
+        self._send("on_llm_new_token", run_id, parent_run_id, {"token": token})
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                   **kwargs: Any) -> None:
+        self._send("on_llm_end", run_id, parent_run_id, {})
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                     **kwargs: Any) -> None:
+        self._send("on_llm_error", run_id, parent_run_id, {"error": repr(error)})
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        serialized = {"name": serialized.get("name"), "description": serialized.get("description")}
+        self._send("on_tool_start", run_id, parent_run_id, {"serialized": serialized, "input_str": input_str})
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                    **kwargs: Any) -> None:
+        self._send("on_tool_end", run_id, parent_run_id, {"output": _dump_output(output)})
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                      **kwargs: Any) -> None:
+        self._send("on_tool_error", run_id, parent_run_id, {"error": repr(error)})
+
+    def on_custom_event(self, name: str, data: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        # e.g. the waits for the rate limiter the turn metrics add up, the data must be JSON
+        self._send("on_custom_event", run_id, None, {"name": name, "data": data})
+
+
+def _callback_args(record: Dict[str, Any]) -> Tuple[str, Optional[str], tuple, Dict[str, Any]]:
+    """
+    Returns (callback, ignore flag, args, kwargs) to call the local handlers with for a CallbackForwarder record.
+    """
+    kind, data = record["e"], record["d"]
+    kwargs = {"run_id": _run_id(record["r"]), "parent_run_id": record["p"] and _run_id(record["p"])}
+    if kind == "on_chain_start":
+        return kind, "ignore_chain", ({"name": data["name"]}, {}), {
+            **kwargs, "tags": data["tags"], "metadata": data["metadata"], "name": data["name"]}
+    if kind == "on_chain_end":
+        return kind, "ignore_chain", ({},), kwargs
+    if kind == "on_chat_model_start":
+        # handlers without on_chat_model_start get on_llm_start, with an empty prompt
+        return kind, "ignore_chat_model", ({"name": data["name"]}, [[]]), kwargs
+    if kind == "on_llm_new_token":
+        return kind, "ignore_llm", (data["token"],), kwargs
+    if kind == "on_llm_end":
+        return kind, "ignore_llm", (LLMResult(generations=[]),), kwargs
+    if kind == "on_tool_start":
+        return kind, "ignore_agent", (data["serialized"], data["input_str"]), kwargs
+    if kind == "on_tool_end":
+        return kind, "ignore_agent", (_load_output(data["output"]),), kwargs
+    if kind == "on_custom_event":
+        return kind, "ignore_custom_event", (data["name"], data["data"]), kwargs
+    ignore = {"on_chain_error": "ignore_chain", "on_llm_error": "ignore_llm", "on_tool_error": "ignore_agent"}[kind]
+    return kind, ignore, (RemoteGraphError(data["error"]),), kwargs
+
+
+def dispatch_record(handlers: List[BaseCallbackHandler], record: Dict[str, Any]) -> None:
+    """
+    Calls the handlers with the callback of a record, the way the callback manager of an in-process run would.
+    """
+    kind, ignore, args, kwargs = _callback_args(record)
+    handle_event(handlers, kind, ignore, *args, **kwargs)
+
+
+async def adispatch_record(handlers: List[BaseCallbackHandler], record: Dict[str, Any]) -> None:
+    """
+    Async version of dispatch_record, inline and coroutine handlers are awaited on the event loop in order.
+    """
+    kind, ignore, args, kwargs = _callback_args(record)
+    await ahandle_event(handlers, kind, ignore, *args, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def _http_client() -> httpx.Client:
+    return httpx.Client(timeout=STREAM_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def _async_http_client() -> httpx.AsyncClient:
+    # its connections belong to the event loop that opened them, the shared loop of event_loop.py
+    return httpx.AsyncClient(timeout=STREAM_TIMEOUT)
+
+
+class RemoteRun:
+    """
+    One graph run on the graph server. `stream` and `astream` yield the records the server streams for it,
+    over Server-Sent Events or a WebSocket, and keep the data of its final record in `result`.
+    Closing the stream early, e.g. once the run is cancelled, closes the connection and cancels the run on the server.
+    """
+
+    def __init__(self, payload: Dict[str, Any], url: Optional[str] = None, transport: Optional[str] = None):
+        """
+        Initializes the RemoteRun.
+        Args:
+            payload (Dict[str, Any]): The JSON input of the run, e.g. the dumped messages.
+            url (Optional[str]): The graph server, defaults to GRAPH_SERVER_URL.
+            transport (Optional[str]): "sse" or "ws", defaults to GRAPH_SERVER_TRANSPORT or "sse".
+        """
+        self.payload = payload
+        self.url = (url or get_graph_server_url()).rstrip("/")
+        self.transport = transport or os.getenv("GRAPH_SERVER_TRANSPORT", "sse")
+        self.result: Any = None
+
+    @property
+    def _ws_url(self) -> str:
+        return "ws" + self.url[len("http"):] + "/runs/ws"
+
+    def _sse_messages(self) -> Iterator[str]:
+        with _http_client().stream("POST", self.url + "/runs/stream", json=self.payload) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line.startswith("data:"):
+                    yield line[len("data:"):].strip()
+
+    async def _asse_messages(self) -> AsyncIterator[str]:
+        async with _async_http_client().stream("POST", self.url + "/runs/stream", json=self.payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    yield line[len("data:"):].strip()
+
+    def _ws_messages(self) -> Iterator[str]:
+        from websockets.sync.client import connect
+
+        with connect(self._ws_url) as websocket:
+            websocket.send(_encode(self.payload))
+            yield from websocket
+
+    async def _aws_messages(self) -> AsyncIterator[str]:
+        from websockets.asyncio.client import connect
+
+        async with connect(self._ws_url) as websocket:
+            await websocket.send(_encode(self.payload))
+            async for message in websocket:
+                yield message
+
+    def _read(self, message: str) -> Optional[Dict[str, Any]]:
+        # returns the record to yield, None once the run is over
+        record = json.loads(message)
+        if record["e"] == "end":
+            self.result = record["d"]
+            return None
+        if record["e"] == "error":
+            raise RemoteGraphError(record["d"])
+        return record
+
+    def stream(self) -> Iterator[Dict[str, Any]]:
+        messages = self._ws_messages() if self.transport == "ws" else self._sse_messages()
+        with closing(messages):
+            for message in messages:
+                record = self._read(message)
+                if record is None:
+                    return
+                yield record
+        raise RemoteGraphError("the graph server closed the stream before the run ended")
+
+    async def astream(self) -> AsyncIterator[Dict[str, Any]]:
+        messages = self._aws_messages() if self.transport == "ws" else self._asse_messages()
+        async with aclosing(messages):
+            async for message in messages:
+                record = self._read(message)
+                if record is None:
+                    return
+                yield record
+        raise RemoteGraphError("the graph server closed the stream before the run ended")
+
+
+def session_id() -> Optional[str]:
+    """
+    Returns the ID of the Streamlit session whose script run calls it, None outside a script run.
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+def open_run(payload: Dict[str, Any], affinity: Optional[str] = None) -> Any:
+    """
+    Returns a graph run on the graph server if GRAPH_SERVER_URL is set, else on the worker pool of GRAPH_WORKERS.
+    Iterate its `stream` or `astream` to start it, its final data is in `result` afterwards.
+    Args:
+        payload (Dict[str, Any]): The JSON input of the run, e.g. the dumped messages.
+        affinity (Optional[str]): Runs with the same key go to the same worker, defaults to the Streamlit session.
+    Returns:
+        Union[RemoteRun, WorkerRun]: The run.
+    """
+    if get_graph_server_url():
+        return RemoteRun(payload)
+    from worker_pool import get_worker_pool  # multiprocessing is only set up if the worker pool is used
+
+    return get_worker_pool(get_graph_workers()).open_run(payload, affinity or session_id())
+
+
+def start_graph_workers() -> None:
+    """
+    Starts the worker pool if GRAPH_WORKERS is set and no graph server is, so the first run doesn't wait
+    for the workers to import the graph. The apps call it in the background once their page is drawn.
+    """
+    if get_graph_workers() and not get_graph_server_url():
+        from worker_pool import get_worker_pool
+
+        get_worker_pool(get_graph_workers())
+
+
+def _run_payload(graph_input: Dict[str, Any], config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # the session goes along for the rate limiter of the server or worker to queue the run's model calls under
+    metadata = (config or {}).get("metadata") or {}
+    return {"messages": dump_messages(graph_input["messages"]), "session_id": metadata.get("session_id")}
+
+
+def invoke_remote(graph_input: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Runs the graph on the graph server or a worker like `graph.invoke(graph_input, config)` would in process:
+    the callbacks of `config` get the callbacks of the remote run, and its final state is returned.
+    Args:
+        graph_input (Dict[str, Any]): The graph's input, its messages.
+        config (Optional[Dict[str, Any]]): The run's config, only its callbacks and the session_id of its metadata
+            are used.
+    Returns:
+        Dict[str, Any]: The final state of the run, its messages.
+    """
+    handlers = (config or {}).get("callbacks") or []
+    run = open_run(_run_payload(graph_input, config))
+    with closing(run.stream()) as records:
+        for record in records:
+            dispatch_record(handlers, record)
+    return {"messages": load_messages(run.result["messages"])}
+
+
+async def ainvoke_remote(graph_input: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Async version of invoke_remote, like `graph.ainvoke(graph_input, config)`.
+    """
+    handlers = (config or {}).get("callbacks") or []
+    run = open_run(_run_payload(graph_input, config))
+    async with aclosing(run.astream()) as records:
+        async for record in records:
+            await adispatch_record(handlers, record)
+    return {"messages": load_messages(run.result["messages"])}
+
+
+def graph_run(get_graph: Callable[[], Any]) -> GraphRun:
+    """
+    Returns the server and worker side of invoke_remote for a graph of messages: it runs the graph with `ainvoke` and
+    streams its callbacks with a CallbackForwarder.
+    Args:
+        get_graph (Callable[[], Any]): Returns the compiled graph, e.g. get_graph_runnable.
+    Returns:
+        GraphRun: The run to serve with create_app.
+    """
+    async def run(payload: Dict[str, Any], emit: Callable[[Dict[str, Any]], None]) -> Any:
+        control = RunControl()  # also stops the nodes that run on executor threads once the client is gone
+        callbacks = [CancelCallbackHandler(control), CallbackForwarder(emit)]
+        try:
+            result = await get_graph().ainvoke({"messages": load_messages(payload["messages"])},
+                                               config={"callbacks": callbacks,
+                                                       "metadata": {"session_id": payload.get("session_id")}})
+        except asyncio.CancelledError:
+            control.cancel()
+            raise
+        return {"messages": dump_messages(result["messages"])}
+
+    return run
+
+
+async def stream_run(run: GraphRun, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Runs `run` as a task and yields the records it emits, then an "end" record with its result or an "error"
+    record. Closing the generator, e.g. when the client disconnects, cancels the run.
+    Args:
+        run (GraphRun): The graph run to stream.
+        payload (Dict[str, Any]): The request payload.
+    Returns:
+        AsyncIterator[Dict[str, Any]]: The records to send.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(record: Dict[str, Any]) -> None:
+        # callbacks of sync nodes come from executor threads, records keep their order through the loop
+        loop.call_soon_threadsafe(queue.put_nowait, record)
+
+    task = asyncio.ensure_future(run(payload, emit))
+    task.add_done_callback(lambda _: loop.call_soon_threadsafe(queue.put_nowait, None))
+    try:
+        while (record := await queue.get()) is not None:
+            yield record
+        try:
+            result = task.result()
+        except Exception as e:
+            yield {"e": "error", "d": repr(e)}
+            return
+        yield {"e": "end", "d": result}
+    finally:
+        task.cancel()
+
+
+def create_app(run: GraphRun) -> Any:
+    """
+    Returns the ASGI app of the graph server, serve it with e.g. `uvicorn graph_server:app --port 8500`.
+      POST /runs/stream   the JSON payload of a run, its records as Server-Sent Events
+      WS   /runs/ws       the payload as the first message, then one message per record
+      GET  /health        liveness check
+    Args:
+        run (GraphRun): The graph run of the example, its graph_server.run_graph.
+    Returns:
+        Starlette: The app.
+    """
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route, WebSocketRoute
+    from starlette.websockets import WebSocket
+
+    async def stream(request):
+        payload = await request.json()
+
+        async def events() -> AsyncIterator[str]:
+            async with aclosing(stream_run(run, payload)) as records:
+                async for record in records:
+                    yield f"data: {_encode(record)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def websocket_stream(websocket: WebSocket):
+        await websocket.accept()
+        payload = json.loads(await websocket.receive_text())
+
+        async def send_records() -> None:
+            async with aclosing(stream_run(run, payload)) as records:
+                async for record in records:
+                    await websocket.send_text(_encode(record))
+
+        # the client sends nothing more, a receive only returns once it disconnects, which cancels the run
+        sender = asyncio.ensure_future(send_records())
+        receiver = asyncio.ensure_future(websocket.receive())
+        await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
+        receiver.cancel()
+        if not sender.done():
+            sender.cancel()
+            return
+        sender.result()
+        await websocket.close()
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(routes=[Route("/runs/stream", stream, methods=["POST"]),
+                             WebSocketRoute("/runs/ws", websocket_stream),
+                             Route("/health", health)])
@@ -1,95 +1,335 @@
-from typing import Callable, TypeVar
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+import asyncio
+import functools
 import inspect
+import threading
+import time
 
 from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
 from streamlit.delta_generator import DeltaGenerator
 
-from langchain_core.callbacks.base import BaseCallbackHandler
+from langchain_core.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
 
+from markdown_stream import MarkdownStream
+from render_queue import TOKEN, RenderQueue
+from run_control import RunControl
 
-# Define a function to create a callback handler for Streamlit that updates the UI dynamically
-def get_streamlit_cb(parent_container: DeltaGenerator) -> BaseCallbackHandler:
+# Type of a wrapped method's result and of a decorated handler class
+T = TypeVar("T")
+H = TypeVar("H", bound=BaseCallbackHandler)
+
+
+def _attach_script_run_ctx(ctx) -> None:
+    thread = threading.current_thread()
+    # attached once per thread and session, every later call only compares the thread's attribute
+    if getattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None) is not ctx:
+        add_script_run_ctx(thread, ctx)
+
+
+def _in_script_run_ctx(fn: Callable[..., T]) -> Callable[..., T]:
     """
-    Creates a Streamlit callback handler that updates the provided Streamlit container with new tokens.
+    Wraps a callback method so it runs with the handler's script run context attached to the calling thread.
 
     Args:
-        parent_container (DeltaGenerator): The Streamlit container where the text will be rendered.
+        fn (Callable[..., T]): The callback method, its handler has the context in `script_run_ctx`.
     Returns:
-        BaseCallbackHandler: An instance of a callback handler configured for Streamlit.
+        Callable[..., T]: The wrapped method.
+    """
+    if inspect.iscoroutinefunction(fn):
+        # a coroutine callback renders before its first await, no other session's callback runs in between
+        @functools.wraps(fn)
+        async def async_wrapper(self, *args, **kwargs) -> T:
+            _attach_script_run_ctx(self.script_run_ctx)
+            return await fn(self, *args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs) -> T:
+        _attach_script_run_ctx(self.script_run_ctx)
+        return fn(self, *args, **kwargs)
+
+    return wrapper
+
+
+def with_script_run_ctx(cls: Type[H]) -> Type[H]:
+    """
+    Class decorator for a callback handler that renders from the threads LangChain runs callbacks on.
+    Wraps the `on_*` methods the handler implements, once when the class is defined instead of for every
+    handler instance, so Streamlit calls in them find the session of the script that created the handler.
+    Fixes the NoSessionContext() error of Streamlit calls in callbacks.
+
+    Args:
+        cls (Type[H]): The handler class, its instances set `script_run_ctx` to the script's context.
+    Returns:
+        Type[H]: The same class.
+    """
+    for name, fn in inspect.getmembers(cls, predicate=inspect.isfunction):
+        # the no-op methods of the base handlers render nothing and stay unwrapped
+        if (name.startswith("on_") and not hasattr(fn, "__wrapped__")  # not wrapped for a base class already
+                and fn not in (getattr(BaseCallbackHandler, name, None), getattr(AsyncCallbackHandler, name, None))):
+            setattr(cls, name, _in_script_run_ctx(fn))
+    return cls
+
+
+MAX_FLUSH_INTERVAL = 1.0  # seconds, the flush backoff never leaves a longer gap between updates
+
+
+# Define a custom callback handler class for managing and displaying stream events from LangGraph in Streamlit
+@with_script_run_ctx
+class StreamHandler(BaseCallbackHandler):
+    """
+    Custom callback handler for Streamlit that updates a Streamlit container with new tokens.
     """
 
-    # Define a custom callback handler class for managing and displaying stream events from LangGraph in Streamlit
-    class StreamHandler(BaseCallbackHandler):
+    def __init__(self, container: DeltaGenerator, initial_text: str = "", flush_interval: float = 0.05,
+                 flush_tokens: int = 20, delta_budget: int = 200,
+                 render_queue: Optional[RenderQueue] = None):
+        """
+        Initializes the StreamHandler with a Streamlit container and optional initial text.
+
+        Args:
+            container (DeltaGenerator): The Streamlit container where text will be rendered.
+            initial_text (str): Optional initial text to start with in the container.
+            flush_interval (float): Seconds to buffer tokens before re-rendering the text.
+            flush_tokens (int): Number of buffered tokens that forces a re-render.
+            delta_budget (int): Re-renders per model call at the initial rate, past half of it the flush
+                budgets double on every flush until the interval reaches MAX_FLUSH_INTERVAL. From then on a
+                long answer adds about one delta a second, the rate is bounded rather than the count.
+            render_queue (Optional[RenderQueue]): Queue for the callbacks to put their events in instead of
+                rendering them, `render_pending` renders them on the thread that calls it.
+        """
+        self.container = container  # The Streamlit container to update
+        # attached to the threads LangChain calls back on, see with_script_run_ctx
+        self.script_run_ctx = get_script_run_ctx()
+        self.markdown_stream = MarkdownStream(self.container.container())  # Block-wise token streaming
+        self.text = initial_text  # Initialize the text content, starting with any initial text
+        self.flush_interval = self.initial_flush_interval = flush_interval
+        self.flush_tokens = self.initial_flush_tokens = flush_tokens
+        self.delta_budget = delta_budget
+        self._pending_tokens = 0  # Tokens appended to self.text but not yet sent to the frontend
+        self._rendered_len = 0  # Length of self.text already handed to the markdown stream
+        self._last_flush = time.monotonic()
+        self._deltas = 0  # Number of re-renders sent to the frontend so far
+        self.render_queue = render_queue
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        """
+        Callback method triggered when a model call starts, every call of a turn starts with the initial budgets.
+
+        Args:
+            serialized (Dict[str, Any]): The serialized model.
+            prompts (List[str]): The prompts, chat models report their messages as strings here too.
+            **kwargs: Additional keyword arguments.
+        """
+        if self.render_queue is not None:
+            self.render_queue.put("llm_start")
+            return
+        self._render_llm_start()
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        """
+        Callback method triggered when a new token is received (e.g., from a language model).
+
+        Args:
+            token (str): The new token received.
+            **kwargs: Additional keyword arguments.
+        """
+        if self.render_queue is not None:
+            self.render_queue.put_token(token)  # rendered by the script thread, see render_pending
+            return
+        self._render_token(token, 1)
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        """
+        Callback method triggered when the language model finishes, forces out any buffered tokens.
+
+        Args:
+            response (Any): The final result of the language model.
+            **kwargs: Additional keyword arguments.
+        """
+        if self.render_queue is not None:
+            self.render_queue.put("llm_end")
+            return
+        self._flush()
+
+    def render_pending(self, timeout: float) -> None:
         """
-        Custom callback handler for Streamlit that updates a Streamlit container with new tokens.
+        Renders the events queued by the callbacks, waiting up to `timeout` seconds for the first one.
+        Called by the script thread while it waits for the graph run, see RunControl.on_wait.
+
+        Args:
+            timeout (float): Seconds to wait for an event if none is queued.
+        """
+        self.render_events(self.render_queue.get_batch(timeout))
+
+    def render_events(self, events: List[Tuple[str, Any]]) -> None:
+        """
+        Renders a batch of queued events in order. The tokens of a batch come merged into frames,
+        the frames a slow consumer missed are never rendered on their own.
+
+        Args:
+            events (List[Tuple[str, Any]]): (kind, args) of the events, see RenderQueue.
+        """
+        for kind, args in events:
+            if kind == TOKEN:
+                self._render_token(*args)
+            elif kind == "llm_end":
+                self._flush()
+            else:
+                getattr(self, "_render_" + kind)(*args)
+
+    def _render_token(self, text: str, tokens: int) -> None:
+        """
+        Appends streamed text and re-renders it once the time or size budget is used up.
+
+        Args:
+            text (str): The text of one or more tokens.
+            tokens (int): Number of tokens in `text`.
         """
+        self.text += text  # Append the new tokens to the existing text
+        self._pending_tokens += tokens
+        # Only render once the time or size budget is used up so each delta carries a batch of tokens
+        if (self._pending_tokens >= self.flush_tokens
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self._flush()
+
+    def _render_llm_start(self) -> None:
+        self._deltas = 0
+        self.flush_interval = self.initial_flush_interval
+        self.flush_tokens = self.initial_flush_tokens
 
-        def __init__(self, container: DeltaGenerator, initial_text: str = ""):
-            """
-            Initializes the StreamHandler with a Streamlit container and optional initial text.
+    def _flush(self) -> None:
+        """
+        Hands the buffered text to the markdown stream if there are buffered tokens.
+        """
+        if not self._pending_tokens:
+            return
+        # Only the open markdown block is re-rendered, finished blocks are frozen in their own elements
+        self.markdown_stream.append(self.text[self._rendered_len:])
+        self._rendered_len = len(self.text)
+        self._pending_tokens = 0
+        self._last_flush = time.monotonic()
+        self._deltas += 1
+        if self._deltas >= self.delta_budget // 2:
+            # back off geometrically to slow the deltas of a long response down to about one per
+            # MAX_FLUSH_INTERVAL, so the text still visibly streams
+            if self.flush_interval * 2 <= MAX_FLUSH_INTERVAL:
+                self.flush_tokens *= 2
+                self.flush_interval *= 2
 
-            Args:
-                container (DeltaGenerator): The Streamlit container where text will be rendered.
-                initial_text (str): Optional initial text to start with in the container.
-            """
-            self.container = container  # The Streamlit container to update
-            self.token_placeholder = self.container.empty()  # Placeholder for dynamic token updates
-            self.text = initial_text  # Initialize the text content, starting with any initial text
 
-        def on_llm_new_token(self, token: str, **kwargs) -> None:
-            """
-            Callback method triggered when a new token is received (e.g., from a language model).
+@with_script_run_ctx
+class AsyncStreamHandler(StreamHandler, AsyncCallbackHandler):
+    """
+    StreamHandler with coroutine callbacks. When the graph runs with `ainvoke` on the shared event loop,
+    LangChain awaits them on the loop in order instead of handing every token to a thread pool.
+    With a render queue the callbacks only queue what to render and the script thread renders it, so no
+    session's websocket writes run on the loop every session shares.
+    """
 
-            Args:
-                token (str): The new token received.
-                **kwargs: Additional keyword arguments.
-            """
-            self.text += token  # Append the new token to the existing text
-            self.token_placeholder.write(self.text)  # Update the Streamlit container with the full text
+    run_inline = True  # awaited directly by the callback manager, not wrapped in a task per token
 
-    # Define a type variable for generic type hinting in the decorator, to maintain
-    # the return type of the input function and the wrapped function
-    fn_return_type = TypeVar('fn_return_type')
+    async def _aput(self, kind: str, *args: Any) -> None:
+        # waits for room in the render queue on a thread rather than blocking the shared event loop
+        await asyncio.to_thread(self.render_queue.put, kind, *args)
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        """
+        Callback method triggered when a model call starts, every call of a turn starts with the initial budgets.
+
+        Args:
+            serialized (Dict[str, Any]): The serialized model.
+            prompts (List[str]): The prompts, chat models report their messages as strings here too.
+            **kwargs: Additional keyword arguments.
+        """
+        if self.render_queue is not None:
+            await self._aput("llm_start")
+            return
+        self._render_llm_start()
 
-    # Decorator function to add the Streamlit execution context to a function
-    def add_streamlit_context(fn: Callable[..., fn_return_type]) -> Callable[..., fn_return_type]:
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
         """
-        Decorator to ensure that the decorated function runs within the Streamlit execution context.
+        Callback method triggered when a new token is received, renders it on the event loop or queues it.
 
         Args:
-            fn (Callable[..., fn_return_type]): The function to be decorated.
+            token (str): The new token received.
+            **kwargs: Additional keyword arguments.
+        """
+        if self.render_queue is not None:
+            self.render_queue.put_token(token)  # never waits, see RenderQueue
+            return
+        self._render_token(token, 1)
+
+    async def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        """
+        Callback method triggered when the language model finishes, forces out any buffered tokens.
 
-        Returns:
-            Callable[..., fn_return_type]: The decorated function that includes the Streamlit context setup.
+        Args:
+            response (Any): The final result of the language model.
+            **kwargs: Additional keyword arguments.
         """
-        # Retrieve the current Streamlit script execution context.
-        # This context holds session information necessary for Streamlit operations.
-        ctx = get_script_run_ctx()
+        if self.render_queue is not None:
+            await self._aput("llm_end")
+            return
+        self._flush()
+
+
+# Define a function to create a callback handler for Streamlit that updates the UI dynamically
+def get_streamlit_cb(parent_container: DeltaGenerator, flush_interval: float = 0.05,
+                     flush_tokens: int = 20, control: Optional[RunControl] = None) -> BaseCallbackHandler:
+    """
+    Creates a Streamlit callback handler that updates the provided Streamlit container with new tokens.
+
+    Args:
+        parent_container (DeltaGenerator): The Streamlit container where the text will be rendered.
+        flush_interval (float): Seconds to buffer tokens before re-rendering the streamed text.
+        flush_tokens (int): Number of buffered tokens that forces a re-render before `flush_interval` elapses.
+        control (Optional[RunControl]): The control of the run on a worker thread. The handler then only queues
+            what to render and the script thread renders it while it waits for the run, so a slow websocket
+            doesn't slow down reading tokens from the model.
+    Returns:
+        BaseCallbackHandler: An instance of a callback handler configured for Streamlit.
+    """
 
-        def wrapper(*args, **kwargs) -> fn_return_type:
-            """
-            Wrapper function that adds the Streamlit context and then calls the original function.
+    # Create an instance of the StreamHandler with the provided Streamlit container
+    render_queue = RenderQueue() if control is not None else None
+    st_cb = StreamHandler(parent_container, flush_interval=flush_interval, flush_tokens=flush_tokens,
+                          render_queue=render_queue)
 
-            Args:
-                *args: Positional arguments to pass to the original function.
-                **kwargs: Keyword arguments to pass to the original function.
+    if render_queue is not None:
+        # only the script thread renders, while it waits for the run
+        control.on_wait(st_cb.render_pending, wake=render_queue.close)
+        control.on_cancel(render_queue.close)  # a cancelled run's callbacks never wait for room in the queue
 
-            Returns:
-                fn_return_type: The result from the original function.
-            """
-            add_script_run_ctx(ctx=ctx)  # Set the correct Streamlit context for execution
-            return fn(*args, **kwargs)  # Call the original function with its arguments
+    return st_cb
 
-        return wrapper
 
-    # Create an instance of the custom StreamHandler with the provided Streamlit container
-    st_cb = StreamHandler(parent_container)
+def get_async_streamlit_cb(parent_container: DeltaGenerator, flush_interval: float = 0.05,
+                           flush_tokens: int = 20,
+                           control: Optional[RunControl] = None) -> AsyncCallbackHandler:
+    """
+    Creates the async version of the handler of `get_streamlit_cb`, for graph runs with `ainvoke`
+    on the shared event loop, see graph.ainvoke_our_graph.
+
+    Args:
+        parent_container (DeltaGenerator): The Streamlit container where the text will be rendered.
+        flush_interval (float): Seconds to buffer tokens before re-rendering the streamed text.
+        flush_tokens (int): Number of buffered tokens that forces a re-render before `flush_interval` elapses.
+        control (Optional[RunControl]): The control `run_async` waits for the run with. The handler then only
+            queues what to render and the script thread renders it while it waits, like `get_streamlit_cb`,
+            without it the handler renders on the event loop.
+    Returns:
+        AsyncCallbackHandler: An AsyncStreamHandler rendering into `parent_container`.
+    """
+    render_queue = RenderQueue() if control is not None else None
+    st_cb = AsyncStreamHandler(parent_container, flush_interval=flush_interval, flush_tokens=flush_tokens,
+                               render_queue=render_queue)
 
-    # Iterate over all methods of the StreamHandler instance
-    for method_name, method_func in inspect.getmembers(st_cb, predicate=inspect.ismethod):
-        if method_name.startswith('on_'):  # Identify callback methods that respond to LLM events
-            setattr(st_cb, method_name,
-                    add_streamlit_context(method_func))  # Wrap and replace the method with the context-aware version
+    if render_queue is not None:
+        # only the script thread renders, while it waits for the run
+        control.on_wait(st_cb.render_pending, wake=render_queue.close)
+        control.on_cancel(render_queue.close)  # a cancelled run's callbacks never wait for room in the queue
 
-    # Return the fully configured StreamlitCallbackHandler instance, now context-aware and integrated with any ChatLLM
     return st_cb
@@ -4,8 +4,13 @@ from dotenv import load_dotenv
 import streamlit as st
 from langchain_core.messages import AIMessage, HumanMessage
 
-from graph import invoke_our_graph
-from st_callable_util import get_streamlit_cb  # Utility function to get a Streamlit callback handler with context
+from event_loop import get_event_loop, run_async  # Runs the graph on a persistent event loop shared by all sessions
+from chat_history import message_markdown, render_chat_history  # Paginated chat history rendering
+from llm_clients import warm_up  # Opens the pooled connection to the model provider ahead of the first turn
+from preload import preload  # Imports and builds the graph in the background once the page is drawn
+from run_control import RunCancelled, RunControl  # Cancels a running graph on a Stop click or a newer prompt
+from st_callable_util import get_async_streamlit_cb  # Utility function to get a Streamlit callback handler with context
+from turn_metrics import TurnMetrics, render_metrics_panel, report_turn  # Per-turn timings and their export
 
 load_dotenv()
 
@@ -27,6 +32,9 @@ if not os.getenv('OPENAI_API_KEY'):
         st.info("Please enter your OPENAI_API_KEY in the sidebar.")
         st.stop()
 
+# Open a keep-alive connection on the graph's event loop (once per process) so the first prompt skips the TLS handshake
+warm_up(get_event_loop())
+
 
 # Capture user input from chat input
 prompt = st.chat_input()
@@ -38,28 +46,32 @@ if prompt is not None:
 # st write magic
 with st.expander(label="Simple Chat Streaming and Tool Calling Using Custom Callback Handler", expanded=st.session_state.expander_open):
     """
-    In this example, we're going to be creating our own [`BaseCallbackHandler`](https://api.python.langchain.com/en/latest/callbacks/langchain_core.callbacks.base.BaseCallbackHandler.html) called StreamHandler
+    In this example, we're going to be creating our own [`AsyncCallbackHandler`](https://api.python.langchain.com/en/latest/callbacks/langchain_core.callbacks.base.AsyncCallbackHandler.html) called AsyncStreamHandler
     to stream our [_LangGraph_](https://langchain-ai.github.io/langgraph/) invocations with `token streaming` or `tool calling` and leveraging callbacks in our
     graph's [`RunnableConfig`](https://api.python.langchain.com/en/latest/runnables/langchain_core.runnables.config.RunnableConfig.html).
 
-    The BaseCallBackHandler is a [Mixin](https://www.wikiwand.com/en/articles/Mixin) overloader function which we will use
-    to implement `on_llm_new_token`, a method that run on every new generation of a token from the ChatLLM model,
+    The graph runs with `ainvoke` on an event loop shared by all sessions and the handler implements the coroutine callbacks
+    `on_llm_new_token`, a method that run on every new generation of a token from the ChatLLM model,
     `on_tool_start` a method that runs on every tool call invocation even multiple tool calls, `on_tool_end`
-    a method that runs on the end of the tool call to get the final result.
+    a method that runs on the end of the tool call to get the final result. They queue what to render and
+    Streamlit's script thread renders it while it waits for the run.
     """
 
 # Initialize chat messages in session state
 if "messages" not in st.session_state:
     st.session_state["messages"] = [AIMessage(content="How can I help you?")]
 
-# Loop through all messages in the session state and render them as a chat on every st.refresh mech
-for msg in st.session_state.messages:
+# Render the newest turns of the chat on every st.refresh mech, earlier turns are loaded on demand
+def render_message(index, msg):
     # https://docs.streamlit.io/develop/api-reference/chat/st.chat_message
     # we store them as AIMessage and HumanMessage as its easier to send to LangGraph
     if isinstance(msg, AIMessage):
-        st.chat_message("assistant").write(msg.content)
+        st.chat_message("assistant").write(message_markdown(msg))
     elif isinstance(msg, HumanMessage):
-        st.chat_message("user").write(msg.content)
+        st.chat_message("user").write(message_markdown(msg))
+
+
+render_chat_history(st.session_state.messages, render_message)
 
 # Handle user input if provided
 if prompt:
@@ -67,7 +79,31 @@ if prompt:
     st.chat_message("user").write(prompt)
 
     with st.chat_message("assistant"):
-        # create a new placeholder for streaming messages and other events, and give it context
-        st_callback = get_streamlit_cb(st.container())
-        response = invoke_our_graph(st.session_state.messages, [st_callback])
-        st.session_state.messages.append(AIMessage(content=response["messages"][-1].content))   # Add that last message to the st_message_state
+        control = RunControl()  # cancels the run on a Stop click, a newer prompt or the user leaving
+        # create a new placeholder for streaming messages and other events, rendered by this thread as the graph runs
+        st_callback = get_async_streamlit_cb(st.container(), control=control)
+        stop_placeholder = st.empty()
+        # clicking Stop reruns the script, which cancels the run and keeps the answer streamed so far
+        stop_placeholder.button("Stop", key="stop_generation")
+        from graph import ainvoke_our_graph  # usually preloaded already, see the end of the script
+        metrics = TurnMetrics()  # node, model, tool and render timings of this turn
+        try:
+            # awaited on the shared event loop, the callbacks queue what this thread renders while it waits
+            response = run_async(ainvoke_our_graph(st.session_state.messages, [st_callback], metrics, control),
+                                 control=control)
+            answer = response["messages"][-1].content
+        except RunCancelled:
+            answer = control.partial_text  # the tokens streamed before the run was cancelled
+        stop_placeholder.empty()
+        report_turn(metrics)  # exported to the metrics endpoint and the JSONL sink if enabled
+        st.session_state.turn_metrics = metrics
+        if answer:
+            st.session_state.messages.append(AIMessage(content=answer))   # Add that last message to the st_message_state
+        control.resume()  # carries out the rerun or stop that cancelled the run, now that its answer is saved
+
+# Optional sidebar panel with the timings of the last turn
+render_metrics_panel(st.session_state.get("turn_metrics"))
+
+# The page is drawn, import the graph and build it in the background (once per process) ahead of the first prompt
+preload("graph", "get_graph_runnable")
+preload("remote_graph", "start_graph_workers")  # the worker processes, if GRAPH_WORKERS is set
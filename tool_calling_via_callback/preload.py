@@ -0,0 +1,30 @@
+import importlib
+import threading
+from typing import Optional, Set
+
+# Modules a background import was started for in this process
+_preloaded: Set[str] = set()
+_preloaded_lock = threading.Lock()
+
+
+def preload(module_name: str, build: Optional[str] = None) -> None:
+    """
+    Imports `module_name` on a background thread, once per process, and calls its function `build` if given,
+    e.g. to compile the graph. Called once the page is drawn, so the heavy imports neither delay the first paint
+    nor the first prompt. A script that imports the module meanwhile waits for the background import to finish
+    instead of importing it a second time.
+    Args:
+        module_name (str): The module to import.
+        build (Optional[str]): Name of a function of the module to call after importing it.
+    """
+    with _preloaded_lock:
+        if module_name in _preloaded:
+            return
+        _preloaded.add(module_name)
+
+    def load() -> None:
+        module = importlib.import_module(module_name)
+        if build is not None:
+            getattr(module, build)()
+
+    threading.Thread(target=load, name=f"preload-{module_name}", daemon=True).start()
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from langchain_core.tools import BaseTool
+
+
+class ToolResultCache:
+    """
+    Size-bounded TTL cache with single-flight calls: while a call for a key is running, concurrent
+    callers with the same key wait for its result instead of starting their own call.
+    Failed calls are not cached, every waiter of a failed call gets its exception.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 256):
+        """
+        Initializes the ToolResultCache.
+        Args:
+            ttl_seconds (float): Seconds a result stays valid.
+            max_entries (int): Maximum number of results kept, least recently used are dropped first.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()  # key -> (expires at, result)
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_call(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Returns the cached result for `key`, joins the running call for it, or calls `fn` and caches its result.
+        Args:
+            key (str): The cache key of the call.
+            fn (Callable[[], Any]): The call to make on a miss.
+        Returns:
+            Any: The result of the call.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._in_flight[key] = Future()
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(result)
+        return result
+
+
+def cache_tool(tool: BaseTool, ttl_seconds: float, max_entries: int = 256) -> BaseTool:
+    """
+    Returns a copy of `tool` whose calls go through a ToolResultCache, keyed on the tool's arguments.
+    The copy only keeps the sync function, async callers run it in a thread like any sync-only tool.
+    Args:
+        tool (BaseTool): The tool to wrap, e.g. a StructuredTool or a @tool function.
+        ttl_seconds (float): Seconds a result stays valid.
+        max_entries (int): Maximum number of results kept for this tool.
+    Returns:
+        BaseTool: The caching copy of the tool with the same name, description and schema.
+    """
+    cache = ToolResultCache(ttl_seconds, max_entries)
+    func = tool.func
+
+    def cached_func(*args: Any, **kwargs: Any) -> Any:
+        key = json.dumps([args, kwargs], sort_keys=True, default=str)
+        return cache.get_or_call(key, lambda: func(*args, **kwargs))
+
+    return tool.model_copy(update={"func": cached_func, "coroutine": None})
+
+
+def with_tool_cache(tools: Sequence[BaseTool], ttl_seconds: Dict[str, float],
+                    max_entries: int = 256) -> List[BaseTool]:
+    """
+    Wraps the tools that have a TTL configured with cache_tool, the others are returned unchanged.
+    Args:
+        tools (Sequence[BaseTool]): The tools of the graph.
+        ttl_seconds (Dict[str, float]): TTL in seconds per tool name.
+        max_entries (int): Maximum number of results kept per tool.
+    Returns:
+        List[BaseTool]: The tools, in the same order.
+    """
+    return [cache_tool(t, ttl_seconds[t.name], max_entries) if t.name in ttl_seconds else t for t in tools]
@@ -0,0 +1,188 @@
+import contextvars
+import json
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Any, Callable, Collection, Deque, Dict, List, Optional, Sequence
+
+from langchain_core.tools import BaseTool, ToolException
+
+
+@lru_cache(maxsize=None)
+def _executor() -> ThreadPoolExecutor:
+    # calls past their deadline can't be stopped and finish here in the background, hence more threads than cores
+    return ThreadPoolExecutor(max_workers=32, thread_name_prefix="tool-guard")
+
+
+def tool_error(tool: str, error: str, message: str, retry_after: Optional[float] = None) -> str:
+    """
+    Returns the structured error a guarded tool answers the model with instead of a result, as JSON.
+    Args:
+        tool (str): Name of the tool.
+        error (str): "timeout" or "unavailable".
+        message (str): What happened, for the model and the user.
+        retry_after (Optional[float]): Seconds until the tool is tried again, if it is paused.
+    Returns:
+        str: The error as a JSON object.
+    """
+    return json.dumps({
+        "error": error,
+        "tool": tool,
+        "message": message,
+        "retry_after_seconds": retry_after and math.ceil(retry_after),
+        "hint": "Don't call this tool again for this question. Answer from what you already know and tell the "
+                "user the information may be incomplete.",
+    })
+
+
+class ToolGuard:
+    """
+    Bounds the latency of one tool's calls. A call that takes longer than the p95 of the tool's recent calls gets
+    a hedged duplicate and the first to answer wins, a call without an answer by the deadline fails with a
+    structured error the model can act on. After `failure_threshold` failed calls in a row the circuit opens and
+    calls fail right away for `reset_seconds`, then a single trial call decides whether it closes again.
+    Calls past their deadline aren't stopped, they finish on their thread and are ignored.
+    """
+
+    def __init__(self, name: str, deadline_seconds: float, hedge: bool = True, failure_threshold: int = 3,
+                 reset_seconds: float = 30.0, window: int = 100, min_samples: int = 20,
+                 max_hedge_ratio: float = 0.1):
+        """
+        Initializes the ToolGuard.
+        Args:
+            name (str): Name of the tool, for its errors.
+            deadline_seconds (float): Seconds a call may take, hedge included.
+            hedge (bool): Whether slow calls get a duplicate, only for tools that are safe to call twice.
+            failure_threshold (int): Failed calls in a row that open the circuit.
+            reset_seconds (float): Seconds the circuit stays open.
+            window (int): Number of recent call latencies the p95 is taken over.
+            min_samples (int): Latencies needed before calls are hedged.
+            max_hedge_ratio (float): Largest share of the recent calls that may be hedged, so a tool that is slow
+                for everyone doesn't get twice the load.
+        """
+        self.name = name
+        self.deadline_seconds = deadline_seconds
+        self.hedge = hedge
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._hedged: Deque[bool] = deque(maxlen=window)  # whether each recent call was hedged
+        self._failures = 0  # failed calls in a row
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def hedge_after(self) -> Optional[float]:
+        """
+        Returns the seconds after which a call gets a hedged duplicate, None if it doesn't.
+        """
+        with self._lock:
+            if not self.hedge or len(self._latencies) < self.min_samples:
+                return None
+            if sum(self._hedged) >= self.max_hedge_ratio * len(self._hedged):
+                return None
+            latencies = sorted(self._latencies)
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        return p95 if p95 < self.deadline_seconds else None
+
+    def _admit(self) -> None:
+        # raises the structured error while the circuit is open, lets a single trial call through afterwards
+        with self._lock:
+            if self._opened_at is None:
+                return
+            retry_after = self._opened_at + self.reset_seconds - time.monotonic()
+            if retry_after <= 0 and not self._trial_running:
+                self._trial_running = True
+                return
+        raise ToolException(tool_error(
+            self.name, "unavailable",
+            f"{self.name} failed {self.failure_threshold} times in a row and is paused.", max(retry_after, 1)))
+
+    def _record(self, latency: Optional[float], hedged: bool) -> None:
+        # latency of a call that answered, None for one that failed
+        with self._lock:
+            self._hedged.append(hedged)
+            self._trial_running = False
+            if latency is not None:
+                self._latencies.append(latency)
+                self._failures, self._opened_at = 0, None
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()  # opened, or opened again after a failed trial call
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """
+        Calls `fn` within the deadline, hedged if it is slow.
+        Args:
+            fn (Callable[[], Any]): The tool call.
+        Returns:
+            Any: The result of the call that answered first.
+        Raises:
+            ToolException: With a tool_error if the circuit is open or no call answered by the deadline.
+        """
+        self._admit()
+        start = time.monotonic()
+        deadline = start + self.deadline_seconds
+        # every call runs in a copy of the caller's context, e.g. the run's config, a context can't be shared
+        calls: List[Future] = [_executor().submit(contextvars.copy_context().run, fn)]
+        hedge_after = self.hedge_after()
+        done, _ = wait(calls, timeout=hedge_after if hedge_after is not None else self.deadline_seconds)
+        if not done and hedge_after is not None:
+            calls.append(_executor().submit(contextvars.copy_context().run, fn))
+            done, _ = wait(calls, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            self._record(None, len(calls) > 1)
+            raise ToolException(tool_error(
+                self.name, "timeout", f"{self.name} did not answer within {self.deadline_seconds:g} seconds."))
+        finished = next(iter(done))
+        try:
+            result = finished.result()
+        except BaseException:
+            self._record(None, len(calls) > 1)
+            raise
+        self._record(time.monotonic() - start, len(calls) > 1)
+        return result
+
+
+def guard_tool(tool: BaseTool, deadline_seconds: float, hedge: bool = True, **guard_params: Any) -> BaseTool:
+    """
+    Returns a copy of `tool` whose calls go through a ToolGuard. Its timeouts and the open circuit become a
+    ToolMessage with the structured error instead of failing the graph run.
+    The copy only keeps the sync function, async callers run it in a thread like any sync-only tool.
+    Args:
+        tool (BaseTool): The tool to wrap, e.g. a StructuredTool or a @tool function.
+        deadline_seconds (float): Seconds a call may take.
+        hedge (bool): Whether slow calls get a duplicate, only for tools that are safe to call twice.
+        **guard_params: Further arguments of ToolGuard, e.g. failure_threshold.
+    Returns:
+        BaseTool: The guarded copy of the tool with the same name, description and schema.
+    """
+    guard = ToolGuard(tool.name, deadline_seconds, hedge, **guard_params)
+    func = tool.func
+
+    def guarded_func(*args: Any, **kwargs: Any) -> Any:
+        return guard.call(lambda: func(*args, **kwargs))
+
+    return tool.model_copy(update={"func": guarded_func, "coroutine": None, "handle_tool_error": True})
+
+
+def with_tool_guard(tools: Sequence[BaseTool], deadline_seconds: Dict[str, float],
+                    hedged: Collection[str] = ()) -> List[BaseTool]:
+    """
+    Wraps the tools that have a deadline configured with guard_tool, the others are returned unchanged.
+    Apply it before with_tool_cache, the cache joins identical concurrent calls and would join the hedge too.
+    Args:
+        tools (Sequence[BaseTool]): The tools of the graph.
+        deadline_seconds (Dict[str, float]): Deadline in seconds per tool name.
+        hedged (Collection[str]): Names of the tools whose slow calls get a duplicate.
+    Returns:
+        List[BaseTool]: The tools, in the same order.
+    """
+    return [guard_tool(t, deadline_seconds[t.name], t.name in hedged) if t.name in deadline_seconds else t
+            for t in tools]
@@ -0,0 +1,249 @@
+import asyncio
+import importlib
+import itertools
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import uuid
+import zlib
+from contextlib import aclosing
+from functools import lru_cache
+from multiprocessing.connection import Connection
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from remote_graph import RemoteGraphError, stream_run
+
+# Environment variables a run takes along to its worker, the apps let the user enter the API key at runtime
+FORWARDED_ENV = ("OPENAI_API_KEY",)
+
+
+def _worker_main(conn: Connection, run_module: str, run_name: str) -> None:
+    """
+    Entry point of a worker process: serves the runs the pool sends over `conn` until the pool goes away.
+    """
+    run = getattr(importlib.import_module(run_module), run_name)
+    asyncio.run(_serve(conn, run))
+
+
+async def _serve(conn, run) -> None:
+    loop = asyncio.get_running_loop()
+    tasks: Dict[str, asyncio.Task] = {}
+    outbox: List[Tuple[str, Dict[str, Any]]] = []
+    stopped = asyncio.Event()
+
+    def flush() -> None:
+        batch = outbox[:]
+        outbox.clear()
+        conn.send(batch)
+
+    def send(run_id: str, record: Dict[str, Any]) -> None:
+        # every record of one loop iteration, e.g. the tokens of all runs of the worker, goes in one message
+        if not outbox:
+            loop.call_soon(flush)
+        outbox.append((run_id, record))
+
+    async def serve_run(run_id: str, payload: Dict[str, Any]) -> None:
+        try:
+            async with aclosing(stream_run(run, payload)) as records:
+                async for record in records:
+                    send(run_id, record)
+        finally:
+            tasks.pop(run_id, None)
+
+    def receive(message: Tuple) -> None:
+        kind, run_id, *args = message
+        if kind == "run":
+            env, payload = args
+            os.environ.update({name: value for name, value in env.items() if value is not None})
+            tasks[run_id] = asyncio.ensure_future(serve_run(run_id, payload))
+        elif kind == "cancel" and run_id in tasks:
+            tasks[run_id].cancel()  # the consumer is gone, stream_run cancels the graph run
+
+    def read() -> None:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):  # the pool's process exited or closed the pipe
+                break
+            loop.call_soon_threadsafe(receive, message)
+        loop.call_soon_threadsafe(stopped.set)
+
+    threading.Thread(target=read, name="worker-pipe", daemon=True).start()
+    await stopped.wait()
+    for task in list(tasks.values()):
+        task.cancel()
+
+
+class _Worker:
+    """
+    One worker process of the pool, its pipe and the runs waiting for its records.
+    """
+
+    def __init__(self, run_module: str, run_name: str, index: int, processes: int):
+        # a plain `python -m worker_pool` instead of multiprocessing's spawn, which would import the main module
+        # of the server in the worker, under Streamlit the app script itself
+        parent_socket, child_socket = socket.socketpair()
+        self.name = f"graph-worker-{index}"
+        # the workers split the model's rate limits between them, see rate_limiter.get_rate_limiter
+        env = dict(os.environ, RATE_LIMIT_PROCESSES=str(processes * int(os.getenv("RATE_LIMIT_PROCESSES", "1"))))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "worker_pool", str(child_socket.fileno()), run_module, run_name],
+            cwd=os.path.dirname(os.path.abspath(__file__)), pass_fds=(child_socket.fileno(),), env=env)
+        child_socket.close()
+        self.conn = Connection(parent_socket.detach())
+        self.runs: Dict[str, Callable[[List[Dict[str, Any]]], None]] = {}  # run id -> delivers a batch of records
+        self.send_lock = threading.Lock()  # sessions start and cancel runs from several threads
+        threading.Thread(target=self._read, name=f"{self.name}-pipe", daemon=True).start()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def send(self, message: Tuple) -> None:
+        with self.send_lock:
+            self.conn.send(message)
+
+    def _read(self) -> None:
+        while True:
+            try:
+                batch = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            by_run: Dict[str, List[Dict[str, Any]]] = {}
+            for run_id, record in batch:
+                by_run.setdefault(run_id, []).append(record)
+            for run_id, records in by_run.items():
+                deliver = self.runs.get(run_id)
+                if deliver is not None:  # a closed run may still get the records sent before it was cancelled
+                    deliver(records)
+        # the worker died, its runs end with an error instead of waiting forever
+        for deliver in list(self.runs.values()):
+            deliver([{"e": "error", "d": f"{self.name} exited"}])
+
+
+class WorkerRun:
+    """
+    One graph run on a worker of the pool. `stream` and `astream` yield the records the worker streams for it,
+    like RemoteRun, and keep the data of its final record in `result`. Closing the stream early cancels the run.
+    """
+
+    def __init__(self, worker: _Worker, payload: Dict[str, Any]):
+        self.worker = worker
+        self.payload = payload
+        self.id = uuid.uuid4().hex
+        self.result: Any = None
+        self._done = False
+
+    def _start(self, deliver: Callable[[List[Dict[str, Any]]], None]) -> None:
+        self.worker.runs[self.id] = deliver
+        self.worker.send(("run", self.id, {name: os.getenv(name) for name in FORWARDED_ENV}, self.payload))
+
+    def _stop(self) -> None:
+        self.worker.runs.pop(self.id, None)
+        if not self._done:
+            try:
+                self.worker.send(("cancel", self.id))
+            except OSError:
+                pass  # the worker is gone and the run with it
+
+    def _read(self, records: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for record in records:
+            if record["e"] == "end":
+                self.result, self._done = record["d"], True
+                return
+            if record["e"] == "error":
+                self._done = True
+                raise RemoteGraphError(record["d"])
+            yield record
+
+    def stream(self) -> Iterator[Dict[str, Any]]:
+        batches: queue.SimpleQueue = queue.SimpleQueue()
+        self._start(batches.put)
+        try:
+            while not self._done:
+                yield from self._read(batches.get())
+        finally:
+            self._stop()
+
+    async def astream(self) -> AsyncIterator[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        batches: asyncio.Queue = asyncio.Queue()
+        self._start(lambda records: loop.call_soon_threadsafe(batches.put_nowait, records))
+        try:
+            while not self._done:
+                for record in self._read(await batches.get()):
+                    yield record
+        finally:
+            self._stop()
+
+
+class WorkerPool:
+    """
+    Worker processes that run the graph, so the runs of concurrent sessions use more than the one core the GIL
+    leaves a Streamlit server. Every worker runs many sessions at once on its own event loop. A session sticks to
+    one worker, so the checkpoints and caches of its runs stay in that worker's memory. Every worker gets an equal
+    share of RATE_LIMIT_RPM and RATE_LIMIT_TPM, so together they stay within the provider's limits.
+    """
+
+    def __init__(self, size: int, run_module: str = "graph_server", run_name: str = "run_graph"):
+        """
+        Initializes the WorkerPool, its workers start with the first run.
+        Args:
+            size (int): Number of worker processes.
+            run_module (str): Module the workers import the run from, graph_server of the example.
+            run_name (str): The GraphRun of that module, see remote_graph.create_app.
+        """
+        self.size = size
+        self.run_module = run_module
+        self.run_name = run_name
+        self._workers: List[Optional[_Worker]] = [None] * size
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+
+    def _worker(self, index: int) -> _Worker:
+        with self._lock:
+            if self._workers[index] is None or not self._workers[index].alive:  # started, or restarted after a crash
+                self._workers[index] = _Worker(self.run_module, self.run_name, index, self.size)
+            return self._workers[index]
+
+    def start(self) -> None:
+        # importing the graph takes a worker a second or two, all of them do it at the same time
+        for index in range(self.size):
+            self._worker(index)
+
+    def open_run(self, payload: Dict[str, Any], affinity: Optional[str] = None) -> WorkerRun:
+        """
+        Returns a run on the worker of `affinity`, it starts once its stream is iterated.
+        Args:
+            payload (Dict[str, Any]): The JSON input of the run, as for the graph server.
+            affinity (Optional[str]): The key runs are kept together by, e.g. the Streamlit session or the graph's
+                thread ID. Runs without one go to the workers in turn.
+        Returns:
+            WorkerRun: The run.
+        """
+        if affinity is None:
+            index = next(self._round_robin) % self.size
+        else:
+            index = zlib.crc32(affinity.encode()) % self.size  # stable across processes, unlike hash()
+        return WorkerRun(self._worker(index), payload)
+
+
+@lru_cache(maxsize=None)
+def get_worker_pool(size: int) -> WorkerPool:
+    """
+    Returns the process-wide WorkerPool of `size` workers, starting them on the first call.
+    Args:
+        size (int): Number of worker processes, GRAPH_WORKERS.
+    Returns:
+        WorkerPool: The shared pool.
+    """
+    pool = WorkerPool(size)
+    pool.start()
+    return pool
+
+
+if __name__ == "__main__":  # a worker process started by the pool: python -m worker_pool <fd> <module> <run>
+    _worker_main(Connection(int(sys.argv[1])), sys.argv[2], sys.argv[3])
@@ -3,9 +3,13 @@ from dotenv import load_dotenv
 
 import streamlit as st
 from langchain_core.messages import AIMessage, HumanMessage
-import asyncio
 
-from astream_events_handler import invoke_our_graph   # Utility function to handle events from astream_events from graph
+from chat_history import message_markdown, render_chat_history  # Paginated chat history rendering
+from event_loop import run_async  # Runs coroutines on a persistent background event loop
+from llm_clients import warm_up  # Opens the pooled connection to the model provider ahead of the first turn
+from preload import preload  # Imports and builds the graph in the background once the page is drawn
+from run_control import RunCancelled, RunControl  # Cancels a running graph on a Stop click or a newer prompt
+from turn_metrics import TurnMetrics, render_metrics_panel, report_turn  # Per-turn timings and their export
 
 load_dotenv()
 
@@ -27,6 +31,9 @@ if not os.getenv('OPENAI_API_KEY'):
         st.info("Please enter your OPENAI_API_KEY in the sidebar.")
         st.stop()
 
+# Open a keep-alive connection in the background (once per process) so the first prompt skips the TLS handshake
+warm_up()
+
 # Capture user input from chat input
 prompt = st.chat_input()
 
@@ -38,24 +45,28 @@ if prompt is not None:
 with st.expander(label="Simple Chat Streaming and Tool Calling using LangGraph's Astream Events", expanded=st.session_state.expander_open):
     """
     In this example, we're going to be creating our own events handler to stream our [_LangGraph_](https://langchain-ai.github.io/langgraph/)
-    invocations with via [`astream_events (v2)`](https://langchain-ai.github.io/langgraph/how-tos/streaming-from-final-node/).
-    This one is does not use any callbacks or external streamlit libraries and is asynchronous.
-    we've implemented `on_llm_new_token`, a method that run on every new generation of a token from the ChatLLM model, and
-    `on_tool_start` a method that runs on every tool call invocation even multiple tool calls, and `on_tool_end` giving final result of tool call.
+    invocations. It is asynchronous and doesn't use external streamlit libraries, instead of the full `astream_events (v2)`
+    stream it builds the few events it renders, with the same names, from the graph's `stream_mode=["messages", "tasks"]`
+    and a small callback handler that reports every tool as soon as it returns.
+    We handle `on_chat_model_stream`, sent for every new token from the ChatLLM model, `on_tool_start`, sent for every tool
+    call invocation even multiple tool calls, and `on_tool_end` giving the final result of each tool call as it finishes.
     """
 
 # Initialize chat messages in session state
 if "messages" not in st.session_state:
     st.session_state["messages"] = [AIMessage(content="How can I help you?")]
 
-# Loop through all messages in the session state and render them as a chat on every st.refresh mech
-for msg in st.session_state.messages:
+# Render the newest turns of the chat on every st.refresh mech, earlier turns are loaded on demand
+def render_message(index, msg):
     # https://docs.streamlit.io/develop/api-reference/chat/st.chat_message
     # we store them as AIMessage and HumanMessage as its easier to send to LangGraph
     if isinstance(msg, AIMessage):
-        st.chat_message("assistant").write(msg.content)
+        st.chat_message("assistant").write(message_markdown(msg))
     elif isinstance(msg, HumanMessage):
-        st.chat_message("user").write(msg.content)
+        st.chat_message("user").write(message_markdown(msg))
+
+
+render_chat_history(st.session_state.messages, render_message)
 
 # Handle user input if provided
 if prompt:
@@ -65,5 +76,28 @@ if prompt:
     with st.chat_message("assistant"):
         # create a placeholder container for streaming and any other events to visually render here
         placeholder = st.container()
-        response = asyncio.run(invoke_our_graph(st.session_state.messages, placeholder))
-        st.session_state.messages.append(AIMessage(response))
+        stop_placeholder = st.empty()
+        # clicking Stop reruns the script, which cancels the run and keeps the answer streamed so far
+        stop_placeholder.button("Stop", key="stop_generation")
+        from astream_events_handler import invoke_our_graph  # usually preloaded already, see the end of the script
+        metrics = TurnMetrics()  # node, model, tool and render timings of this turn
+        control = RunControl()  # cancels the run on a Stop click, a newer prompt or the user leaving
+        # run on the long-lived background event loop so async clients and pools survive across turns
+        try:
+            response = run_async(invoke_our_graph(st.session_state.messages, placeholder, metrics=metrics,
+                                                  control=control), control=control)
+        except RunCancelled:
+            response = control.partial_text  # the tokens streamed before the run was cancelled
+        stop_placeholder.empty()
+        report_turn(metrics)  # exported to the metrics endpoint and the JSONL sink if enabled
+        st.session_state.turn_metrics = metrics
+        if response:
+            st.session_state.messages.append(AIMessage(response))
+        control.resume()  # carries out the rerun or stop that cancelled the run, now that its answer is saved
+
+# Optional sidebar panel with the timings of the last turn
+render_metrics_panel(st.session_state.get("turn_metrics"))
+
+# The page is drawn, import the graph and build it in the background (once per process) ahead of the first prompt
+preload("graph", "get_graph_runnable")
+preload("remote_graph", "start_graph_workers")  # the worker processes, if GRAPH_WORKERS is set
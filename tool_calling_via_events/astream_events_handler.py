@@ -1,15 +1,27 @@
+import asyncio
+
 from langchain_core.messages import AIMessage
 import streamlit as st
-from graph import graph_runnable
+from graph import get_graph_runnable
+from graph_stream import astream_ui_events
+from markdown_stream import MarkdownStream
+from remote_graph import dump_messages, open_run, session_id, use_remote_graph
+from run_control import CancelCallbackHandler, RunCancelled
+from stream_trace import load_event, new_trace_path, record_events
+from turn_metrics import QueueWaitHandler, observe_events
 
 
-async def invoke_our_graph(st_messages, st_placeholder):
+async def invoke_our_graph(st_messages, st_placeholder, events=None, metrics=None, control=None):
     """
     Asynchronously processes a stream of events from the graph_runnable and updates the Streamlit interface.
 
     Args:
         st_messages (list): List of messages to be sent to the graph_runnable.
         st_placeholder (st.beta_container): Streamlit placeholder used to display updates and statuses.
+        events (AsyncIterator[dict], optional): Events to render instead of running the graph, e.g. from stream_trace.replay_events.
+        metrics (TurnMetrics, optional): Collects the node, model, tool and render timings of this turn.
+        control (RunControl, optional): The control event_loop.run_async cancels the run with, a cancelled run
+            returns the text streamed so far.
 
     Returns:
         AIMessage: An AIMessage object containing the final aggregated text content from the events.
@@ -17,38 +29,70 @@ async def invoke_our_graph(st_messages, st_placeholder):
     # Set up placeholders for displaying updates in the Streamlit app
     container = st_placeholder  # This container will hold the dynamic Streamlit UI components
     thoughts_placeholder = container.container()  # Container for displaying status messages
-    token_placeholder = container.empty()  # Placeholder for displaying progressive token updates
+    # Streams tokens block by block, finished markdown blocks are frozen and only the open block is re-rendered
+    markdown_stream = MarkdownStream(container.container())
     final_text = ""  # Will store the accumulated text from the model's response
+    # status box and output placeholder of every running tool call, keyed by the event's run_id
+    # so the end of one of several parallel tool calls lands in the right box
+    tool_renders = {}
+
+    if events is None:
+        if use_remote_graph():
+            # GRAPH_SERVER_URL or GRAPH_WORKERS is set, the graph server or a worker runs the graph and streams
+            # the same events, a cancelled run closes its stream, which cancels it there
+            run = open_run({"messages": dump_messages(st_messages), "session_id": session_id()})
+            events = (load_event(record) async for record in run.astream())
+        else:
+            # only the events rendered below, from stream_mode="messages" and "tasks", instead of the astream_events
+            # firehose that builds an event for the start and end of every runnable in the graph
+            # the cancel handler also stops model calls and nodes that run on executor threads, out of reach of
+            # the task, the rate limiter queues the model calls under the session and reports their waits
+            callbacks = [CancelCallbackHandler(control)] if control is not None else []
+            if metrics is not None:
+                callbacks.append(QueueWaitHandler(metrics))
+            config = {"callbacks": callbacks, "metadata": {"session_id": session_id()}}
+            events = astream_ui_events(get_graph_runnable(), {"messages": st_messages}, config)
+        trace_path = new_trace_path()
+        if trace_path:  # STREAM_TRACE_DIR is set, record the rendered events for offline replay
+            events = record_events(events, trace_path)
+    if metrics is not None:  # node, model and tool timings, and the time this loop spends rendering each event
+        events = observe_events(events, metrics)
+
+    try:
+        # Stream events from the graph_runnable asynchronously
+        async for event in events:
+            kind = event["event"]  # Determine the type of event received
+
+            if kind == "on_chat_model_stream":
+                # The event corresponding to a stream of new content (tokens or chunks of text)
+                addition = event["data"]["chunk"].content  # Extract the new content chunk
+                final_text += addition  # Append the new content to the accumulated text
+                if addition:
+                    markdown_stream.append(addition)  # Update the st placeholder with the progressive response
+
+            elif kind == "on_tool_start":
+                # The event signals that a tool is about to be called
+                with thoughts_placeholder:
+                    status_placeholder = st.empty()  # Placeholder to show the tool's status
+                    with status_placeholder.status("Calling Tool...", expanded=True) as s:
+                        st.write("Called ", event['name'])  # Show which tool is being called
+                        st.write("Tool input: ")
+                        st.code(event['data'].get('input'))  # Display the input data sent to the tool
+                        st.write("Tool output: ")
+                        # Placeholder for tool output that will be updated later below
+                        tool_renders[event['run_id']] = (s, st.empty())
 
-    # Stream events from the graph_runnable asynchronously
-    async for event in graph_runnable.astream_events({"messages": st_messages}, version="v2"):
-        kind = event["event"]  # Determine the type of event received
-
-        if kind == "on_chat_model_stream":
-            # The event corresponding to a stream of new content (tokens or chunks of text)
-            addition = event["data"]["chunk"].content  # Extract the new content chunk
-            final_text += addition  # Append the new content to the accumulated text
-            if addition:
-                token_placeholder.write(final_text)  # Update the st placeholder with the progressive response
-
-        elif kind == "on_tool_start":
-            # The event signals that a tool is about to be called
-            with thoughts_placeholder:
-                status_placeholder = st.empty()  # Placeholder to show the tool's status
-                with status_placeholder.status("Calling Tool...", expanded=True) as s:
-                    st.write("Called ", event['name'])  # Show which tool is being called
-                    st.write("Tool input: ")
-                    st.code(event['data'].get('input'))  # Display the input data sent to the tool
-                    st.write("Tool output: ")
-                    output_placeholder = st.empty()  # Placeholder for tool output that will be updated later below
-                    s.update(label="Completed Calling Tool!", expanded=False)  # Update the status once done
-
-        elif kind == "on_tool_end":
-            # The event signals the completion of a tool's execution
-            with thoughts_placeholder:
-                # We assume that `on_tool_end` comes after `on_tool_start`, meaning output_placeholder exists
-                if 'output_placeholder' in locals():
+            elif kind == "on_tool_end":
+                # The event signals the completion of a tool's execution
+                # `on_tool_end` comes after the `on_tool_start` of the same run_id, whichever tool finishes first
+                if event['run_id'] in tool_renders:
+                    status, output_placeholder = tool_renders.pop(event['run_id'])
                     output_placeholder.code(event['data'].get('output').content)  # Display the tool's output
+                    status.update(label="Completed Calling Tool!", expanded=False)  # Update the status once done
+    except (asyncio.CancelledError, RunCancelled):
+        if control is None or not control.cancelled:
+            raise
+        # a Stop click or a newer prompt, the events generator is closed and the streamed text is the answer
 
     # Return the final aggregated message after all events have been processed
     return final_text
@@ -0,0 +1,96 @@
+"""
+Compares how many events each way of streaming the tool calling graph builds and hands to the UI per answer.
+
+  astream_events      astream_events(version="v2"), what the handler used to consume
+  filtered events     astream_events with include_types=["chat_model", "tool"], filtered after the events are built
+  ui events           graph_stream.astream_ui_events, stream_mode=["messages", "tasks"], what the handler consumes
+
+The model is the deterministic fake chat model of the benchmarks directory, no API key is needed.
+
+    python bench_event_stream.py --tokens 500 --tool-calls 2 --runs 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from langchain_core.messages import HumanMessage
+from langchain_core.tracers.event_stream import _AstreamEventsCallbackHandler
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import graph  # noqa: E402
+from fake_chat_model import FakeStreamingChatModel  # noqa: E402
+from graph_stream import astream_ui_events  # noqa: E402
+
+built = 0  # events built by the astream_events tracer, including the ones a filter drops later
+_send = _AstreamEventsCallbackHandler._send
+
+
+def counting_send(self, event, event_type):
+    global built
+    built += 1
+    return _send(self, event, event_type)
+
+
+_AstreamEventsCallbackHandler._send = counting_send
+
+STREAMS = {
+    "astream_events": lambda graph_input: graph.get_graph_runnable().astream_events(graph_input, version="v2"),
+    "filtered events": lambda graph_input: graph.get_graph_runnable().astream_events(
+        graph_input, version="v2", include_types=["chat_model", "tool"]),
+    "ui events": lambda graph_input: astream_ui_events(graph.get_graph_runnable(), graph_input),
+}
+
+
+async def run_once(stream):
+    global built
+    built = 0
+    delivered = 0
+    async for _ in stream({"messages": [HumanMessage(content="What's the weather in sf?")]}):
+        delivered += 1
+    return (built or delivered), delivered  # the ui events are built only when delivered
+
+
+async def bench(name, runs, trace_memory):
+    results = []
+    for _ in range(runs):
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        events_built, delivered = await run_once(STREAMS[name])
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        results.append((events_built, delivered, elapsed, peak))
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=500, help="tokens of the streamed answer")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per streamed chunk")
+    parser.add_argument("--tool-calls", type=int, default=2, help="parallel tool calls before the answer")
+    parser.add_argument("--runs", type=int, default=5, help="answers per stream")
+    args = parser.parse_args()
+
+    model = FakeStreamingChatModel(streaming=True, tokens=args.tokens, chunk_tokens=args.chunk_tokens,
+                                   tool_calls=args.tool_calls)
+    graph.get_chat_model_with_tools = lambda tools, **kwargs: model
+
+    print(f"{'stream':<16} {'built':>7} {'delivered':>10} {'ms/answer':>10} {'peak KiB':>9}")
+    for name in STREAMS:
+        await bench(name, 1, False)  # warm up imports and caches
+        timed = await bench(name, args.runs, False)
+        traced = await bench(name, args.runs, True)  # separately, tracemalloc slows every allocation down
+        print(f"{name:<16} {statistics.median(r[0] for r in timed):>7.0f} "
+              f"{statistics.median(r[1] for r in timed):>10.0f} "
+              f"{statistics.median(r[2] for r in timed) * 1000:>10.1f} "
+              f"{statistics.median(r[3] for r in traced) / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+from typing import Callable, Sequence
+
+import streamlit as st
+from langchain_core.messages import BaseMessage, HumanMessage
+
+
+def visible_start(messages: Sequence[BaseMessage], max_turns: int) -> int:
+    """
+    Returns the index of the first message of the newest `max_turns` turns, a turn starts at a user message.
+    Args:
+        messages (Sequence[BaseMessage]): The chat history.
+        max_turns (int): Number of turns to show.
+    Returns:
+        int: Index of the first message to render.
+    """
+    turns = 0
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            turns += 1
+            if turns == max_turns:
+                return index
+    return 0
+
+
+def message_markdown(message: BaseMessage) -> str:
+    """
+    Returns the markdown to render for a message, content blocks are reduced to their text.
+    Only the visible turns are rendered on a rerun, see render_chat_history, so this isn't cached.
+    Args:
+        message (BaseMessage): The message to render.
+    Returns:
+        str: The markdown text of the message.
+    """
+    if isinstance(message.content, str):
+        return message.content
+    # content blocks, e.g. from tool calling models, only the text parts are shown
+    return "".join(block if isinstance(block, str) else block.get("text", "") for block in message.content)
+
+
+def _show_earlier(state_key: str, page_turns: int) -> None:
+    st.session_state[state_key] += page_turns
+
+
+def render_chat_history(messages: Sequence[BaseMessage], render_message: Callable[[int, BaseMessage], None],
+                        page_turns: int = 20, key: str = "chat_history") -> None:
+    """
+    Renders only the newest `page_turns` turns of the chat history, with a button to load earlier turns,
+    so the cost of a rerun stays the same however long the conversation gets.
+    Args:
+        messages (Sequence[BaseMessage]): The chat history, usually st.session_state.messages.
+        render_message (Callable[[int, BaseMessage], None]): Renders one message given its index in `messages`.
+        page_turns (int): Number of turns shown at first and added by every click on the button.
+        key (str): Prefix of the session state and widget keys.
+    """
+    state_key = f"{key}_turns"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = page_turns
+    start = visible_start(messages, st.session_state[state_key])
+    if start > 0:
+        st.button(f"Load earlier messages ({start} hidden)", key=f"{key}_load_earlier",
+                  on_click=_show_earlier, args=[state_key, page_turns])
+    for index in range(start, len(messages)):
+        render_message(index, messages[index])
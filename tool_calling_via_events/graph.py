@@ -1,20 +1,26 @@
-from typing import Annotated, TypedDict, Literal
+import os
+from functools import lru_cache
+from typing import Annotated, List, TypedDict, Literal
 
 from langgraph.prebuilt import ToolNode
-from langchain_core.tools import tool, StructuredTool
+from langchain_core.tools import BaseTool, tool, StructuredTool
 from langgraph.graph import START, StateGraph
 from langgraph.graph.message import AnyMessage, add_messages
-from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
-from langchain_openai import ChatOpenAI
 
-# Define a search tool using DuckDuckGo API wrapper
-search_DDG = StructuredTool.from_function(
-        name="Search",
-        func=DuckDuckGoSearchAPIWrapper().run,  # Executes DuckDuckGo search using the provided query
-        description=f"""
-        useful for when you need to answer questions about current events. You should ask targeted questions
-        """,
-    )
+from context_window import get_context_window
+from llm_clients import get_chat_model_with_tools
+from response_cache import invoke_with_cache
+from tool_cache import with_tool_cache
+from tool_guard import with_tool_guard
+
+@lru_cache(maxsize=None)
+def _search_api():
+    # langchain_community and the DuckDuckGo client are imported and set up by the first search, not at import
+    from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+    return DuckDuckGoSearchAPIWrapper()
+
+def _search(query: str) -> str:
+    return _search_api().run(query)  # Executes DuckDuckGo search using the provided query
 
 @tool
 def get_weather(location: str):
@@ -31,17 +37,35 @@ def get_coolest_cities():
     # Hardcoded response with a list of cool cities
     return "nyc, sf"
 
-# List of tools that will be accessible to the graph via the ToolNode
-tools = [get_weather, get_coolest_cities, search_DDG]
-tool_node = ToolNode(tools)
+@lru_cache(maxsize=None)
+def get_tools() -> List[BaseTool]:
+    """
+    Returns the tools that will be accessible to the graph via the ToolNode, built once per process on first use.
+    Search results are cached for a while and identical concurrent searches share one outbound call.
+    A slow search gets a hedged duplicate and ends at its deadline, SEARCH_DEADLINE_SECONDS, with an error the model
+    answers around, after repeated failures the search is paused for a while.
+    Returns:
+        List[BaseTool]: The tools of the graph.
+    """
+    # Define a search tool using DuckDuckGo API wrapper
+    search_DDG = StructuredTool.from_function(
+            name="Search",
+            func=_search,
+            description=f"""
+            useful for when you need to answer questions about current events. You should ask targeted questions
+            """,
+        )
+    # guarded inside the cache, the cache would join the hedged duplicate of a search to the search itself
+    tools = with_tool_guard([get_weather, get_coolest_cities, search_DDG],
+                            deadline_seconds={"Search": float(os.getenv("SEARCH_DEADLINE_SECONDS", "10"))},
+                            hedged={"Search"})
+    return with_tool_cache(tools, ttl_seconds={"Search": 10 * 60})
 
 # This is the default state same as "MessageState" TypedDict but allows us accessibility to custom keys
 class GraphsState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     # Custom keys for additional data can be added here such as - conversation_id: str
 
-graph = StateGraph(GraphsState)
-
 # Function to decide whether to continue tool usage or end the process
 def should_continue(state: GraphsState) -> Literal["tools", "__end__"]:
     messages = state["messages"]
@@ -52,27 +76,36 @@ def should_continue(state: GraphsState) -> Literal["tools", "__end__"]:
 
 # Core invocation of the model
 def _call_model(state: GraphsState):
-    messages = state["messages"]
-    llm = ChatOpenAI(
-        temperature=0.7,
-        streaming=True,
-        # specifically for OpenAI we have to set parallel tool call to false
-        # because of st primitively visually rendering the tool results
-    ).bind_tools(tools, parallel_tool_calls=False)
-    response = llm.invoke(messages)
+    # recent turns are sent verbatim, older ones are folded into a rolling summary to stay within budget
+    messages = get_context_window().fit(state["messages"])
+    # shared per process, the tool schemas are converted once and the pooled HTTP client is reused
+    # parallel tool calls are enabled, the ToolNode runs them concurrently and the UI matches
+    # every tool's start and end by run_id, so a turn takes as long as its slowest tool
+    llm = get_chat_model_with_tools(get_tools(), temperature=0.7, streaming=True)
+    response = invoke_with_cache(llm, messages)  # replays a cached answer if the opt-in cache is enabled
     return {"messages": [response]}  # add the response to the messages using LangGraph reducer paradigm
 
-# Define the structure (nodes and directional edges between nodes) of the graph
-graph.add_edge(START, "modelNode")
-graph.add_node("tools", tool_node)
-graph.add_node("modelNode", _call_model)
+@lru_cache(maxsize=None)
+def get_graph_runnable():
+    """
+    Returns the compiled graph, built once per process on the first call and shared by every session and rerun.
+    The app imports this module after drawing the page, so neither the imports nor the build delay the first paint.
+    Returns:
+        CompiledStateGraph: The runnable graph.
+    """
+    graph = StateGraph(GraphsState)
+
+    # Define the structure (nodes and directional edges between nodes) of the graph
+    graph.add_edge(START, "modelNode")
+    graph.add_node("tools", ToolNode(get_tools()))
+    graph.add_node("modelNode", _call_model)
 
-# Add conditional logic to determine the next step based on the state (to continue or to end)
-graph.add_conditional_edges(
-    "modelNode",
-    should_continue,  # This function will decide the flow of execution
-)
-graph.add_edge("tools", "modelNode")
+    # Add conditional logic to determine the next step based on the state (to continue or to end)
+    graph.add_conditional_edges(
+        "modelNode",
+        should_continue,  # This function will decide the flow of execution
+    )
+    graph.add_edge("tools", "modelNode")
 
-# Compile the state graph into a runnable object
-graph_runnable = graph.compile()
\ No newline at end of file
+    # Compile the state graph into a runnable object
+    return graph.compile()
\ No newline at end of file
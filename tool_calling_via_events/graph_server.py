@@ -0,0 +1,58 @@
+"""
+Serves the graph of this example over HTTP, so the app can run it in another process or on another machine.
+
+Runs are streamed as Server-Sent Events (POST /runs/stream) or over a WebSocket (/runs/ws), one record per
+event of graph_stream.astream_ui_events. Start the server from this directory and point the app at it,
+the handler renders the remote events the way it renders local ones:
+
+    uvicorn graph_server:app --port 8500
+    GRAPH_SERVER_URL=http://127.0.0.1:8500 streamlit run app.py
+
+Set GRAPH_SERVER_TRANSPORT=ws for the app to use the WebSocket instead.
+"""
+import asyncio
+
+from dotenv import load_dotenv
+from langchain_core.callbacks.base import BaseCallbackHandler
+
+from graph import get_graph_runnable
+from graph_stream import astream_ui_events
+from remote_graph import create_app, load_messages
+from run_control import CancelCallbackHandler, RunControl
+from stream_trace import dump_event
+from turn_metrics import RATE_LIMIT_EVENT
+
+load_dotenv()
+
+
+class QueueWaitForwarder(BaseCallbackHandler):
+    """
+    Sends the waits of the model calls for the rate limiter along as on_custom_event events, the turn metrics of
+    the app add them up. The streamed modes of astream_ui_events don't carry custom events.
+    """
+
+    run_inline = True
+
+    def __init__(self, emit):
+        self.emit = emit
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == RATE_LIMIT_EVENT:
+            self.emit(dump_event({"event": "on_custom_event", "name": name, "run_id": run_id, "data": data}))
+
+
+# also what the workers of GRAPH_WORKERS run, see worker_pool.py
+async def run_graph(payload, emit):
+    control = RunControl()  # also stops the nodes that run on executor threads once the client is gone
+    config = {"callbacks": [CancelCallbackHandler(control), QueueWaitForwarder(emit)],
+              "metadata": {"session_id": payload.get("session_id")}}
+    try:
+        async for event in astream_ui_events(get_graph_runnable(), {"messages": load_messages(payload["messages"])},
+                                             config):
+            emit(dump_event(event))
+    except asyncio.CancelledError:
+        control.cancel()
+        raise
+
+
+app = create_app(run_graph)
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langchain_core.runnables import Runnable
+
+
+class _ToolEndHandler(AsyncCallbackHandler):
+    """
+    Queues the ToolMessage of every tool call as soon as its tool returns. The "messages" stream only carries them
+    once the whole ToolNode finished, i.e. every parallel tool call would end with the slowest one.
+    """
+
+    run_inline = True
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    # only tool callbacks are handled, the callback manager skips the handler for every token, chain and model run
+    @property
+    def ignore_llm(self) -> bool:
+        return True
+
+    @property
+    def ignore_chat_model(self) -> bool:
+        return True
+
+    @property
+    def ignore_chain(self) -> bool:
+        return True
+
+    async def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        if isinstance(output, ToolMessage):
+            self.queue.put_nowait(("tool_end", output))
+
+
+async def astream_ui_events(graph: Runnable, graph_input: Any,
+                            config: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streams a graph run as the few astream_events (v2) events the UI renders, built from
+    `stream_mode=["messages", "tasks"]` instead of the full event stream. No event is built for the
+    start and end of every chain, prompt or parser run, only for tokens, tool calls and node boundaries.
+    The events have the shape and names of astream_events, with the task ID of the node as run_id of
+    its tokens and the tool call ID as run_id of a tool call. on_tool_end comes from a callback handler when each
+    tool returns, a tool call that failed without one ends with the ToolMessage of the "messages" stream.
+    Args:
+        graph (Runnable): The compiled graph.
+        graph_input (Any): The input of the run.
+        config (Optional[Dict[str, Any]]): The config of the run.
+    Returns:
+        AsyncIterator[Dict[str, Any]]: on_chain_start/on_chain_end per node run, on_chat_model_stream per token
+            chunk, on_chat_model_end per model call, on_tool_start per tool call and on_tool_end per tool result.
+    """
+    # the streamed parts and the tool ends of the callback handler in the order they happen, None after the run
+    queue: asyncio.Queue = asyncio.Queue()
+    config = dict(config or {})
+    config["callbacks"] = [*(config.get("callbacks") or []), _ToolEndHandler(queue)]
+
+    async def run() -> None:
+        async for part in graph.astream(graph_input, config, stream_mode=["messages", "tasks"]):
+            queue.put_nowait(part)
+
+    task = asyncio.ensure_future(run())
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    step, step_done = 0, True
+    ended = set()  # tool call IDs whose on_tool_end was sent
+    try:
+        while (part := await queue.get()) is not None:
+            mode, payload = part
+            if mode == "tool_end" or (mode == "messages" and isinstance(payload[0], ToolMessage)):
+                message = payload if mode == "tool_end" else payload[0]
+                if message.tool_call_id not in ended:
+                    ended.add(message.tool_call_id)
+                    yield {"event": "on_tool_end", "name": message.name, "run_id": message.tool_call_id,
+                           "data": {"output": message}}
+
+            elif mode == "messages":
+                message, metadata = payload
+                if isinstance(message, AIMessageChunk):
+                    # the checkpoint namespace of a node run is "<node>:<task id>"
+                    task_id = metadata.get("langgraph_checkpoint_ns", "").rsplit(":", 1)[-1]
+                    yield {"event": "on_chat_model_stream", "name": metadata.get("langgraph_node"),
+                           "run_id": task_id, "data": {"chunk": message}}
+
+            elif "result" not in payload:  # a node starts
+                if step_done:  # nodes started before any of them finished run in the same superstep
+                    step, step_done = step + 1, False
+                yield {"event": "on_chain_start", "name": payload["name"], "run_id": payload["id"],
+                       "tags": [f"graph:step:{step}"], "metadata": {"langgraph_node": payload["name"]}, "data": {}}
+
+            else:  # a node finished
+                step_done = True
+                yield {"event": "on_chain_end", "name": payload["name"], "run_id": payload["id"], "data": {}}
+                result = payload["result"] if isinstance(payload["result"], dict) else {}
+                for message in result.get("messages", []):
+                    if isinstance(message, AIMessage):
+                        yield {"event": "on_chat_model_end", "name": payload["name"], "run_id": payload["id"],
+                               "data": {"output": message}}
+                        for call in message.tool_calls:
+                            yield {"event": "on_tool_start", "name": call["name"], "run_id": call["id"],
+                                   "data": {"input": call["args"]}}
+        task.result()  # raises the error the run failed with
+    finally:
+        task.cancel()  # the consumer stopped early, e.g. a cancelled turn
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,119 @@
+import re
+from typing import List, Tuple
+
+from streamlit.delta_generator import DeltaGenerator
+
+# Lines that open or close a fenced code block, e.g. ``` or ~~~python
+FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# Top level list items, e.g. "- item", "* item" or "1. item", they open or continue a list block
+LIST_ITEM_RE = re.compile(r"^([-*+]|\d{1,9}[.)])\s")
+# ATX headings, e.g. "## Title", are complete as soon as their line ends
+HEADING_RE = re.compile(r"^ {0,3}#{1,6}(\s|$)")
+
+
+def split_markdown_blocks(text: str) -> Tuple[List[str], str]:
+    """
+    Splits streamed markdown into the blocks that are finished and the trailing block that is still open.
+    A block is finished once a later line proves it can't grow anymore: a blank line ends a paragraph,
+    a closing fence ends a code block. A list is one block with its blank lines and indented continuations, so
+    numbering and loose spacing render like the unsplit text, it ends at the first line after a blank line that is
+    neither indented nor a list item, or at a heading or fence.
+    Args:
+        text (str): Markdown text that starts at a block boundary.
+    Returns:
+        Tuple[List[str], str]: The finished blocks in order and the text of the open trailing block.
+    """
+    blocks = []
+    start = 0  # Offset where the current block begins
+    pos = 0  # Offset of the line being inspected
+    fence = None  # Marker of the open code fence, if any
+    in_list = False  # Whether the current block is a list
+    after_blank = False  # Whether the previous line of the list was blank
+
+    def finish(end: int) -> None:
+        if text[start:end].strip():
+            blocks.append(text[start:end])
+
+    while True:
+        end = text.find("\n", pos)
+        if end == -1:
+            break  # An incomplete line always belongs to the open block
+        line = text[pos:end]
+        next_pos = end + 1
+
+        if in_list:
+            if not line.strip():
+                after_blank = True
+                pos = next_pos
+                continue
+            # list items, indented lines and, right after a line of text, lazy continuations stay in the list
+            if (LIST_ITEM_RE.match(line) or line[0] in " \t"
+                    or not (after_blank or FENCE_RE.match(line) or HEADING_RE.match(line))):
+                after_blank = False
+                pos = next_pos
+                continue
+            finish(pos)
+            start = pos
+            in_list = False
+
+        if fence:
+            match = FENCE_RE.match(line)
+            # A closing fence uses the same character, is at least as long and carries no info string
+            if (match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence)
+                    and not line[match.end():].strip()):
+                finish(next_pos)
+                start = next_pos
+                fence = None
+        elif not line.strip():
+            finish(pos)
+            start = next_pos
+        elif FENCE_RE.match(line):
+            finish(pos)
+            start = pos
+            fence = FENCE_RE.match(line).group(1)
+        elif HEADING_RE.match(line):
+            finish(pos)
+            start = pos
+            finish(next_pos)
+            start = next_pos
+        elif LIST_ITEM_RE.match(line):
+            finish(pos)
+            start = pos
+            in_list, after_blank = True, False
+        pos = next_pos
+
+    return blocks, text[start:]
+
+
+class MarkdownStream:
+    """
+    Streams markdown into a Streamlit container one block at a time.
+    Finished blocks are written once into their own element and never touched again, only the
+    trailing open block is re-rendered, so the cost of a chunk depends on the size of the current
+    block instead of the whole response.
+    """
+
+    def __init__(self, container: DeltaGenerator):
+        """
+        Initializes the MarkdownStream with the Streamlit container the blocks are appended to.
+        Args:
+            container (DeltaGenerator): The Streamlit container where the markdown will be rendered.
+        """
+        self.container = container
+        self.live_placeholder = self.container.empty()  # Element that holds the open block
+        self.open_block = ""  # Text of the trailing block that can still change
+
+    def append(self, chunk: str) -> None:
+        """
+        Adds a chunk of streamed text, freezes the blocks it finishes and refreshes the open block.
+        Args:
+            chunk (str): The new text received from the model.
+        """
+        if not chunk:
+            return
+        blocks, self.open_block = split_markdown_blocks(self.open_block + chunk)
+        for block in blocks:
+            self.live_placeholder.markdown(block)  # Final render of the block into its own element
+            self.live_placeholder = self.container.empty()
+        if self.open_block.strip():
+            self.live_placeholder.markdown(self.open_block)
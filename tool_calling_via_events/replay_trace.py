@@ -0,0 +1,60 @@
+"""
+Replays a recorded astream_events trace into the events handler without a model or an API key.
+
+Traces are recorded by running the app with STREAM_TRACE_DIR set, every graph run writes one file.
+The handler runs in a headless Streamlit script run (AppTest), so every re-render is built and queued
+as it is for a browser, this measures the handler's render throughput or, with --speed 1,
+reproduces the pacing of the recorded run.
+
+    python replay_trace.py traces/20250101-120000-1a2b3c4d.jsonl --speed 0
+"""
+import argparse
+import os
+
+from streamlit.testing.v1 import AppTest
+
+
+def replay_script(trace, speed, app_dir):
+    # runs as its own Streamlit script, so it imports everything itself
+    import asyncio
+    import sys
+    import time
+
+    import streamlit as st
+
+    sys.path.insert(0, app_dir)
+    from astream_events_handler import invoke_our_graph
+    from stream_trace import replay_events
+
+    counted = 0
+
+    async def counting(events):
+        nonlocal counted
+        async for event in events:
+            counted += 1
+            yield event
+
+    start = time.perf_counter()
+    asyncio.run(invoke_our_graph([], st.container(), events=counting(replay_events(trace, speed=speed))))
+    st.session_state.replay_result = (counted, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("trace", help="trace file written with STREAM_TRACE_DIR set")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="playback speed, 1 keeps the recorded timing, 0 replays as fast as possible")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds the replay may take")
+    args = parser.parse_args()
+
+    app = AppTest.from_function(replay_script, args=(os.path.abspath(args.trace), args.speed,
+                                                     os.path.dirname(os.path.abspath(__file__))))
+    app.run(timeout=args.timeout)
+    if app.exception:
+        raise SystemExit("\n".join(app.exception[0].stack_trace))
+    events, elapsed = app.session_state.replay_result
+    print(f"replayed {events} events in {elapsed * 1000:.1f} ms ({events / elapsed:,.0f} events/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+from uuid import UUID
+
+from langchain_core.callbacks.base import BaseCallbackHandler
+from langchain_core.messages import AIMessageChunk, ToolMessage
+from langchain_core.outputs import LLMResult
+
+# astream_events events kept in a trace, everything the handlers render, custom events such as
+# `on_waiting_user_resp` arrive as `on_custom_event` with the custom name in `name`
+RECORDED_EVENTS = {"on_chat_model_stream", "on_tool_start", "on_tool_end", "on_custom_event"}
+
+
+def new_trace_path() -> Optional[str]:
+    """
+    Returns a fresh trace file path in STREAM_TRACE_DIR, or None if recording isn't enabled.
+    Read on every run rather than at import, the apps load their .env after importing the graph.
+    Returns:
+        Optional[str]: Path of the trace file to write for this run.
+    """
+    trace_dir = os.getenv("STREAM_TRACE_DIR")
+    if not trace_dir:
+        return None
+    os.makedirs(trace_dir, exist_ok=True)
+    return os.path.join(trace_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl")
+
+
+def _dump_output(output: Any) -> Any:
+    if isinstance(output, ToolMessage):
+        return {"content": output.content, "name": output.name, "tool_call_id": output.tool_call_id}
+    return output
+
+
+def _load_output(output: Any) -> Any:
+    if isinstance(output, dict) and "tool_call_id" in output:
+        return ToolMessage(**output)
+    return output
+
+
+def dump_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduces an astream_events event to what the handlers read, chunks and tool messages become plain dicts.
+    Events the handlers don't render, e.g. the chain events the metrics time nodes with, keep no data.
+    """
+    record = {"e": event["event"], "n": event.get("name"), "r": str(event.get("run_id"))}
+    if event["event"] == "on_chain_start":  # node runs are told apart by their tags
+        record["g"] = event.get("tags")
+    data = event.get("data") if event["event"] in RECORDED_EVENTS else {}
+    if not isinstance(data, dict):  # custom events carry whatever was dispatched, e.g. a length
+        return {**record, "d": data}
+    data = dict(data)
+    if "chunk" in data and isinstance(data["chunk"], AIMessageChunk):
+        chunk = data["chunk"]
+        data["chunk"] = {"content": chunk.content, "tool_call_chunks": chunk.tool_call_chunks}
+    if "output" in data:
+        data["output"] = _dump_output(data["output"])
+    return {**record, "d": data}
+
+
+def load_event(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turns a record of dump_event back into the event the handlers read.
+    """
+    event = {"event": record["e"], "name": record["n"], "run_id": record["r"], "data": record["d"]}
+    if "g" in record:
+        event["tags"] = record["g"]
+    data = record["d"]
+    if not isinstance(data, dict):
+        return event
+    data = dict(data)
+    if record["e"] == "on_chat_model_stream":
+        data["chunk"] = AIMessageChunk(**data["chunk"])
+    if "output" in data:
+        data["output"] = _load_output(data["output"])
+    event["data"] = data
+    return event
+
+
+class TraceWriter:
+    """
+    Appends timestamped records to a JSON lines trace file, one compact line per event.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializes the TraceWriter.
+        Args:
+            path (str): The trace file to create.
+        """
+        self.path = path
+        self._file = open(path, "w", buffering=1)  # line buffered, traces of hung or crashed runs stay readable
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()  # callbacks of parallel tool calls report from several threads
+
+    def write(self, record: Dict[str, Any]) -> None:
+        with self._lock:  # timestamps under the lock, so they increase down the file
+            record["t"] = round(time.perf_counter() - self._start, 6)  # seconds since the start of the run
+            self._file.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+async def record_events(events: AsyncIterator[Dict[str, Any]], path: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Passes an astream_events stream through unchanged while writing the rendered events to a trace file.
+    Args:
+        events (AsyncIterator[Dict[str, Any]]): The events of `astream_events(..., version="v2")`.
+        path (str): The trace file to write.
+    Returns:
+        AsyncIterator[Dict[str, Any]]: The same events.
+    """
+    writer = TraceWriter(path)
+    try:
+        async for event in events:
+            if event["event"] in RECORDED_EVENTS:
+                writer.write(dump_event(event))
+            yield event
+    finally:
+        writer.close()
+
+
+async def replay_events(path: str, speed: float = 1.0) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yields the events of a trace as astream_events would, to feed them to an events handler without a model.
+    Args:
+        path (str): The trace file written by record_events.
+        speed (float): Playback speed, 1.0 keeps the original timing and 0 replays as fast as possible.
+    Returns:
+        AsyncIterator[Dict[str, Any]]: The recorded events.
+    """
+    start = time.perf_counter()
+    for record in read_trace(path):
+        if speed > 0:
+            delay = record["t"] / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield load_event(record)
+
+
+class TraceRecorder(BaseCallbackHandler):
+    """
+    Callback handler that writes the callbacks a StreamHandler renders to a trace file,
+    add it next to the StreamHandler in the graph's callbacks.
+    """
+
+    run_inline = True  # an async run calls it on the event loop, in order, instead of a thread pool
+
+    def __init__(self, path: str):
+        """
+        Initializes the TraceRecorder.
+        Args:
+            path (str): The trace file to write.
+        """
+        self.writer = TraceWriter(path)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self.writer.write({"e": "on_llm_new_token", "r": str(run_id), "d": {"token": token}})
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.writer.write({"e": "on_llm_end", "r": str(run_id), "d": {}})
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        serialized = {"name": serialized.get("name"), "description": serialized.get("description")}
+        self.writer.write({"e": "on_tool_start", "r": str(run_id),
+                           "d": {"serialized": serialized, "input_str": input_str}})
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.writer.write({"e": "on_tool_end", "r": str(run_id), "d": {"output": _dump_output(output)}})
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                     **kwargs: Any) -> None:
+        if parent_run_id is None:  # the graph run is over
+            self.writer.close()
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       **kwargs: Any) -> None:
+        if parent_run_id is None:
+            self.writer.close()
+
+
+def replay_callbacks(path: str, handler: BaseCallbackHandler, speed: float = 1.0) -> int:
+    """
+    Calls the callbacks of a trace on `handler` in the order and, unless unthrottled, at the pace they were recorded.
+    Args:
+        path (str): The trace file written by TraceRecorder.
+        handler (BaseCallbackHandler): The handler to feed, e.g. the StreamHandler of get_streamlit_cb.
+        speed (float): Playback speed, 1.0 keeps the original timing and 0 replays as fast as possible.
+    Returns:
+        int: The number of callbacks replayed.
+    """
+    start = time.perf_counter()
+    count = 0
+    for record in read_trace(path):
+        if speed > 0:
+            delay = record["t"] / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        kind, run_id, data = record["e"], UUID(record["r"]), record["d"]
+        if kind == "on_llm_new_token":
+            handler.on_llm_new_token(data["token"], run_id=run_id)
+        elif kind == "on_llm_end":
+            handler.on_llm_end(LLMResult(generations=[]), run_id=run_id)
+        elif kind == "on_tool_start":
+            handler.on_tool_start(data["serialized"], data["input_str"], run_id=run_id)
+        elif kind == "on_tool_end":
+            handler.on_tool_end(_load_output(data["output"]), run_id=run_id)
+        count += 1
+    return count